@@ -0,0 +1,295 @@
+"""
+Armazenamento de artefatos endereçado por conteúdo
+Guarda WAVs processados e embeddings pela chave
+sha256(bytes da entrada) + pipeline + configuração + modelo: o mesmo upload
+processado de novo devolve o resultado já salvo.
+
+Layout:
+    <root>/<chave[:2]>/<chave>/manifest.json + arquivos do artefato
+    <root>/.staging/...   diretórios em construção (publicados com rename atômico)
+
+Também limpa diretórios temporários (ex.: tmp/ do lado Node) por idade.
+"""
+
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from embedding_cache import hash_file
+from embedding_format import DEFAULT_MODEL_ID
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STORE_DIR_ENV = "ARTIFACT_STORE_DIR"
+MANIFEST = "manifest.json"
+STAGING = ".staging"
+
+# Incrementar quando o formato do armazenamento mudar
+STORE_VERSION = "1"
+
+# Padrões de arquivos temporários deixados pelo lado Node (src/lib/python-worker.ts)
+TMP_PATTERNS = ("input_*", "output_*", "*.emb.json", "*.proc.wav")
+
+
+def artifact_key(input_hash: str, pipeline: str, config: Optional[Dict] = None, model: str = DEFAULT_MODEL_ID) -> str:
+    """Combina hash da entrada, pipeline, configuração e modelo em uma chave única."""
+    config_json = json.dumps(config or {}, sort_keys=True, separators=(",", ":"))
+    raw = f"{input_hash}|{pipeline}|{model}|{STORE_VERSION}|{config_json}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+class ArtifactStore:
+    """
+    Artefatos imutáveis por chave de conteúdo, com despejo por tamanho e idade.
+
+    Args:
+        root: Diretório do armazenamento
+        max_bytes: Tamanho total máximo
+        max_age: Idade máxima (segundos) de um artefato sem uso
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = 2 * 1024 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._publishes = 0
+        self.last_eviction: Dict = {}
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / STAGING).mkdir(exist_ok=True)
+        self.last_eviction = self.evict()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Retorna o manifest do artefato (com caminhos absolutos em "files") ou None.
+
+        Um artefato só existe depois do rename final, então nunca é visto pela metade.
+        """
+        entry = self._entry_dir(key)
+        try:
+            with open(entry / MANIFEST, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            os.utime(entry)  # marca uso recente para o despejo por idade/LRU
+        except (OSError, ValueError):
+            return None
+        manifest["files"] = {name: str(entry / rel) for name, rel in manifest["files"].items()}
+        return manifest
+
+    def staging_dir(self) -> Path:
+        """Cria um diretório de construção exclusivo (mesmo filesystem do destino)."""
+        path = self.root / STAGING / f"{os.getpid()}-{uuid.uuid4().hex}"
+        path.mkdir(parents=True)
+        return path
+
+    def publish(self, key: str, staging: Path, files: Dict[str, str], metadata: Optional[Dict] = None) -> Dict:
+        """
+        Publica um diretório de construção como o artefato da chave.
+
+        Args:
+            key: Chave do artefato
+            staging: Diretório criado por staging_dir() com os arquivos
+            files: Nome lógico -> nome do arquivo dentro de staging (ex.: {"audio": "audio.wav"})
+            metadata: Campos extras do manifest
+
+        Returns:
+            Manifest publicado (o já existente, se outro job publicou antes)
+        """
+        manifest = {"key": key, "created_at": time.time(), "files": dict(files), "metadata": metadata or {}}
+        with open(staging / MANIFEST, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        entry = self._entry_dir(key)
+        for _ in range(3):
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(staging, entry)  # atômico: o artefato aparece inteiro ou não aparece
+                break
+            except FileNotFoundError:
+                continue  # shard vazio removido por um evict concorrente
+            except OSError:
+                # Outro job publicou a mesma chave primeiro: vale o dele
+                shutil.rmtree(staging, ignore_errors=True)
+                break
+
+        with self._lock:
+            self._publishes += 1
+            evict_now = self._publishes % 16 == 0
+        if evict_now:
+            self.evict()
+        return self.get(key) or dict(manifest, files={n: str(entry / r) for n, r in files.items()})
+
+    def get_or_create(
+        self,
+        key: str,
+        build: Callable[[Path], Tuple[Dict[str, str], Dict]]
+    ) -> Tuple[Dict, bool]:
+        """
+        Retorna o artefato da chave, construindo com build(staging) em caso de miss.
+
+        build recebe o diretório de construção e retorna (files, metadata).
+
+        Returns:
+            Tuple (manifest, hit)
+        """
+        manifest = self.get(key)
+        if manifest is not None:
+            return manifest, True
+
+        staging = self.staging_dir()
+        try:
+            files, metadata = build(staging)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return self.publish(key, staging, files, metadata), False
+
+    def evict(self, staging_max_age: float = 3600) -> Dict:
+        """
+        Remove artefatos sem uso há mais de max_age e, acima de max_bytes,
+        os menos usados recentemente. Diretórios de construção abandonados
+        (job que morreu) também são removidos.
+        """
+        now = time.time()
+        removed = 0
+        entries = []
+        for entry in self.root.glob("??/*"):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+            else:
+                entries.append((st.st_mtime, _dir_size(entry), entry))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        while entries and total > self.max_bytes:
+            _, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+
+        for shard in self.root.glob("??"):
+            try:
+                shard.rmdir()  # só remove shards vazios
+            except OSError:
+                pass
+
+        for staging in (self.root / STAGING).iterdir():
+            try:
+                if now - staging.stat().st_mtime > staging_max_age:
+                    shutil.rmtree(staging, ignore_errors=True)
+            except OSError:
+                continue
+
+        return {"removed": removed, "bytes": total, "entries": len(entries)}
+
+
+def materialize(src: str, dst: str):
+    """
+    Disponibiliza um arquivo do armazenamento em dst (hard link, ou cópia),
+    com rename atômico para quem lê dst nunca ver o arquivo pela metade.
+    """
+    out = Path(dst)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, out)
+
+
+def sweep_tmp(directory: str, max_age: float = 3600, patterns: Sequence[str] = TMP_PATTERNS) -> Dict:
+    """
+    Remove arquivos temporários antigos (por padrão, os input_/output_ do lado Node).
+
+    Returns:
+        Dict com removed e bytes liberados
+    """
+    now = time.time()
+    removed, freed = 0, 0
+    root = Path(directory)
+    if not root.is_dir():
+        return {"removed": 0, "bytes": 0}
+    for path in root.rglob("*"):
+        if not path.is_file() or not any(fnmatch.fnmatch(path.name, p) for p in patterns):
+            continue
+        try:
+            st = path.stat()
+            if now - st.st_mtime > max_age:
+                path.unlink()
+                removed += 1
+                freed += st.st_size
+        except OSError:
+            continue
+    return {"removed": removed, "bytes": freed}
+
+
+_default_store: Optional[ArtifactStore] = None
+
+
+def get_default_store() -> Optional[ArtifactStore]:
+    """Armazenamento do processo, ativado pela variável ARTIFACT_STORE_DIR (None se ausente)."""
+    global _default_store
+    root = os.environ.get(STORE_DIR_ENV)
+    if _default_store is None and root:
+        _default_store = ArtifactStore(root)
+    return _default_store
+
+
+def configure_default_store(root: str, **kwargs) -> ArtifactStore:
+    """Substitui o armazenamento do processo (ex.: --store na CLI)."""
+    global _default_store
+    _default_store = ArtifactStore(root, **kwargs)
+    return _default_store
+
+
+def input_key(input_path: str, pipeline: str, config: Optional[Dict] = None, model: str = DEFAULT_MODEL_ID) -> str:
+    """Chave do artefato para um arquivo de entrada."""
+    return artifact_key(hash_file(input_path), pipeline, config, model)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Armazenamento de artefatos por conteúdo")
+    parser.add_argument("--root", default=os.environ.get(STORE_DIR_ENV), help=f"Diretório do armazenamento (padrão: ${STORE_DIR_ENV})")
+    parser.add_argument("--max-bytes", type=int, default=2 * 1024 * 1024 * 1024, help="Tamanho máximo total")
+    parser.add_argument("--max-age", type=float, default=7 * 24 * 3600, help="Idade máxima sem uso (s)")
+    parser.add_argument("--sweep-tmp", metavar="DIR", help="Remove temporários antigos (input_*, output_*...) deste diretório")
+    parser.add_argument("--tmp-max-age", type=float, default=3600, help="Idade mínima (s) para remover um temporário")
+    args = parser.parse_args()
+
+    output = {}
+    if args.root:
+        store = ArtifactStore(args.root, max_bytes=args.max_bytes, max_age=args.max_age)
+        output["store"] = store.last_eviction
+    if args.sweep_tmp:
+        output["tmp"] = sweep_tmp(args.sweep_tmp, args.tmp_max_age)
+    if not output:
+        parser.error("informe --root e/ou --sweep-tmp")
+    print(json.dumps(output))
@@ -0,0 +1,340 @@
+"""
+Encoder de áudio via pipe do ffmpeg
+Envia PCM float32 direto para o stdin do ffmpeg (sem cópia completa em memória
+nem WAV intermediário) e grava várias saídas em uma única passada:
+MP3 (bitrate escolhido), Opus e FLAC.
+
+Saídas são especificadas como "caminho[:bitrate]", ex.: out.mp3:192k, out.opus:48k, out.flac
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FFMPEG_ENV = "FFMPEG_PATH"
+
+# Formatos suportados: codec, muxer, bitrate padrão
+FORMATS = {
+    "mp3": {"codec": "libmp3lame", "muxer": "mp3", "bitrate": "128k"},
+    "opus": {"codec": "libopus", "muxer": "ogg", "bitrate": "64k"},
+    "flac": {"codec": "flac", "muxer": "flac", "bitrate": None},
+}
+EXTENSIONS = {".mp3": "mp3", ".opus": "opus", ".ogg": "opus", ".flac": "flac"}
+
+# Opus só aceita estas taxas; outras são convertidas para 48kHz
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# Frames por bloco enviado ao pipe (~1.4s a 48kHz)
+BLOCK_FRAMES = 65536
+
+
+def find_ffmpeg() -> str:
+    """Localiza o executável do ffmpeg (FFMPEG_PATH ou PATH)."""
+    path = os.environ.get(FFMPEG_ENV) or shutil.which("ffmpeg")
+    if not path:
+        raise RuntimeError(
+            "ffmpeg não encontrado. Instale (https://ffmpeg.org/download.html) "
+            f"ou defina {FFMPEG_ENV}"
+        )
+    return path
+
+
+def parse_output(spec: str) -> Dict:
+    """
+    Converte "caminho[:bitrate]" em {"path", "format", "bitrate"}.
+
+    O formato vem da extensão (.mp3, .opus/.ogg, .flac).
+    """
+    path, bitrate = spec, None
+    head, sep, tail = spec.rpartition(":")
+    # "C:\\x.mp3" não tem bitrate; "x.mp3:192k" tem
+    if sep and head and Path(head).suffix.lower() in EXTENSIONS and "/" not in tail and "\\" not in tail:
+        path, bitrate = head, tail
+
+    fmt = EXTENSIONS.get(Path(path).suffix.lower())
+    if fmt is None:
+        raise ValueError(f"Formato de saída não suportado: {spec} (use {', '.join(sorted(EXTENSIONS))})")
+    return {"path": path, "format": fmt, "bitrate": bitrate or FORMATS[fmt]["bitrate"]}
+
+
+def _build_command(ffmpeg: str, sr: int, channels: int, outputs: List[Dict], tmp_paths: List[str]) -> List[str]:
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+           "-f", "f32le", "-ar", str(sr), "-ac", str(channels), "-i", "pipe:0"]
+    for out, tmp_path in zip(outputs, tmp_paths):
+        spec = FORMATS[out["format"]]
+        cmd += ["-map", "0:a", "-map_metadata", "-1", "-c:a", spec["codec"]]
+        if out["bitrate"] and out["format"] != "flac":
+            cmd += ["-b:a", out["bitrate"]]
+        if out["format"] == "opus" and sr not in OPUS_SAMPLE_RATES:
+            cmd += ["-ar", "48000"]
+        cmd += ["-f", spec["muxer"], tmp_path]
+    return cmd
+
+
+def encode_stream(
+    blocks: Iterable[np.ndarray],
+    sr: int,
+    outputs: Sequence[str],
+    channels: int = 1
+) -> List[Dict]:
+    """
+    Codifica blocos de PCM (float, frames x canais) para todas as saídas em uma passada.
+
+    Cada saída é gravada em arquivo temporário e publicada com os.replace
+    só se o ffmpeg terminar com sucesso.
+
+    Args:
+        blocks: Iterável de arrays float (mono 1D ou (frames, canais))
+        sr: Sample rate do PCM
+        outputs: Especificações "caminho[:bitrate]"
+        channels: Número de canais do PCM
+
+    Returns:
+        Lista de {"path", "format", "bitrate", "size"} na ordem das saídas
+    """
+    specs = [parse_output(o) for o in outputs]
+    if not specs:
+        raise ValueError("Nenhuma saída informada")
+    duplicates = _duplicate_paths(spec["path"] for spec in specs)
+    if duplicates:
+        raise ValueError(f"Saídas repetidas: {', '.join(duplicates)}")
+
+    ffmpeg = find_ffmpeg()
+    tmp_paths = []
+    for spec in specs:
+        out = Path(spec["path"])
+        out.parent.mkdir(parents=True, exist_ok=True)
+        # Nome único também entre threads do mesmo processo (encode_batch)
+        tmp_paths.append(str(out.with_name(f".{out.name}.{uuid.uuid4().hex}.tmp")))
+
+    cmd = _build_command(ffmpeg, sr, channels, specs, tmp_paths)
+    # stderr vai para arquivo: um pipe cheio travaria o ffmpeg enquanto escrevemos no stdin
+    with tempfile.TemporaryFile() as err:
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err)
+        except OSError:
+            _remove(tmp_paths)
+            raise
+        try:
+            try:
+                for block in blocks:
+                    pcm = np.ascontiguousarray(block, dtype="<f4")
+                    proc.stdin.write(pcm.data)
+            except BrokenPipeError:
+                pass  # ffmpeg saiu antes; o erro real vem no stderr
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            returncode = proc.wait()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            _remove(tmp_paths)
+            raise
+
+        if returncode != 0:
+            _remove(tmp_paths)
+            err.seek(0)
+            message = err.read().decode("utf-8", errors="replace").strip()[-1000:]
+            raise RuntimeError(f"ffmpeg falhou (código {returncode}): {message}")
+
+    results = []
+    for spec, tmp_path in zip(specs, tmp_paths):
+        os.replace(tmp_path, spec["path"])
+        results.append(dict(spec, size=os.path.getsize(spec["path"])))
+    return results
+
+
+def _duplicate_paths(paths: Iterable[str]) -> List[str]:
+    """Caminhos que aparecem mais de uma vez (comparados já normalizados)."""
+    seen, duplicates = set(), []
+    for path in paths:
+        key = os.path.normcase(os.path.abspath(path))
+        if key in seen and path not in duplicates:
+            duplicates.append(path)
+        seen.add(key)
+    return duplicates
+
+
+def _remove(paths: Iterable[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def encode_array(y: np.ndarray, sr: int, outputs: Sequence[str]) -> List[Dict]:
+    """
+    Codifica um áudio já em memória (ex.: saída do preprocess_audio),
+    sem WAV intermediário.
+
+    Args:
+        y: Áudio float, mono (n,) ou multicanal (n, canais)
+        sr: Sample rate
+        outputs: Especificações "caminho[:bitrate]"
+    """
+    channels = 1 if y.ndim == 1 else y.shape[1]
+    blocks = (y[start:start + BLOCK_FRAMES] for start in range(0, len(y), BLOCK_FRAMES))
+    return encode_stream(blocks, sr, outputs, channels=channels)
+
+
+def encode_to_bytes(y: np.ndarray, sr: int, fmt: str = "mp3", bitrate: Optional[str] = None) -> bytes:
+    """
+    Codifica um áudio em memória e devolve os bytes (saída do ffmpeg em pipe:1),
+    sem arquivo de saída.
+
+    Args:
+        y: Áudio float (mono 1D ou (frames, canais))
+        sr: Sample rate
+        fmt: "mp3", "opus" ou "flac"
+        bitrate: Bitrate (padrão do formato se None)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato de saída não suportado: {fmt} (use {', '.join(FORMATS)})")
+    pcm = np.ascontiguousarray(y, dtype="<f4")
+    channels = 1 if pcm.ndim == 1 else pcm.shape[1]
+    spec = {"path": "pipe:1", "format": fmt, "bitrate": bitrate or FORMATS[fmt]["bitrate"]}
+    cmd = _build_command(find_ffmpeg(), sr, channels, [spec], ["pipe:1"])
+    proc = subprocess.run(cmd, input=pcm.tobytes(), capture_output=True)
+    if proc.returncode != 0:
+        message = proc.stderr.decode("utf-8", errors="replace").strip()[-1000:]
+        raise RuntimeError(f"ffmpeg falhou (código {proc.returncode}): {message}")
+    return proc.stdout
+
+
+def encode_file(input_path: str, outputs: Sequence[str], block_frames: int = BLOCK_FRAMES) -> List[Dict]:
+    """
+    Codifica um arquivo de áudio lendo em blocos (memória constante).
+
+    Args:
+        input_path: Arquivo de entrada (WAV/FLAC/OGG, via soundfile)
+        outputs: Especificações "caminho[:bitrate]"
+        block_frames: Frames por bloco lido
+    """
+    import soundfile as sf
+
+    with sf.SoundFile(input_path) as snd:
+        blocks = snd.blocks(blocksize=block_frames, dtype="float32", always_2d=snd.channels > 1)
+        return encode_stream(blocks, snd.samplerate, outputs, channels=snd.channels)
+
+
+def output_specs_for(input_path: str, out_dir: str, formats: Sequence[str]) -> List[str]:
+    """
+    Monta as saídas de um arquivo do lote a partir de formatos "ext[:bitrate]".
+
+    Ex.: ("mp3:192k", "opus") -> ["out/x.mp3:192k", "out/x.opus"]
+    """
+    stem = Path(input_path).stem
+    specs = []
+    for fmt in formats:
+        ext, _, bitrate = fmt.partition(":")
+        path = str(Path(out_dir) / f"{stem}.{ext.lstrip('.')}")
+        specs.append(f"{path}:{bitrate}" if bitrate else path)
+    return specs
+
+
+def encode_batch(
+    input_paths: Sequence[str],
+    out_dir: str,
+    formats: Sequence[str] = ("mp3",),
+    workers: Optional[int] = None
+) -> Dict:
+    """
+    Codifica vários arquivos com paralelismo limitado.
+
+    Cada arquivo é um processo ffmpeg; no máximo `workers` rodam ao mesmo
+    tempo (threads só alimentam os pipes).
+
+    Returns:
+        Dict com "results" (na ordem das entradas) e "summary"
+
+    Raises:
+        ValueError: Entradas com o mesmo nome (ex.: a/x.wav e b/x.wav) gerariam
+            a mesma saída em out_dir
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    outputs_by_input = [output_specs_for(path, out_dir, formats) for path in input_paths]
+    duplicates = _duplicate_paths(parse_output(o)["path"] for specs in outputs_by_input for o in specs)
+    if duplicates:
+        raise ValueError(f"Entradas do lote gerariam a mesma saída: {', '.join(duplicates)}")
+
+    workers = max(1, workers or min(4, os.cpu_count() or 1))
+    started = time.perf_counter()
+
+    def run(index_path):
+        index, input_path = index_path
+        start = time.perf_counter()
+        try:
+            outputs = encode_file(input_path, outputs_by_input[index])
+            return {"index": index, "input": input_path, "status": "ok", "outputs": outputs,
+                    "elapsed_ms": (time.perf_counter() - start) * 1000}
+        except Exception as e:
+            logger.error(f"   ❌ Erro ao codificar {input_path}: {e}")
+            return {"index": index, "input": input_path, "status": "error", "error": str(e) or type(e).__name__,
+                    "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run, enumerate(input_paths)))
+
+    ok = sum(1 for r in results if r["status"] == "ok")
+    return {
+        "results": results,
+        "summary": {
+            "total": len(results),
+            "ok": ok,
+            "failed": len(results) - ok,
+            "workers": workers,
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
+        },
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description="Codifica áudio para MP3/Opus/FLAC via pipe do ffmpeg")
+    parser.add_argument("--input", help="Arquivo de entrada")
+    parser.add_argument("--output", nargs='+', default=[], metavar="CAMINHO[:BITRATE]",
+                        help="Saídas (ex.: out.mp3:192k out.opus out.flac)")
+    parser.add_argument("--inputs", nargs='+', help="Modo lote: vários arquivos de entrada")
+    parser.add_argument("--out-dir", help="Modo lote: diretório de saída")
+    parser.add_argument("--formats", nargs='+', default=["mp3"], metavar="EXT[:BITRATE]",
+                        help="Modo lote: formatos (padrão: mp3)")
+    parser.add_argument("--workers", type=int, help="Modo lote: conversões simultâneas (padrão: min(4, CPUs))")
+    args = parser.parse_args()
+
+    if args.inputs:
+        if not args.out_dir:
+            parser.error("--out-dir é obrigatório com --inputs")
+        try:
+            report = encode_batch(args.inputs, args.out_dir, args.formats, args.workers)
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(report))
+        sys.exit(0 if report["summary"]["failed"] == 0 else 1)
+
+    if not args.input or not args.output:
+        parser.error("informe --input e --output (ou --inputs/--out-dir)")
+    try:
+        print(json.dumps({"outputs": encode_file(args.input, args.output)}))
+    except Exception as e:
+        print(f"❌ Erro ao codificar: {e}", file=sys.stderr)
+        sys.exit(1)
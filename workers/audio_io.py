@@ -0,0 +1,203 @@
+"""
+Entrada/saída de áudio sem arquivos temporários
+Aceita como fonte um caminho, "-" (bytes no stdin), uma data URL
+(data:audio/...;base64,...) ou bytes, e decodifica direto da memória.
+O áudio processado pode voltar como data URL no JSON de saída.
+
+Formatos que o libsndfile não lê (ex.: m4a) são decodificados pelo ffmpeg via pipe.
+"""
+
+import base64
+import io
+import re
+import subprocess
+import sys
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+# Fonte de áudio: caminho, "-" (stdin), data URL ou bytes já em memória
+AudioSource = Union[str, bytes]
+
+STDIN = "-"
+
+MIME_TYPES = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "ogg": "audio/ogg",
+    "opus": "audio/ogg",
+    "mp3": "audio/mpeg",
+}
+
+_DATA_URL = re.compile(r"^data:(?P<mime>[\w/+.-]*)(?P<params>(;[^;,]*)*?),(?P<data>.*)$", re.DOTALL)
+
+
+def is_data_url(value) -> bool:
+    return isinstance(value, str) and value.startswith("data:")
+
+
+def parse_data_url(url: str) -> Tuple[str, bytes]:
+    """
+    Decodifica uma data URL.
+
+    Returns:
+        Tuple (mime, bytes)
+    """
+    match = _DATA_URL.match(url)
+    if not match:
+        raise ValueError("Data URL inválida")
+    if ";base64" not in match.group("params"):
+        raise ValueError("Data URL de áudio precisa ser base64")
+    return match.group("mime") or "application/octet-stream", base64.b64decode(match.group("data"))
+
+
+def to_data_url(data: bytes, mime: str = "audio/wav") -> str:
+    return f"data:{mime};base64," + base64.b64encode(data).decode("ascii")
+
+
+def read_source(source: AudioSource) -> AudioSource:
+    """
+    Resolve a fonte: "-" lê o stdin inteiro, data URL vira bytes; caminhos
+    e bytes passam direto.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if source == STDIN:
+        return sys.stdin.buffer.read()
+    if is_data_url(source):
+        return parse_data_url(source)[1]
+    return source
+
+
+def decode_param(value: str) -> bytes:
+    """Áudio em parâmetro do protocolo do daemon: data URL ou base64 puro."""
+    if is_data_url(value):
+        return parse_data_url(value)[1]
+    return base64.b64decode(value)
+
+
+def source_hash(source: AudioSource) -> str:
+    """Hash do conteúdo (mesma chave para o arquivo e para os seus bytes)."""
+    from embedding_cache import hash_bytes, hash_file
+
+    source = read_source(source)
+    return hash_bytes(source) if isinstance(source, bytes) else hash_file(source)
+
+
+def describe_source(source: AudioSource) -> str:
+    """Texto curto para logs (não despeja bytes no log)."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f"<{len(source)} bytes em memória>"
+    if is_data_url(source):
+        return "<data URL>"
+    return "<stdin>" if source == STDIN else source
+
+
+def _probe_ffmpeg(ffmpeg: str, data: bytes) -> Tuple[int, int]:
+    """Taxa e número de canais do primeiro stream de áudio (saída do ffmpeg -i)."""
+    probe = subprocess.run([ffmpeg, "-hide_banner", "-nostdin", "-i", "pipe:0", "-f", "null", "-"],
+                           input=data, capture_output=True)
+    match = re.search(rb"Audio: [^\n]*?(\d+) Hz, (mono|stereo|(\d+) channels)?", probe.stderr)
+    if not match:
+        raise RuntimeError("ffmpeg não reconheceu o áudio")
+    layout = match.group(2)
+    channels = 1 if layout == b"mono" else int(match.group(3)) if match.group(3) else 2
+    return int(match.group(1)), channels
+
+
+def _decode_ffmpeg(data: bytes, sr: Optional[int], mono: bool) -> Tuple[np.ndarray, int]:
+    from audio_encoder import find_ffmpeg
+
+    ffmpeg = find_ffmpeg()
+    native_sr, channels = _probe_ffmpeg(ffmpeg, data)
+    sr = sr or native_sr
+    channels = 1 if mono else channels
+
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-i", "pipe:0",
+           "-f", "f32le", "-ar", str(sr), "-ac", str(channels), "pipe:1"]
+    proc = subprocess.run(cmd, input=data, capture_output=True)
+    if proc.returncode != 0:
+        message = proc.stderr.decode("utf-8", errors="replace").strip()[-1000:]
+        raise RuntimeError(f"ffmpeg falhou (código {proc.returncode}): {message}")
+    y = np.frombuffer(proc.stdout, dtype="<f4").copy()
+    return (y if mono else y.reshape(-1, channels)), sr
+
+
+def decode_audio(data: bytes, sr: Optional[int] = None, mono: bool = True) -> Tuple[np.ndarray, int]:
+    """
+    Decodifica áudio codificado (WAV/FLAC/OGG/MP3...) direto da memória.
+
+    Args:
+        data: Bytes do arquivo de áudio
+        sr: Reamostra para esta taxa (None = taxa original)
+        mono: Mistura os canais (como librosa.load)
+
+    Returns:
+        Tuple (áudio float32, sample rate); (frames, canais) quando mono=False
+    """
+    import soundfile as sf
+
+    try:
+        y, native_sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    except (RuntimeError, sf.LibsndfileError):
+        return _decode_ffmpeg(data, sr, mono)
+
+    y = y.mean(axis=1) if mono else y
+    if sr is not None and sr != native_sr:
+        import librosa
+        y = librosa.resample(y.T if not mono else y, orig_sr=native_sr, target_sr=sr)
+        y = y if mono else y.T
+        native_sr = sr
+    return np.ascontiguousarray(y, dtype=np.float32), native_sr
+
+
+def load_audio(source: AudioSource, sr: Optional[int] = None) -> Tuple[np.ndarray, int]:
+    """
+    Carrega áudio mono float32 de qualquer fonte.
+
+    Caminhos continuam passando por librosa.load (mesmo resultado de antes);
+    stdin, data URL e bytes são decodificados em memória.
+    """
+    source = read_source(source)
+    if isinstance(source, bytes):
+        return decode_audio(source, sr)
+    import librosa
+    return librosa.load(source, sr=sr)
+
+
+def encode_audio_bytes(y: np.ndarray, sr: int, fmt: str = "wav") -> bytes:
+    """
+    Codifica áudio em memória: wav (PCM_16) e flac pelo libsndfile; mp3/opus pelo ffmpeg.
+    """
+    if fmt in ("wav", "flac"):
+        import soundfile as sf
+        buf = io.BytesIO()
+        sf.write(buf, y, sr, format=fmt.upper(), subtype="PCM_16")
+        return buf.getvalue()
+    from audio_encoder import encode_to_bytes
+    return encode_to_bytes(y, sr, fmt)
+
+
+def audio_payload(y: np.ndarray, sr: int, fmt: str = "wav") -> Dict:
+    """Áudio para o JSON de saída: {"format", "sample_rate", "data_url"}."""
+    data = encode_audio_bytes(y, sr, fmt)
+    return {"format": fmt, "sample_rate": sr, "bytes": len(data),
+            "data_url": to_data_url(data, MIME_TYPES.get(fmt, "application/octet-stream"))}
+
+
+@contextmanager
+def reserved_stdout():
+    """
+    Reserva o stdout para o resultado: prints de bibliotecas (ex.: "Loaded the
+    voice encoder model...") vão para stderr enquanto o bloco roda.
+
+    Yields:
+        O stdout original, para escrever o resultado
+    """
+    original = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        yield original
+    finally:
+        sys.stdout = original
@@ -9,15 +9,20 @@ Etapas:
 4. Redução de ruído (noisereduce)
 5. Bandpass filter
 6. Trim de silêncio
+
+As etapas são as do preset "studio" de pipeline (resample e bandpass pela
+cadeia pré-compilada de dsp_chain).
+librosa, soundfile, noisereduce e scipy só são importados quando usados.
 """
 
-import librosa
-import soundfile as sf
-import noisereduce as nr
 import numpy as np
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 import logging
+import os
+import time
+
+from instrumentation import StageProfiler, get_profiler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,89 +30,162 @@ logger = logging.getLogger(__name__)
 
 def preprocess_audio(
     input_path: str,
-    output_path: str,
+    output_path: Optional[str],
     target_sr: int = 24000,
     normalize_rms: bool = True,
     reduce_noise: bool = True,
     apply_bandpass: bool = True,
     trim_silence: bool = True,
-    top_db: int = 25
-) -> Tuple[str, dict]:
+    top_db: int = 25,
+    streaming: bool = False,
+    memory_budget_mb: float = 64,
+    profiler: Optional[StageProfiler] = None,
+    encode: Optional[Sequence[str]] = None,
+    low_memory: bool = False,
+    noise_profile: Optional[str] = None,
+    target_rms: float = 0.1,
+    stage_cache=None
+) -> Tuple[Optional[str], dict]:
     """
     Pré-processa áudio seguindo pipeline profissional do Fish AI.
     
     Args:
         input_path: Caminho do áudio de entrada
-        output_path: Caminho do áudio processado
+        output_path: Caminho do áudio processado (None = não grava WAV; exige encode)
         target_sr: Sample rate alvo (24000 ou 22050)
         normalize_rms: Normalizar RMS
         reduce_noise: Reduzir ruído
         apply_bandpass: Aplicar filtro bandpass
         trim_silence: Remover silêncio inicial/final
         top_db: Threshold para trim (dB)
+        streaming: Processar em blocos com memória limitada (áudios longos); não
+            combina com encode, low_memory, noise_profile, profiler nem stage_cache
+        memory_budget_mb: Orçamento de memória do modo streaming
+        profiler: Instrumentação por etapa (opt-in); as métricas vão em metadata['stages']
+        encode: Saídas codificadas direto do áudio em memória, "caminho[:bitrate]"
+            (ex.: ["out.mp3:192k", "out.opus"]); ver audio_encoder
+        low_memory: Mantém float32 do começo ao fim, normaliza e filtra in-place
+            reaproveitando buffers de trabalho; o pico de alocação vai em
+            metadata['peak_bytes']
+        noise_profile: Id do clone/sessão: denoise estacionário com o perfil de
+            ruído salvo (criado na primeira amostra); ver noise_profile
+        target_rms: RMS alvo da normalização
+        stage_cache: pipeline.StageCache: reaproveita as etapas já calculadas para
+            a mesma entrada e configuração (só reexecuta a partir da que mudou)
     
     Returns:
         Tuple (output_path, metadata)
+
+    Raises:
+        ValueError: Sem saída, ou streaming combinado com opção não suportada
     """
+    if output_path is None and not encode:
+        raise ValueError("Informe output_path e/ou encode")
+    
+    if streaming:
+        if output_path is None:
+            raise ValueError("O modo streaming grava em output_path")
+        unsupported = [name for name, value in (
+            ("encode", encode), ("low_memory", low_memory), ("noise_profile", noise_profile),
+            ("profiler", profiler), ("stage_cache", stage_cache)
+        ) if value]
+        if unsupported:
+            raise ValueError(f"Opções não suportadas no modo streaming: {', '.join(unsupported)}")
+        from streaming_preprocessor import preprocess_audio_streaming
+        return preprocess_audio_streaming(
+            input_path, output_path,
+            target_sr=target_sr,
+            normalize_rms=normalize_rms,
+            reduce_noise=reduce_noise,
+            apply_bandpass=apply_bandpass,
+            trim_silence=trim_silence,
+            top_db=top_db,
+            target_rms=target_rms,
+            memory_budget_mb=memory_budget_mb
+        )
+    
+    if low_memory:
+        from instrumentation import track_peak
+        # Imports fora da medição: o pico reportado é só o do processamento
+        import librosa.effects  # noqa: F401
+        import soundfile  # noqa: F401
+        import dsp_chain  # noqa: F401
+        import pipeline  # noqa: F401
+        if reduce_noise:
+            import noisereduce  # noqa: F401
+        with track_peak() as memory:
+            output_path, metadata = _preprocess_audio(
+                input_path, output_path, target_sr, normalize_rms, reduce_noise,
+                apply_bandpass, trim_silence, top_db, profiler, encode, low_memory, noise_profile,
+                target_rms, stage_cache
+            )
+        metadata['peak_bytes'] = memory['peak_bytes']
+        logger.info(f"   📊 Pico de memória: {memory['peak_bytes'] / 1e6:.1f} MB")
+        return output_path, metadata
+    
+    return _preprocess_audio(
+        input_path, output_path, target_sr, normalize_rms, reduce_noise,
+        apply_bandpass, trim_silence, top_db, profiler, encode, low_memory, noise_profile,
+        target_rms, stage_cache
+    )
+
+
+def _preprocess_audio(
+    input_path: str,
+    output_path: Optional[str],
+    target_sr: int,
+    normalize_rms: bool,
+    reduce_noise: bool,
+    apply_bandpass: bool,
+    trim_silence: bool,
+    top_db: int,
+    profiler: Optional[StageProfiler],
+    encode: Optional[Sequence[str]],
+    low_memory: bool,
+    noise_profile: Optional[str],
+    target_rms: float = 0.1,
+    stage_cache=None
+) -> Tuple[Optional[str], dict]:
+    import soundfile as sf
+    from dsp_chain import get_workspace
+    from pipeline import build_pipeline
+    
     logger.info(f"🎵 Iniciando pré-processamento: {input_path}")
+    prof = get_profiler(profiler)
+    # Buffers reaproveitados entre etapas (e entre chamadas no worker persistente)
+    workspace = get_workspace() if low_memory else None
+    
+    # Etapas do preset "studio"; as desativadas saem do pipeline
+    overrides = {
+        "normalize": {"target_rms": target_rms} if normalize_rms else None,
+        "denoise": ({"noise_profile": noise_profile} if noise_profile else {}) if reduce_noise else None,
+        "bandpass": {} if apply_bandpass else None,
+        "trim": {"top_db": top_db} if trim_silence else None,
+    }
+    pipeline = build_pipeline("studio", target_sr, overrides)
     
     try:
-        # 1. Carregar áudio (preserva sample rate original)
-        y, sr = librosa.load(input_path, sr=None, mono=False)
-        logger.info(f"   📊 Áudio original: {sr}Hz, {len(y) if isinstance(y, np.ndarray) else len(y[0])} samples")
-        
-        # 2. Converter para mono se estéreo
-        if len(y.shape) > 1:
-            y = librosa.to_mono(y)
-            logger.info("   ✅ Convertido para mono")
-        
-        # 3. Resample para target_sr
-        if sr != target_sr:
-            y = librosa.resample(y, orig_sr=sr, target_sr=target_sr)
-            logger.info(f"   ✅ Resampleado para {target_sr}Hz")
-        
-        # 4. Normalização RMS (garante volume consistente)
-        if normalize_rms:
-            rms = np.sqrt(np.mean(y**2))
-            if rms > 0:
-                target_rms = 0.1  # RMS alvo (ajustável)
-                y = y * (target_rms / rms)
-                logger.info(f"   ✅ Normalizado RMS: {rms:.4f} → {target_rms:.4f}")
-        
-        # 5. Redução de ruído (noisereduce)
-        if reduce_noise:
-            try:
-                y = nr.reduce_noise(y=y, sr=target_sr, stationary=False)
-                logger.info("   ✅ Ruído reduzido")
-            except Exception as e:
-                logger.warning(f"   ⚠️ Erro na redução de ruído: {e}")
-        
-        # 6. Bandpass filter (remove frequências muito baixas/altas)
-        if apply_bandpass:
-            from scipy import signal
-            # Filtro passa-banda: 80Hz - 8000Hz (voz humana)
-            nyquist = target_sr / 2
-            low = 80 / nyquist
-            high = 8000 / nyquist
-            b, a = signal.butter(4, [low, high], btype='band')
-            y = signal.filtfilt(b, a, y)
-            logger.info("   ✅ Filtro bandpass aplicado (80Hz-8kHz)")
-        
-        # 7. Trim de silêncio (remove silêncio inicial/final)
-        if trim_silence:
-            y_trimmed, _ = librosa.effects.trim(y, top_db=top_db)
-            original_length = len(y)
-            trimmed_length = len(y_trimmed)
-            if trimmed_length < original_length:
-                y = y_trimmed
-                logger.info(f"   ✅ Silêncio removido: {original_length} → {trimmed_length} samples")
+        # 1-7. Carregar, mono, resample, normalizar, denoise, bandpass e trim
+        y, _, info = pipeline.run(input_path, profiler=prof, cache=stage_cache, workspace=workspace)
+        sr = info["original_sr"]
+        denoise_info = info.get("denoise")
         
         # 8. Salvar áudio processado
-        output_path_obj = Path(output_path)
-        output_path_obj.parent.mkdir(parents=True, exist_ok=True)
+        if output_path is not None:
+            output_path_obj = Path(output_path)
+            output_path_obj.parent.mkdir(parents=True, exist_ok=True)
+            
+            with prof.stage("write"):
+                sf.write(output_path, y, target_sr, subtype='PCM_16')
+            logger.info(f"   ✅ Áudio salvo: {output_path}")
         
-        sf.write(output_path, y, target_sr, subtype='PCM_16')
-        logger.info(f"   ✅ Áudio salvo: {output_path}")
+        # 9. Codificar saídas (MP3/Opus/FLAC) direto do array, sem WAV intermediário
+        encoded = None
+        if encode:
+            from audio_encoder import encode_array
+            with prof.stage("encode"):
+                encoded = encode_array(y, target_sr, encode)
+            logger.info(f"   ✅ Codificado: {', '.join(e['path'] for e in encoded)}")
         
         # Metadata
         duration = len(y) / target_sr
@@ -116,8 +194,20 @@ def preprocess_audio(
             'target_sr': target_sr,
             'duration': duration,
             'samples': len(y),
-            'file_size': Path(output_path).stat().st_size
         }
+        if denoise_info is not None:
+            metadata['denoise'] = denoise_info
+        if 'cache' in info:
+            metadata['stage_cache'] = info['cache']
+        if low_memory:
+            metadata['low_memory'] = True
+            metadata['workspace_bytes'] = workspace.nbytes
+        if output_path is not None:
+            metadata['file_size'] = Path(output_path).stat().st_size
+        if encoded is not None:
+            metadata['encoded'] = encoded
+        if prof.enabled:
+            metadata['stages'] = prof.as_list()
         
         logger.info(f"   ✅ Pré-processamento concluído: {duration:.2f}s")
         return output_path, metadata
@@ -161,16 +251,255 @@ def batch_preprocess(
     return results
 
 
+def _init_batch_worker():
+    """Inicializa cada processo do pool: importa a pilha pesada uma única vez."""
+    import librosa.effects  # noqa: F401
+    import noisereduce  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import soundfile  # noqa: F401
+
+
+def _preprocess_chunk(items: List[Tuple[int, str, str]], kwargs: dict) -> List[dict]:
+    """Processa um lote de arquivos dentro de um worker do pool."""
+    results = []
+    for index, input_path, output_path in items:
+        start = time.perf_counter()
+        try:
+            _, metadata = preprocess_audio(input_path, output_path, **kwargs)
+            results.append({
+                "index": index,
+                "input": input_path,
+                "output": output_path,
+                "status": "ok",
+                "metadata": metadata,
+                "elapsed": time.perf_counter() - start
+            })
+        except Exception as e:
+            results.append({
+                "index": index,
+                "input": input_path,
+                "output": None,
+                "status": "error",
+                "error": str(e) or type(e).__name__,
+                "elapsed": time.perf_counter() - start
+            })
+    return results
+
+
+def _worker_pid() -> int:
+    time.sleep(0.01)  # espalha as chamadas entre os processos
+    return os.getpid()
+
+
+def _start_pool(workers: int):
+    """
+    Cria o pool e espera todos os processos terminarem a inicialização,
+    para que o import das bibliotecas não conte no timeout por arquivo.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker)
+    ready = set()
+    for _ in range(20):
+        ready.update(f.result() for f in [executor.submit(_worker_pid) for _ in range(workers)])
+        if len(ready) >= workers:
+            break
+    return executor
+
+
+def _terminate_pool(executor):
+    """Encerra o pool matando os processos (necessário para abortar arquivos travados)."""
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def _output_names(input_paths: Sequence[str]) -> List[str]:
+    """
+    Nomes de saída únicos mesmo com stems repetidos (a/x.wav, b/x.wav) e
+    com um stem igual ao nome gerado para outro (x_2.wav): o índice entra
+    no nome e, se ainda colidir, um contador. A comparação ignora maiúsculas
+    (sistemas de arquivos do Windows/macOS).
+    """
+    names = []
+    used = set()
+    for index, input_path in enumerate(input_paths):
+        stem = Path(input_path).stem
+        name = f"{stem}_processed.wav"
+        suffix = 0
+        while name.lower() in used:
+            name = f"{stem}_{index}{f'_{suffix}' if suffix else ''}_processed.wav"
+            suffix += 1
+        used.add(name.lower())
+        names.append(name)
+    return names
+
+
+def batch_preprocess_parallel(
+    input_paths: Sequence[str],
+    output_dir: str,
+    workers: Optional[int] = None,
+    chunksize: int = 1,
+    timeout: Optional[float] = None,
+    **kwargs
+) -> Dict:
+    """
+    Pré-processa múltiplos áudios em paralelo com um pool de processos.
+    
+    Args:
+        input_paths: Lista de caminhos de entrada
+        output_dir: Diretório de saída
+        workers: Número de processos (padrão: número de CPUs)
+        chunksize: Arquivos enviados por tarefa a cada worker
+        timeout: Tempo máximo por arquivo em segundos (None = sem limite)
+        **kwargs: Argumentos para preprocess_audio
+    
+    Returns:
+        Dict com:
+            - "results": um item por entrada, na ordem de entrada, com
+              "status" ("ok", "error" ou "timeout") e "metadata" ou "error"
+            - "summary": totais e throughput (arquivos/s, segundos de áudio/s)
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+    
+    workers = max(1, workers or os.cpu_count() or 1)
+    chunksize = max(1, chunksize)
+    output_dir_obj = Path(output_dir)
+    output_dir_obj.mkdir(parents=True, exist_ok=True)
+    
+    items = [(index, str(input_path), str(output_dir_obj / name))
+             for index, (input_path, name) in enumerate(zip(input_paths, _output_names(input_paths)))]
+    
+    # (itens, tentativas): um lote derrubado junto com um pool abortado é reenviado uma vez
+    pending = [(items[i:i + chunksize], 0) for i in range(0, len(items), chunksize)]
+    pending.reverse()
+    results: List[Optional[dict]] = [None] * len(items)
+    
+    def fail(chunk, status, error):
+        for index, input_path, _ in chunk:
+            results[index] = {"index": index, "input": input_path, "output": None,
+                              "status": status, "error": error, "elapsed": None}
+    
+    logger.info(f"🚀 Lote paralelo: {len(items)} arquivos, {workers} workers, chunksize {chunksize}")
+    start = time.perf_counter()
+    executor = _start_pool(workers)
+    in_flight = {}
+    try:
+        while pending or in_flight:
+            # Janela de envio = número de workers, então cada tarefa começa ao ser enviada
+            while pending and len(in_flight) < workers:
+                chunk, attempts = pending.pop()
+                future = executor.submit(_preprocess_chunk, chunk, kwargs)
+                deadline = time.monotonic() + timeout * len(chunk) if timeout else None
+                in_flight[future] = (chunk, attempts, deadline)
+            
+            deadlines = [d for _, _, d in in_flight.values() if d is not None]
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            done, _ = wait(in_flight, timeout=wait_for, return_when=FIRST_COMPLETED)
+            
+            broken = False
+            for future in done:
+                chunk, attempts, _ = in_flight.pop(future)
+                try:
+                    for item in future.result():
+                        results[item["index"]] = item
+                except BrokenProcessPool:
+                    broken = True
+                    if attempts == 0:
+                        pending.append((chunk, 1))
+                    else:
+                        fail(chunk, "error", "Worker encerrado inesperadamente")
+                except Exception as e:
+                    fail(chunk, "error", str(e))
+            
+            now = time.monotonic()
+            expired = [f for f, (_, _, d) in in_flight.items() if d is not None and now >= d]
+            if expired or broken:
+                # Não dá para interromper um único worker: aborta o pool e reenvia o restante
+                for future in expired:
+                    chunk, _, _ = in_flight.pop(future)
+                    logger.error(f"   ❌ Timeout ao processar: {[path for _, path, _ in chunk]}")
+                    fail(chunk, "timeout", f"Tempo limite de {timeout}s por arquivo excedido")
+                for chunk, attempts, _ in in_flight.values():
+                    pending.append((chunk, attempts))
+                in_flight.clear()
+                _terminate_pool(executor)
+                executor = _start_pool(workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if r["status"] == "ok"]
+    audio_seconds = sum(r["metadata"]["duration"] for r in ok)
+    summary = {
+        "total": len(results),
+        "ok": len(ok),
+        "failed": sum(1 for r in results if r["status"] == "error"),
+        "timeouts": sum(1 for r in results if r["status"] == "timeout"),
+        "workers": workers,
+        "elapsed": elapsed,
+        "files_per_second": len(results) / elapsed if elapsed > 0 else 0.0,
+        "audio_seconds": audio_seconds,
+        "realtime_factor": audio_seconds / elapsed if elapsed > 0 else 0.0
+    }
+    logger.info(f"   ✅ Lote concluído: {summary['ok']}/{summary['total']} em {elapsed:.2f}s "
+                f"({summary['files_per_second']:.2f} arquivos/s)")
+    return {"results": results, "summary": summary}
+
+
 if __name__ == "__main__":
-    # Teste
+    import argparse
+    import json
     import sys
     
-    if len(sys.argv) < 3:
+    parser = argparse.ArgumentParser(description="Pré-processamento de áudio profissional")
+    parser.add_argument("paths", nargs="*", help="<input> <output>, ou as entradas no modo --batch")
+    parser.add_argument("--batch", metavar="OUTPUT_DIR", help="Processa várias entradas em paralelo neste diretório")
+    parser.add_argument("--workers", type=int, default=None, help="Processos no modo lote (padrão: CPUs)")
+    parser.add_argument("--chunksize", type=int, default=1, help="Arquivos por tarefa no modo lote (padrão: 1)")
+    parser.add_argument("--timeout", type=float, default=None, help="Tempo máximo por arquivo em segundos")
+    parser.add_argument("--profile", action="store_true", help="Mede tempo/CPU/memória por etapa")
+    parser.add_argument("--metrics-out", help="Exporta as métricas por etapa (.prom = Prometheus, senão JSON lines)")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="float32 do começo ao fim, operações in-place e buffers reaproveitados (pico em peak_bytes)")
+    parser.add_argument("--noise-profile", metavar="ID",
+                        help="Id do clone/sessão: reaproveita o perfil de ruído (denoise estacionário)")
+    parser.add_argument("--noise-profile-dir", help="Diretório dos perfis de ruído (padrão: $NOISE_PROFILE_DIR)")
+    parser.add_argument("--encode", nargs='+', metavar="CAMINHO[:BITRATE]",
+                        help="Também codifica o resultado (ex.: out.mp3:192k out.opus); com --encode o <output> WAV é opcional")
+    args = parser.parse_args()
+    
+    if args.noise_profile_dir:
+        from noise_profile import configure_default_store
+        configure_default_store(args.noise_profile_dir)
+    
+    if args.batch:
+        report = batch_preprocess_parallel(
+            args.paths, args.batch,
+            workers=args.workers, chunksize=args.chunksize, timeout=args.timeout,
+            low_memory=args.low_memory, noise_profile=args.noise_profile
+        )
+        print(json.dumps(report))
+        sys.exit(0 if report["summary"]["ok"] == report["summary"]["total"] else 1)
+    
+    if len(args.paths) < (1 if args.encode else 2):
         print("Uso: python audio_preprocessor.py <input> <output>")
         sys.exit(1)
     
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    input_path = args.paths[0]
+    output_path = args.paths[1] if len(args.paths) > 1 else None
     
-    preprocess_audio(input_path, output_path)
-
+    profiler = None
+    if args.profile or args.metrics_out:
+        profiler = StageProfiler(labels={"pipeline": "studio"})
+    
+    _, metadata = preprocess_audio(input_path, output_path, profiler=profiler, encode=args.encode,
+                                   low_memory=args.low_memory, noise_profile=args.noise_profile)
+    
+    if profiler or args.encode or args.low_memory or args.noise_profile:
+        if args.metrics_out:
+            profiler.export(args.metrics_out)
+        print(json.dumps(metadata))
@@ -0,0 +1,418 @@
+"""
+Benchmark reprodutível do pipeline de workers
+Gera sinais sintéticos determinísticos (fala sintética e ruído) e mede
+latência/throughput de cada etapa, gravando um baseline em JSON.
+
+Uso:
+    python benchmark.py --output baseline.json
+    python benchmark.py --quick --compare baseline.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import soundfile as sf
+
+from instrumentation import StageProfiler
+from synthetic_signals import synth_noise, synth_speech
+
+BENCHMARK_VERSION = 1
+WORKERS_DIR = Path(__file__).resolve().parent
+
+# Matriz padrão (completa) e reduzida (--quick)
+FULL_CONFIG = {"durations": [2.0, 10.0, 30.0], "sample_rates": [16000, 44100, 48000],
+               "repeats": 5, "batch_clips": 16, "combine_count": 8}
+QUICK_CONFIG = {"durations": [2.0, 10.0], "sample_rates": [44100],
+                "repeats": 3, "batch_clips": 4, "combine_count": 4}
+
+SUITES = ("startup", "preprocess", "embed", "combine", "validate", "cli")
+
+# Orçamento de inicialização (ms) de cada entry point: `--help` não pode
+# carregar a pilha de ML (torch, noisereduce, modelo)
+STARTUP_BUDGETS_MS = {
+    "preprocess_and_embed.py": 1500,
+    "validate_generation.py": 1500,
+    "audio_preprocessor.py": 1500,
+    "combine_embeddings.py": 1000,
+    "embedding_format.py": 1000,
+    "embedding_index.py": 1000,
+    "streaming_preprocessor.py": 1500,
+    "worker_daemon.py": 1000,
+    "benchmark.py": 1500,
+    "audio_encoder.py": 1000,
+    "convert_wav_to_mp3.py": 1000,
+    "vad.py": 1000,
+    "voice_aggregate.py": 1000,
+    "job_queue.py": 1000,
+    "artifact_store.py": 1000,
+    "noise_profile.py": 1000,
+    "streaming_validation.py": 1500,
+    "pipeline.py": 1000,
+    "encoder_pool.py": 1000,
+    "encoder_backend.py": 1000,
+}
+
+
+# ---------------------------------------------------------------------------
+# Sinais sintéticos (geradores em synthetic_signals)
+# ---------------------------------------------------------------------------
+
+def write_signal(path: Path, y: np.ndarray, sr: int) -> str:
+    sf.write(str(path), y, samplerate=sr, subtype="PCM_16")
+    return str(path)
+
+
+# ---------------------------------------------------------------------------
+# Medição
+# ---------------------------------------------------------------------------
+
+def summarize(samples_ms: Sequence[float], audio_seconds: Optional[float] = None, items: int = 1) -> Dict:
+    """Estatísticas de uma série de medições (ms)."""
+    ordered = sorted(samples_ms)
+    median = statistics.median(ordered)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    result = {
+        "median_ms": median,
+        "p95_ms": p95,
+        "min_ms": ordered[0],
+        "mean_ms": statistics.fmean(ordered),
+        "runs": len(ordered),
+    }
+    if median > 0:
+        result["items_per_s"] = items * 1000.0 / median
+        if audio_seconds:
+            # Segundos de áudio processados por segundo de parede
+            result["realtime_factor"] = audio_seconds * 1000.0 / median
+    return result
+
+
+def time_call(fn: Callable, repeats: int, warmup: int = 1) -> List[float]:
+    """Executa fn() warmup + repeats vezes e retorna os tempos (ms) das repetições."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+# ---------------------------------------------------------------------------
+# Suítes
+# ---------------------------------------------------------------------------
+
+def bench_startup(work: Path, config: Dict) -> Dict:
+    """Tempo até o `--help` de cada CLI, comparado com STARTUP_BUDGETS_MS."""
+    results = {}
+    repeats = max(3, config["repeats"])
+    for script, budget in STARTUP_BUDGETS_MS.items():
+        cmd = [sys.executable, script, "--help"]
+        samples = time_call(
+            lambda: subprocess.run(cmd, cwd=str(WORKERS_DIR), stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, check=True),
+            repeats
+        )
+        stats = summarize(samples)
+        stats["budget_ms"] = budget
+        stats["within_budget"] = stats["median_ms"] <= budget
+        results[f"startup.{script}"] = stats
+    return results
+
+
+def bench_preprocess(work: Path, config: Dict) -> Dict:
+    """Latência por etapa do pipeline "studio" (audio_preprocessor)."""
+    from audio_preprocessor import preprocess_audio
+
+    results = {}
+    for sr in config["sample_rates"]:
+        for seconds in config["durations"]:
+            label = f"{seconds:g}s@{sr}"
+            # Fala com ruído de fundo (exercita o denoise)
+            y = synth_speech(seconds, sr, seed=1) + 0.3 * synth_noise(seconds, sr, seed=1)
+            in_path = write_signal(work / f"speech_{label}.wav", y, sr)
+            out_path = str(work / f"speech_{label}.proc.wav")
+
+            stage_samples: Dict[str, List[float]] = {}
+            totals = []
+            preprocess_audio(in_path, out_path)  # aquecimento (imports, projetos de filtro)
+            for _ in range(config["repeats"]):
+                prof = StageProfiler(trace_memory=False)
+                start = time.perf_counter()
+                preprocess_audio(in_path, out_path, profiler=prof)
+                totals.append((time.perf_counter() - start) * 1000)
+                for record in prof.records:
+                    stage_samples.setdefault(record["stage"], []).append(record["wall_ms"])
+
+            results[f"preprocess.{label}.total"] = summarize(totals, seconds)
+            for stage, samples in stage_samples.items():
+                results[f"preprocess.{label}.{stage}"] = summarize(samples, seconds)
+
+            # Modo de baixa memória: latência total e pico de alocação
+            peaks = []
+            def run_low_memory():
+                peaks.append(preprocess_audio(in_path, out_path, low_memory=True)[1]["peak_bytes"])
+            samples = time_call(run_low_memory, config["repeats"])
+            results[f"preprocess.{label}.low_memory.total"] = dict(
+                summarize(samples, seconds), peak_bytes=max(peaks))
+    return results
+
+
+def bench_embed(work: Path, config: Dict) -> Dict:
+    """Embedding de um clipe (embed_utterance) e em lote (embed_wavs_batch)."""
+    from preprocess_and_embed import embed_signal, embed_wavs_batch
+
+    results = {}
+    for seconds in config["durations"]:
+        y = synth_speech(seconds, 16000, seed=2)
+        samples = time_call(lambda: embed_signal(y, 16000), config["repeats"])
+        results[f"embed.single.{seconds:g}s"] = summarize(samples, seconds)
+
+    clips = [synth_speech(3.0, 16000, seed=10 + i) for i in range(config["batch_clips"])]
+    audio_total = 3.0 * len(clips)
+    samples = time_call(lambda: [embed_signal(c, 16000) for c in clips], config["repeats"])
+    results[f"embed.sequential.{len(clips)}x3s"] = summarize(samples, audio_total, items=len(clips))
+    samples = time_call(lambda: embed_wavs_batch(clips), config["repeats"])
+    results[f"embed.batch.{len(clips)}x3s"] = summarize(samples, audio_total, items=len(clips))
+    return results
+
+
+def _random_embeddings(count: int, seed: int = 3) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    embs = np.abs(rng.standard_normal((count, 256))).astype(np.float32)
+    return embs / np.linalg.norm(embs, axis=1, keepdims=True)
+
+
+def bench_combine(work: Path, config: Dict) -> Dict:
+    """combine_embeddings a partir de arquivos JSON e binários."""
+    from combine_embeddings import combine_embeddings
+    from embedding_format import save_embedding
+
+    results = {}
+    embs = _random_embeddings(config["combine_count"])
+    for suffix in (".emb.json", ".emb"):
+        paths = []
+        for i, emb in enumerate(embs):
+            path = str(work / f"combine_{i}{suffix}")
+            save_embedding(emb, path)
+            paths.append(path)
+        samples = time_call(lambda: combine_embeddings(paths), config["repeats"] * 4)
+        fmt = "bin" if suffix == ".emb" else "json"
+        results[f"combine.{fmt}.{len(paths)}"] = summarize(samples, items=len(paths))
+    return results
+
+
+def bench_validate(work: Path, config: Dict) -> Dict:
+    """validate() sem cache (encoder roda sempre) e com cache em memória."""
+    from embedding_cache import EmbeddingCache
+    from embedding_format import save_embedding
+    from preprocess_and_embed import embed_signal
+    from validate_generation import validate
+
+    results = {}
+    ref_path = str(work / "validate_ref.emb")
+    save_embedding(embed_signal(synth_speech(5.0, 16000, seed=4), 16000), ref_path)
+
+    for seconds in config["durations"]:
+        gen_path = write_signal(work / f"validate_gen_{seconds:g}s.wav", synth_speech(seconds, 24000, seed=5), 24000)
+        samples = time_call(lambda: validate(ref_path, gen_path, use_cache=False), config["repeats"])
+        results[f"validate.uncached.{seconds:g}s"] = summarize(samples, seconds)
+
+        cache = EmbeddingCache()
+        samples = time_call(lambda: validate(ref_path, gen_path, cache=cache), config["repeats"] * 4)
+        results[f"validate.cached.{seconds:g}s"] = summarize(samples, seconds)
+    return results
+
+
+def bench_cli(work: Path, config: Dict) -> Dict:
+    """Invocação da CLI em processo novo (inclui cold start: imports + modelo)."""
+    results = {}
+    seconds = config["durations"][0]
+    in_path = write_signal(work / "cli_input.wav", synth_speech(seconds, 44100, seed=6), 44100)
+    ref_path = str(work / "cli_ref.emb.json")
+    from embedding_format import save_embedding
+    save_embedding(_random_embeddings(1)[0], ref_path)
+
+    commands = {
+        "cli.import.preprocess_and_embed": [sys.executable, "-c", "import preprocess_and_embed"],
+        "cli.preprocess_and_embed": [sys.executable, "preprocess_and_embed.py", "--input", in_path,
+                                     "--out", str(work / "cli_output.wav")],
+        "cli.validate_generation": [sys.executable, "validate_generation.py", "--reference", ref_path,
+                                    "--generated", in_path, "--no-cache"],
+        "cli.audio_preprocessor": [sys.executable, "audio_preprocessor.py", in_path,
+                                   str(work / "cli_studio.wav")],
+    }
+    repeats = max(1, config["repeats"] // 2 + 1)
+    for name, cmd in commands.items():
+        def run():
+            completed = subprocess.run(cmd, cwd=str(WORKERS_DIR), stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE)
+            if completed.returncode != 0:
+                raise RuntimeError(f"{name} falhou: {completed.stderr.decode(errors='replace')[-500:]}")
+        results[name] = summarize(time_call(run, repeats, warmup=0), seconds)
+    return results
+
+
+SUITE_FUNCTIONS = {
+    "startup": bench_startup,
+    "preprocess": bench_preprocess,
+    "embed": bench_embed,
+    "combine": bench_combine,
+    "validate": bench_validate,
+    "cli": bench_cli,
+}
+
+
+def environment_info() -> Dict:
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    from encoder_backend import get_backend
+    info["encoder_backend"] = get_backend()
+    return info
+
+
+def run_benchmarks(config: Dict, suites: Sequence[str] = SUITES) -> Dict:
+    """
+    Executa as suítes e retorna o relatório (baseline).
+
+    Returns:
+        Dict com version, environment, config e results ({nome: estatísticas})
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        work = Path(tmp)
+        for suite in suites:
+            print(f"🚀 Suíte: {suite}", file=sys.stderr)
+            start = time.perf_counter()
+            results.update(SUITE_FUNCTIONS[suite](work, config))
+            print(f"   ✅ {suite}: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment_info(),
+        "config": config,
+        "results": results,
+    }
+
+
+def compare(
+    current: Dict,
+    baseline: Dict,
+    tolerance: float = 0.2,
+    metric: str = "median_ms",
+    suites: Sequence[str] = SUITES
+) -> Dict:
+    """
+    Compara o relatório atual com um baseline.
+
+    Uma medição é regressão quando current > baseline * (1 + tolerance).
+    Só entram as medições das suítes executadas.
+
+    Returns:
+        Dict com regressions, improvements, missing e o detalhe por medição
+    """
+    details = {}
+    regressions, improvements, missing = [], [], []
+    for name, base in baseline.get("results", {}).items():
+        if name.split(".", 1)[0] not in suites:
+            continue
+        cur = current["results"].get(name)
+        if cur is None:
+            missing.append(name)
+            continue
+        ratio = cur[metric] / base[metric] if base[metric] > 0 else 1.0
+        details[name] = {"baseline": base[metric], "current": cur[metric], "ratio": ratio}
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            improvements.append(name)
+    return {
+        "metric": metric,
+        "tolerance": tolerance,
+        "regressions": regressions,
+        "improvements": improvements,
+        "missing": missing,
+        "details": details,
+    }
+
+
+if __name__ == "__main__":
+    from encoder_backend import add_backend_argument
+
+    parser = argparse.ArgumentParser(description="Benchmark reprodutível do pipeline de workers")
+    parser.add_argument("--output", help="Grava o relatório (baseline) em JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compara com um baseline salvo")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Tolerância relativa antes de acusar regressão (padrão: 0.2 = 20%%)")
+    parser.add_argument("--suite", nargs='+', choices=SUITES, default=list(SUITES), help="Suítes a executar")
+    parser.add_argument("--quick", action="store_true", help="Matriz reduzida (menos durações/sample rates)")
+    parser.add_argument("--repeats", type=int, help="Repetições por medição")
+    add_backend_argument(parser)
+    args = parser.parse_args()
+
+    if args.encoder_backend:
+        from preprocess_and_embed import set_encoder_backend
+        set_encoder_backend(args.encoder_backend)
+
+    config = dict(QUICK_CONFIG if args.quick else FULL_CONFIG)
+    if args.repeats:
+        config["repeats"] = args.repeats
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Mesma matriz do baseline para a comparação fazer sentido
+        config = baseline.get("config", config)
+
+    report = run_benchmarks(config, args.suite)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"   ✅ Baseline salvo: {args.output}", file=sys.stderr)
+
+    over_budget = [name for name, r in report["results"].items() if r.get("within_budget") is False]
+    for name in over_budget:
+        r = report["results"][name]
+        print(f"❌ {name}: {r['median_ms']:.0f}ms acima do orçamento de {r['budget_ms']}ms", file=sys.stderr)
+
+    if baseline is None:
+        print(json.dumps(report["results"], indent=2))
+        sys.exit(1 if over_budget else 0)
+
+    comparison = compare(report, baseline, args.tolerance, suites=args.suite)
+    for name, d in sorted(comparison["details"].items()):
+        flag = "❌" if name in comparison["regressions"] else ("⚡" if name in comparison["improvements"] else "  ")
+        print(f"{flag} {name:<48} {d['baseline']:10.2f}ms -> {d['current']:10.2f}ms ({d['ratio']:.2f}x)")
+    for name in comparison["missing"]:
+        print(f"⚠️ {name}: ausente na execução atual")
+
+    if comparison["regressions"] or over_budget:
+        print(f"\n❌ {len(comparison['regressions'])} regressão(ões) acima de {args.tolerance:.0%}, "
+              f"{len(over_budget)} entry point(s) acima do orçamento de inicialização")
+        sys.exit(1)
+    print(f"\n✅ Sem regressões acima de {args.tolerance:.0%}")
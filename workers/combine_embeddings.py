@@ -8,6 +8,10 @@ import numpy as np
 import sys
 from pathlib import Path
 
+from embedding_format import load_embedding, save_embedding_bin
+from encoder_backend import model_id
+from voice_aggregate import VoiceAggregate
+
 def cosine_similarity(a, b):
     """Calcula similaridade coseno"""
     from numpy.linalg import norm
@@ -18,56 +22,58 @@ def cosine_similarity(a, b):
         return 0.0
     return float(dot_product / (norm_a * norm_b))
 
-def combine_embeddings(embedding_paths, method="weighted_average"):
-    """Combina múltiplos embeddings"""
+def combine_embeddings(embedding_paths, method="weighted_average", weights=None):
+    """
+    Combina múltiplos embeddings.
+    
+    average e weighted_average são visões sobre um VoiceAggregate (ver
+    voice_aggregate); weights (ex.: duração de cada áudio) só afetam
+    weighted_average. Para atualizar a voz amostra a amostra use o
+    agregado salvo (voice_aggregate.update_aggregate).
+    """
     embeddings = []
     
     for path in embedding_paths:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            embeddings.append(np.array(data['embedding'], dtype=np.float32))
+        # JSON ou binário (.emb, mapeado em memória)
+        embeddings.append(load_embedding(path))
     
     if len(embeddings) == 1:
-        return embeddings[0]
-    
-    embeddings_array = np.array(embeddings)
-    
-    if method == "average":
-        combined = np.mean(embeddings_array, axis=0)
-    elif method == "weighted_average":
-        weights = np.ones(len(embeddings)) / len(embeddings)
-        combined = np.average(embeddings_array, axis=0, weights=weights)
-    else:
-        combined = np.mean(embeddings_array, axis=0)
-    
-    # Normalizar
-    norm = np.linalg.norm(combined)
-    if norm > 0:
-        combined = combined / norm
+        return np.array(embeddings[0], dtype=np.float32)
     
-    return combined
+    aggregate = VoiceAggregate.from_embeddings(embeddings, weights=weights)
+    return aggregate.combined(method)
 
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Combina embeddings")
-    parser.add_argument("--embeddings", nargs='+', required=True, help="Caminhos dos arquivos de embedding JSON")
+    parser.add_argument("--embeddings", nargs='+', required=True, help="Caminhos dos arquivos de embedding (JSON ou .emb)")
     parser.add_argument("--output", required=True, help="Caminho de saída")
     parser.add_argument("--method", default="weighted_average", help="Método: average, weighted_average")
+    parser.add_argument("--format", choices=["json", "bin"], default="json", help="Formato da saída (padrão: json)")
+    parser.add_argument("--weights", nargs='+', type=float, help="Pesos por embedding (ex.: duração em segundos) para weighted_average")
     
     args = parser.parse_args()
     
-    combined = combine_embeddings(args.embeddings, args.method)
+    if args.weights and len(args.weights) != len(args.embeddings):
+        parser.error("--weights precisa de um valor por embedding")
+    
+    combined = combine_embeddings(args.embeddings, args.method, args.weights)
     
     output_data = {
         "embedding": combined.tolist(),
         "shape": list(combined.shape),
         "method": args.method,
-        "count": len(args.embeddings)
+        "count": len(args.embeddings),
+        "model": model_id()
     }
     
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2)
+    if args.format == "bin":
+        save_embedding_bin(combined, args.output, model=model_id(),
+                           metadata={"method": args.method, "count": len(args.embeddings)})
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output_data, f, indent=2)
     
     print(json.dumps(output_data, indent=2))
 
@@ -1,38 +1,59 @@
 #!/usr/bin/env python3
 """
-Converter WAV para MP3 usando pydub
+Converter WAV para MP3 (e outros formatos) via pipe do ffmpeg
+O PCM é lido em blocos e enviado direto ao ffmpeg (ver audio_encoder)
 """
 
 import argparse
 import sys
 from pathlib import Path
 
-try:
-    from pydub import AudioSegment
-except ImportError:
-    print("❌ Erro: pydub não está instalado. Execute: pip install pydub", file=sys.stderr)
-    print("   NOTA: pydub requer ffmpeg. Instale: https://ffmpeg.org/download.html", file=sys.stderr)
-    sys.exit(1)
+from audio_encoder import FORMATS, encode_array, encode_file, encode_to_bytes
+from audio_io import STDIN, decode_audio, read_source
+
 
 def main():
     parser = argparse.ArgumentParser(description='Converter WAV para MP3')
-    parser.add_argument('--input', required=True, help='Arquivo WAV de entrada')
-    parser.add_argument('--output', required=True, help='Arquivo MP3 de saída')
-    
+    parser.add_argument('--input', required=True, help='Arquivo WAV de entrada ("-" lê o áudio do stdin)')
+    parser.add_argument('--output', required=True, nargs='+',
+                        help='Arquivo(s) de saída: .mp3, .opus ou .flac, opcionalmente "caminho:bitrate"; '
+                             '"-" escreve os bytes codificados no stdout')
+    parser.add_argument('--bitrate', default='128k', help='Bitrate das saídas MP3 sem bitrate explícito (padrão: 128k)')
+    parser.add_argument('--format', default='mp3', choices=sorted(FORMATS),
+                        help='Formato da saída "-" (padrão: mp3)')
+
     args = parser.parse_args()
-    
+
+    if STDIN in args.output and len(args.output) > 1:
+        parser.error('"--output -" não pode ser combinado com outras saídas')
+
+    outputs = [
+        f"{out}:{args.bitrate}" if Path(out).suffix.lower() == '.mp3' else out
+        for out in args.output
+    ]
+
     try:
-        # Carregar WAV
-        audio = AudioSegment.from_wav(args.input)
-        
-        # Exportar como MP3
-        audio.export(args.output, format='mp3', bitrate='128k')
-        
-        print(f"✅ Conversão concluída: {args.output}", file=sys.stderr)
+        if args.input == STDIN or args.output == [STDIN]:
+            # Em memória: sem WAV de entrada nem arquivo de saída temporários
+            source = read_source(args.input)
+            if isinstance(source, bytes):
+                y, sr = decode_audio(source, mono=False)
+            else:
+                import soundfile as sf
+                y, sr = sf.read(source, dtype='float32', always_2d=True)
+            if args.output == [STDIN]:
+                bitrate = args.bitrate if args.format == 'mp3' else None
+                sys.stdout.buffer.write(encode_to_bytes(y, sr, args.format, bitrate))
+                sys.stdout.buffer.flush()
+            else:
+                encode_array(y, sr, outputs)
+        else:
+            encode_file(args.input, outputs)
+
+        print(f"✅ Conversão concluída: {', '.join(args.output)}", file=sys.stderr)
     except Exception as e:
         print(f"❌ Erro ao converter: {e}", file=sys.stderr)
         sys.exit(1)
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,263 @@
+"""
+Cache de embeddings endereçado por conteúdo
+Evita rodar o encoder de novo para o mesmo áudio (re-validação, retries)
+
+Chave = sha256(bytes do áudio) + modelo + versão da configuração.
+Dois níveis:
+    - memória: LRU em processo (útil no worker persistente)
+    - disco: arquivos .emb com despejo por tamanho total e idade
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from embedding_format import DEFAULT_MODEL_ID, load_embedding, load_embedding_bin, save_embedding_bin
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Incrementar quando mudar o pré-processamento/extração (invalida o cache)
+CACHE_VERSION = "1"
+
+# Configuração atual da extração de embedding (entra na chave)
+EMBEDDING_CONFIG = {"sr": 16000, "rate": 1.3, "min_coverage": 0.75, "vad": "numpy-energy-flatness"}
+
+CACHE_DIR_ENV = "EMBEDDING_CACHE_DIR"
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash sha256 do conteúdo de um arquivo (lido em blocos)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    """Hash sha256 de bytes em memória."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(content_hash: str, model: str = DEFAULT_MODEL_ID, config: Optional[Dict] = None) -> str:
+    """Combina hash do conteúdo, modelo e configuração em uma chave única."""
+    config_json = json.dumps(config or EMBEDDING_CONFIG, sort_keys=True, separators=(",", ":"))
+    raw = f"{content_hash}|{model}|{CACHE_VERSION}|{config_json}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Cache de embeddings em dois níveis (memória LRU + disco).
+
+    Args:
+        max_items: Máximo de embeddings no LRU em memória
+        cache_dir: Diretório do nível em disco (None = só memória)
+        max_bytes: Tamanho máximo do nível em disco
+        max_age: Idade máxima (segundos) de uma entrada em disco sem uso
+        model: Identificador do modelo (entra na chave)
+    """
+
+    def __init__(
+        self,
+        max_items: int = 512,
+        cache_dir: Optional[str] = None,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600,
+        model: str = DEFAULT_MODEL_ID
+    ):
+        self.max_items = max_items
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.model = model
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._references: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.stats = {"memory": 0, "disk": 0, "miss": 0}
+
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.evict()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.emb"
+
+    def _remember(self, store: OrderedDict, key, value: np.ndarray):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_items:
+            store.popitem(last=False)
+
+    def get(self, key: str) -> Tuple[Optional[np.ndarray], str]:
+        """
+        Busca um embedding pela chave.
+
+        Returns:
+            Tuple (embedding ou None, nível: "memory", "disk" ou "miss")
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory"] += 1
+                return self._memory[key], "memory"
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                emb = np.array(load_embedding_bin(str(path), mmap=False))
+                os.utime(path)  # marca uso recente para o despejo por idade
+            except (OSError, ValueError):
+                emb = None
+            if emb is not None:
+                with self._lock:
+                    self._remember(self._memory, key, emb)
+                    self.stats["disk"] += 1
+                return emb, "disk"
+
+        with self._lock:
+            self.stats["miss"] += 1
+        return None, "miss"
+
+    def put(self, key: str, emb: np.ndarray):
+        """Guarda um embedding nos dois níveis."""
+        emb = np.asarray(emb, dtype=np.float32)
+        with self._lock:
+            self._remember(self._memory, key, emb)
+            self._puts += 1
+            evict_now = self._puts % 32 == 0
+
+        if self.cache_dir:
+            try:
+                save_embedding_bin(emb, str(self._disk_path(key)), model=self.model)
+            except OSError as e:
+                logger.warning(f"   ⚠️ Falha ao gravar cache em disco: {e}")
+            if evict_now:
+                self.evict()
+
+    def get_or_compute(
+        self,
+        audio_path: Union[str, bytes],
+        compute: Callable[[Union[str, bytes]], np.ndarray],
+        config: Optional[Dict] = None
+    ) -> Tuple[np.ndarray, Dict]:
+        """
+        Retorna o embedding do áudio, calculando com compute(audio_path) só em caso de miss.
+
+        audio_path também pode ser o conteúdo do arquivo (bytes): a chave é a mesma.
+
+        Returns:
+            Tuple (embedding, info) com info = {"tier": ..., "key": ...}
+        """
+        content_hash = hash_bytes(audio_path) if isinstance(audio_path, bytes) else hash_file(audio_path)
+        key = cache_key(content_hash, self.model, config)
+        emb, tier = self.get(key)
+        if emb is None:
+            emb = np.asarray(compute(audio_path), dtype=np.float32)
+            self.put(key, emb)
+        return emb, {"tier": tier, "key": key}
+
+    def load_reference(
+        self,
+        path: str,
+        expected_model: Optional[Union[str, Sequence[str]]] = None
+    ) -> Tuple[np.ndarray, str]:
+        """
+        Carrega um embedding de referência, reaproveitando o já carregado
+        enquanto o arquivo não mudar (caminho + mtime + tamanho).
+
+        Args:
+            path: Embedding de referência (JSON ou .emb)
+            expected_model: Id (ou ids aceitos) do modelo (ver load_embedding)
+
+        Returns:
+            Tuple (embedding, "memory" ou "miss")
+
+        Raises:
+            ValueError: Referência de outro modelo
+        """
+        st = os.stat(path)
+        if expected_model is not None and not isinstance(expected_model, str):
+            expected_model = tuple(expected_model)
+        ref_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, expected_model)
+        with self._lock:
+            if ref_key in self._references:
+                self._references.move_to_end(ref_key)
+                return self._references[ref_key], "memory"
+
+        emb = np.array(load_embedding(path, expected_model=expected_model), dtype=np.float32)
+        with self._lock:
+            self._remember(self._references, ref_key, emb)
+        return emb, "miss"
+
+    def evict(self) -> Dict:
+        """
+        Aplica os limites do nível em disco: remove entradas mais velhas que
+        max_age e, se ainda passar de max_bytes, as menos usadas recentemente.
+        """
+        if not self.cache_dir:
+            return {"removed": 0, "bytes": 0}
+
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self.cache_dir.glob("*/*.emb"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        while entries and total > self.max_bytes:
+            _, size, path = entries.pop(0)
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        return {"removed": removed, "bytes": total}
+
+
+_default_cache: Optional[EmbeddingCache] = None
+
+
+def get_default_cache() -> EmbeddingCache:
+    """
+    Cache compartilhado do processo. O nível em disco é ativado pela
+    variável de ambiente EMBEDDING_CACHE_DIR; o modelo da chave segue o
+    backend do encoder (int8 não reaproveita embeddings do float32).
+    """
+    global _default_cache
+    from encoder_backend import model_id
+    model = model_id()
+    if _default_cache is None:
+        _default_cache = EmbeddingCache(cache_dir=os.environ.get(CACHE_DIR_ENV) or None, model=model)
+    elif _default_cache.model != model:
+        # Backend do encoder trocado no processo: mesmas configurações, outra chave
+        cache = _default_cache
+        _default_cache = EmbeddingCache(cache.max_items, cache.cache_dir, cache.max_bytes, cache.max_age, model)
+    return _default_cache
+
+
+def configure_default_cache(**kwargs) -> EmbeddingCache:
+    """Substitui o cache compartilhado do processo (ex.: --cache-dir na CLI)."""
+    global _default_cache
+    from encoder_backend import model_id
+    kwargs.setdefault("model", model_id())
+    _default_cache = EmbeddingCache(**kwargs)
+    return _default_cache
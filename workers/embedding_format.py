@@ -0,0 +1,258 @@
+"""
+Formato binário compacto para embeddings de voz
+Substitui as listas JSON de floats por dados float32 crus, mapeáveis em memória
+
+Layout do arquivo (.emb):
+    magic   6 bytes  b"ACEMB\\0"
+    versão  uint16   little-endian
+    tamanho uint32   tamanho do cabeçalho JSON em bytes
+    header  JSON     {"model", "dtype", "shape", ...metadados}
+    padding          zeros até alinhar os dados em 64 bytes
+    dados            array little-endian em ordem C
+
+JSON continua suportado para importação/exportação.
+"""
+
+import base64
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+MAGIC = b"ACEMB\0"
+FORMAT_VERSION = 1
+DEFAULT_MODEL_ID = "resemblyzer-ge2e-256"
+BINARY_SUFFIX = ".emb"
+
+_PREFIX = struct.Struct("<6sHI")
+_ALIGNMENT = 64
+
+
+def embedding_to_base64(emb: np.ndarray):
+    """
+    Converte embedding numpy para base64 string.
+    """
+    return base64.b64encode(np.asarray(emb, dtype=np.float32).tobytes()).decode("utf-8")
+
+
+def base64_to_embedding(b64_str: str) -> np.ndarray:
+    """
+    Converte base64 string para embedding numpy.
+    """
+    bytes_data = base64.b64decode(b64_str)
+    return np.frombuffer(bytes_data, dtype=np.float32)
+
+
+def save_embedding_bin(
+    emb: np.ndarray,
+    out_path: str,
+    model: str = DEFAULT_MODEL_ID,
+    metadata: Optional[Dict] = None
+) -> str:
+    """
+    Salva embedding (ou matriz de embeddings) no formato binário.
+
+    A escrita é atômica: o arquivo final só aparece completo.
+
+    Args:
+        emb: Array float32 (d,) ou (n, d)
+        out_path: Caminho de saída
+        model: Identificador do modelo que gerou o embedding
+        metadata: Campos extras para o cabeçalho (precisam ser serializáveis em JSON)
+
+    Returns:
+        Caminho salvo
+    """
+    data = np.ascontiguousarray(emb, dtype="<f4")
+    header = dict(metadata or {})
+    header.update({"model": model, "dtype": data.dtype.str, "shape": list(data.shape)})
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    offset = _PREFIX.size + len(header_bytes)
+    padding = (-offset) % _ALIGNMENT
+
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * padding)
+        f.write(data.tobytes())
+    os.replace(tmp_path, out)
+    return str(out)
+
+
+def is_embedding_bin(path: str) -> bool:
+    """Verifica pelo magic se o arquivo está no formato binário."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def read_embedding_header(path: str) -> Tuple[Dict, int]:
+    """
+    Lê o cabeçalho de um arquivo binário.
+
+    Returns:
+        Tuple (header, offset dos dados)
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"Arquivo de embedding truncado: {path}")
+        magic, version, header_len = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"Arquivo não está no formato binário de embedding: {path}")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Versão de formato não suportada ({version}): {path}")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    offset = _PREFIX.size + header_len
+    offset += (-offset) % _ALIGNMENT
+    return header, offset
+
+
+def _check_model(found: Optional[str], expected_model: Optional[Union[str, Sequence[str]]], path: str):
+    if expected_model is None or found is None:
+        return
+    accepted = (expected_model,) if isinstance(expected_model, str) else tuple(expected_model)
+    if found not in accepted:
+        raise ValueError(f"Embedding de outro modelo: {found} (esperado {' ou '.join(accepted)}): {path}")
+
+
+def load_embedding_bin(
+    path: str,
+    mmap: bool = True,
+    expected_model: Optional[Union[str, Sequence[str]]] = None
+) -> np.ndarray:
+    """
+    Carrega embedding do formato binário.
+
+    Args:
+        path: Caminho do arquivo .emb
+        mmap: Mapear em memória (somente leitura) em vez de copiar para RAM
+        expected_model: Id (ou ids aceitos) do modelo; confere com o do cabeçalho
+
+    Returns:
+        numpy array float32 com o shape salvo
+
+    Raises:
+        ValueError: Arquivo inválido ou de outro modelo
+    """
+    header, offset = read_embedding_header(path)
+    _check_model(header.get("model"), expected_model, path)
+    shape = tuple(header["shape"])
+    dtype = np.dtype(header["dtype"])
+
+    if mmap and int(np.prod(shape)) > 0:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = np.frombuffer(f.read(), dtype=dtype, count=int(np.prod(shape)))
+    return data.reshape(shape)
+
+
+def load_embedding(
+    path: str,
+    mmap: bool = True,
+    expected_model: Optional[Union[str, Sequence[str]]] = None
+) -> np.ndarray:
+    """
+    Carrega embedding em qualquer formato suportado (binário ou JSON).
+
+    No JSON, aceita tanto "embedding" (lista de floats) quanto
+    "embedding_b64" (float32 em base64).
+
+    Args:
+        path: Caminho do embedding
+        mmap: Mapear o binário em memória
+        expected_model: Id (ou ids aceitos) do modelo; confere com o "model"
+            do arquivo (JSON sem "model", de versões antigas, não é conferido)
+
+    Raises:
+        ValueError: Embedding de outro modelo
+    """
+    if is_embedding_bin(path):
+        return load_embedding_bin(path, mmap=mmap, expected_model=expected_model)
+
+    with open(path, "r", encoding="utf-8") as f:
+        obj = json.load(f)
+    _check_model(obj.get("model"), expected_model, path)
+
+    if "embedding_b64" in obj:
+        emb = base64_to_embedding(obj["embedding_b64"])
+        if "shape" in obj:
+            emb = emb.reshape(obj["shape"])
+        return emb
+    return np.array(obj["embedding"], dtype=np.float32)
+
+
+def export_json(
+    emb: np.ndarray,
+    out_json: str,
+    compact: bool = False,
+    model: Optional[str] = None,
+    **extra
+) -> str:
+    """
+    Exporta embedding para JSON (lista de floats, ou base64 se compact=True).
+
+    Args:
+        model: Identificador do modelo, gravado em "model" (conferido no load_embedding)
+    """
+    emb = np.asarray(emb, dtype=np.float32)
+    obj = dict(extra)
+    if model:
+        obj["model"] = model
+    if compact:
+        obj["embedding_b64"] = embedding_to_base64(emb)
+    else:
+        obj["embedding"] = emb.tolist()
+    obj.update({"shape": list(emb.shape), "dtype": str(emb.dtype)})
+
+    Path(out_json).parent.mkdir(parents=True, exist_ok=True)
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=None if compact else 2)
+    return out_json
+
+
+def save_embedding(emb: np.ndarray, out_path: str, model: Optional[str] = None, **metadata) -> str:
+    """
+    Salva embedding escolhendo o formato pela extensão (.json = JSON, demais = binário).
+
+    Args:
+        model: Identificador do modelo (padrão: o do backend de encoder atual,
+            encoder_backend.model_id())
+    """
+    if model is None:
+        from encoder_backend import model_id  # encoder_backend importa este módulo
+        model = model_id()
+    if str(out_path).lower().endswith(".json"):
+        return export_json(emb, out_path, model=model, **metadata)
+    return save_embedding_bin(emb, out_path, model=model, metadata=metadata or None)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Converte embeddings entre JSON e binário")
+    parser.add_argument("--input", required=True, help="Embedding de entrada (JSON ou .emb)")
+    parser.add_argument("--output", required=True, help="Saída (.json = JSON, demais = binário)")
+    parser.add_argument("--compact", action="store_true", help="JSON com embedding em base64")
+    parser.add_argument("--model", default=None, help="Identificador do modelo gravado na saída")
+    args = parser.parse_args()
+
+    emb = np.asarray(load_embedding(args.input, mmap=False))
+    if args.output.lower().endswith(".json"):
+        export_json(emb, args.output, compact=args.compact, model=args.model or DEFAULT_MODEL_ID)
+    else:
+        save_embedding_bin(emb, args.output, model=args.model or DEFAULT_MODEL_ID)
+
+    print(json.dumps({"output": args.output, "shape": list(emb.shape)}))
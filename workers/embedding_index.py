@@ -0,0 +1,335 @@
+"""
+Índice vetorizado de embeddings de voz
+Guarda todos os embeddings de referência em uma única matriz float32 contígua,
+pré-normalizada, e responde buscas top-k / por threshold com um produto de matrizes.
+
+Uso típico: detectar clones duplicados e identificar o locutor de um áudio.
+
+Layout em disco: cada save grava matriz e ids em um diretório de versão novo
+(v-<timestamp>-...) e troca o ponteiro CURRENT de forma atômica; leitores
+nunca veem matriz e ids de versões diferentes, e uma matriz mapeada em
+memória nunca é sobrescrita.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_format import DEFAULT_MODEL_ID, load_embedding, load_embedding_bin, save_embedding_bin
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MATRIX_FILE = "matrix.emb"
+IDS_FILE = "ids.json"
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v-"
+
+
+def _current_dir(index_dir: str) -> Optional[Path]:
+    """Diretório da versão atual (ou o próprio diretório no layout antigo, sem CURRENT)."""
+    directory = Path(index_dir)
+    try:
+        return directory / (directory / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return directory if (directory / IDS_FILE).exists() else None
+
+
+def index_exists(index_dir: str) -> bool:
+    return _current_dir(index_dir) is not None
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    if np.any(norms == 0):
+        raise ValueError("Embedding com norma zero não pode ser indexado")
+    return x / norms
+
+
+class EmbeddingIndex:
+    """
+    Índice de embeddings por clone id com busca por similaridade coseno.
+
+    As linhas ficam normalizadas (L2), então a similaridade coseno de uma
+    consulta contra todo o índice é um único produto matriz-vetor.
+    Remoções trocam a última linha para o buraco, mantendo a matriz contígua.
+    """
+
+    def __init__(self, dim: int = 256, capacity: int = 1024, model: str = DEFAULT_MODEL_ID):
+        self.dim = dim
+        self.model = model
+        self._matrix = np.empty((max(capacity, 1), dim), dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, clone_id: str) -> bool:
+        return clone_id in self._rows
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self._ids)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Visão (n, dim) das linhas ocupadas."""
+        return self._matrix[:len(self._ids)]
+
+    def _ensure_capacity(self, extra: int):
+        needed = len(self._ids) + extra
+        if needed <= len(self._matrix) and self._matrix.flags.writeable:
+            return
+        # Crescimento amortizado; também copia uma matriz mapeada (somente leitura) para RAM
+        capacity = max(needed, 2 * len(self._matrix)) if needed > len(self._matrix) else len(self._matrix)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:len(self._ids)] = self._matrix[:len(self._ids)]
+        self._matrix = matrix
+
+    def add(self, clone_id: str, embedding: np.ndarray):
+        """Adiciona um embedding (erro se o clone id já existir)."""
+        if clone_id in self._rows:
+            raise KeyError(f"Clone já indexado: {clone_id}")
+        self.add_many([clone_id], np.asarray(embedding)[None, :])
+
+    def add_many(self, clone_ids: Sequence[str], embeddings: np.ndarray):
+        """Adiciona vários embeddings (n, dim) de uma vez."""
+        embeddings = _normalize_rows(np.asarray(embeddings).reshape(len(clone_ids), self.dim))
+        if len(set(clone_ids)) != len(clone_ids) or any(cid in self._rows for cid in clone_ids):
+            raise KeyError("Clone ids duplicados ou já indexados")
+
+        self._ensure_capacity(len(clone_ids))
+        start = len(self._ids)
+        self._matrix[start:start + len(clone_ids)] = embeddings
+        for offset, clone_id in enumerate(clone_ids):
+            self._rows[clone_id] = start + offset
+            self._ids.append(clone_id)
+
+    def update(self, clone_id: str, embedding: np.ndarray):
+        """Substitui o embedding de um clone existente."""
+        row = self._rows[clone_id]
+        self._ensure_capacity(0)
+        self._matrix[row] = _normalize_rows(np.asarray(embedding).reshape(self.dim))
+
+    def upsert(self, clone_id: str, embedding: np.ndarray):
+        """Adiciona ou substitui o embedding de um clone."""
+        if clone_id in self._rows:
+            self.update(clone_id, embedding)
+        else:
+            self.add(clone_id, embedding)
+
+    def remove(self, clone_id: str):
+        """Remove um clone (a última linha ocupa o lugar dele)."""
+        row = self._rows.pop(clone_id)
+        last = len(self._ids) - 1
+        if row != last:
+            self._ensure_capacity(0)
+            moved_id = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._ids.pop()
+
+    def get(self, clone_id: str) -> np.ndarray:
+        return np.array(self._matrix[self._rows[clone_id]])
+
+    def similarities(self, embedding: np.ndarray) -> np.ndarray:
+        """Similaridade coseno da consulta contra todas as linhas (n,)."""
+        query = _normalize_rows(np.asarray(embedding).reshape(self.dim))
+        return self.matrix @ query
+
+    def query(
+        self,
+        embedding: np.ndarray,
+        k: int = 5,
+        exclude: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Retorna os k clones mais similares, em ordem decrescente.
+
+        Args:
+            embedding: Embedding de consulta (dim,)
+            k: Número de resultados
+            exclude: Clone ids a ignorar (ex.: o próprio clone)
+        """
+        if not self._ids:
+            return []
+        scores = self.similarities(embedding)
+        if exclude:
+            rows = [self._rows[cid] for cid in exclude if cid in self._rows]
+            scores[rows] = -np.inf
+        return self._top_k(scores, k)
+
+    def query_threshold(self, embedding: np.ndarray, threshold: float) -> List[Tuple[str, float]]:
+        """Retorna todos os clones com similaridade >= threshold, em ordem decrescente."""
+        if not self._ids:
+            return []
+        scores = self.similarities(embedding)
+        rows = np.nonzero(scores >= threshold)[0]
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [(self._ids[r], float(scores[r])) for r in rows]
+
+    def query_batch(
+        self,
+        embeddings: np.ndarray,
+        k: int = 5,
+        chunk_rows: int = 65536
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Top-k para várias consultas (m, dim).
+
+        A matriz (m, n) de scores é calculada em blocos de linhas do índice
+        para limitar a memória temporária com índices grandes.
+        """
+        queries = _normalize_rows(np.asarray(embeddings).reshape(-1, self.dim))
+        n = len(self._ids)
+        if n == 0:
+            return [[] for _ in range(len(queries))]
+
+        k = min(k, n)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), k), dtype=np.int64)
+        for start in range(0, n, chunk_rows):
+            block = queries @ self.matrix[start:start + chunk_rows].T
+            scores = np.concatenate([best_scores, block], axis=1)
+            rows = np.concatenate([best_rows, np.arange(start, start + block.shape[1])[None, :]
+                                   .repeat(len(queries), axis=0)], axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [[(self._ids[r], float(s)) for r, s in zip(rows, scores)]
+                for rows, scores in zip(best_rows, best_scores)]
+
+    def _top_k(self, scores: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [(self._ids[r], float(scores[r])) for r in rows if np.isfinite(scores[r])]
+
+    def save(self, index_dir: str) -> str:
+        """
+        Persiste o índice em um diretório (matriz binária + lista de ids).
+
+        Matriz e ids vão para um diretório de versão novo; a troca de versão
+        é um único os.replace do arquivo CURRENT. Versões anteriores são
+        apagadas em seguida (uma ainda mapeada por outro processo no Windows
+        fica para o próximo save). Um escritor por índice de cada vez.
+        """
+        directory = Path(index_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        version = Path(tempfile.mkdtemp(prefix=f"{VERSION_PREFIX}{time.time_ns():020d}-", dir=directory))
+        save_embedding_bin(self.matrix, str(version / MATRIX_FILE), model=self.model,
+                           metadata={"count": len(self._ids)})
+        with open(version / IDS_FILE, "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "dim": self.dim, "model": self.model}, f)
+
+        fd, tmp_current = tempfile.mkstemp(prefix=f".{CURRENT_FILE}.", suffix=".tmp", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(version.name)
+        os.replace(tmp_current, directory / CURRENT_FILE)
+
+        # A matriz mapeada aponta para a versão anterior, que vai ser apagada
+        if isinstance(self._matrix, np.memmap):
+            self._matrix = np.array(self._matrix)
+        for old in directory.glob(f"{VERSION_PREFIX}*"):
+            if old.name < version.name:
+                shutil.rmtree(old, ignore_errors=True)
+        for legacy in (MATRIX_FILE, IDS_FILE):
+            if (directory / legacy).exists():
+                try:
+                    os.remove(directory / legacy)
+                except OSError:
+                    pass
+
+        logger.info(f"   ✅ Índice salvo: {index_dir} ({len(self._ids)} vozes)")
+        return str(directory)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> "EmbeddingIndex":
+        """
+        Carrega o índice de um diretório.
+
+        Com mmap=True a matriz é mapeada em memória (somente leitura) e só é
+        copiada para a RAM na primeira alteração.
+        """
+        for attempt in range(3):
+            directory = _current_dir(index_dir)
+            if directory is None:
+                raise FileNotFoundError(f"Índice não encontrado: {index_dir}")
+            try:
+                return cls._load_version(directory, mmap)
+            except FileNotFoundError:
+                # Versão apagada por um save concorrente entre ler CURRENT e abrir os arquivos
+                if attempt == 2 or _current_dir(index_dir) == directory:
+                    raise
+
+    @classmethod
+    def _load_version(cls, directory: Path, mmap: bool) -> "EmbeddingIndex":
+        with open(directory / IDS_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        index = cls(dim=meta["dim"], capacity=1, model=meta.get("model", DEFAULT_MODEL_ID))
+        if meta["ids"]:
+            matrix = load_embedding_bin(str(directory / MATRIX_FILE), mmap=mmap)
+            if matrix.shape != (len(meta["ids"]), meta["dim"]):
+                raise ValueError(f"Índice inconsistente em {directory}: matriz {matrix.shape}")
+            index._matrix = matrix
+        index._ids = list(meta["ids"])
+        index._rows = {cid: row for row, cid in enumerate(index._ids)}
+        return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Índice de embeddings de voz (top-k coseno)")
+    parser.add_argument("--index", required=True, help="Diretório do índice")
+    parser.add_argument("--add", nargs='+', default=[], metavar="ID=ARQUIVO",
+                        help="Adiciona/atualiza embeddings (JSON ou .emb)")
+    parser.add_argument("--remove", nargs='+', default=[], metavar="ID", help="Remove clones do índice")
+    parser.add_argument("--query", help="Embedding de consulta (JSON ou .emb)")
+    parser.add_argument("--top-k", type=int, default=5, help="Número de resultados (padrão: 5)")
+    parser.add_argument("--threshold", type=float, help="Retorna todos com similaridade >= threshold")
+    parser.add_argument("--exclude", nargs='+', default=[], metavar="ID", help="Clone ids a ignorar na consulta")
+    args = parser.parse_args()
+
+    if index_exists(args.index):
+        index = EmbeddingIndex.load(args.index)
+    else:
+        index = EmbeddingIndex()
+
+    if args.add or args.remove:
+        for item in args.add:
+            clone_id, path = item.split("=", 1)
+            index.upsert(clone_id, load_embedding(path))
+        for clone_id in args.remove:
+            if clone_id in index:
+                index.remove(clone_id)
+        index.save(args.index)
+
+    output = {"count": len(index)}
+    if args.query:
+        query = load_embedding(args.query)
+        if args.threshold is not None:
+            matches = index.query_threshold(query, args.threshold)
+            matches = [m for m in matches if m[0] not in set(args.exclude)]
+        else:
+            matches = index.query(query, k=args.top_k, exclude=args.exclude)
+        output["matches"] = [{"id": cid, "similarity": score} for cid, score in matches]
+
+    print(json.dumps(output))
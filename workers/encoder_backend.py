@@ -0,0 +1,599 @@
+"""
+Backends do encoder de voz (GE2E do resemblyzer)
+O mesmo modelo, com os mesmos pesos, executado de formas diferentes:
+
+- "torch": VoiceEncoder do resemblyzer em modo eager (padrão)
+- "torchscript": grafo congelado (trace + freeze) executado sob inference_mode
+- "onnx": modelo exportado para ONNX e executado pelo ONNX Runtime
+  (dependência opcional: pip install onnx onnxruntime)
+
+Com o sufixo ":int8" (ex.: "onnx:int8") os pesos da camada linear de
+projeção são quantizados dinamicamente em int8; o LSTM fica em float32 (em
+int8 o desvio acumula ao longo dos 160 frames e passa de MAX_DRIFT). A
+quantização muda os embeddings: cada exportação int8 é comparada com o
+modelo eager (check_parity) e recusada se o desvio de cosseno passar de
+MAX_DRIFT.
+
+As exportações são feitas uma vez e reaproveitadas entre processos, em
+ENCODER_EXPORT_DIR (padrão: ./encoder_exports), com nome derivado dos pesos,
+da versão do torch e do backend.
+
+Seleção: ENCODER_BACKEND=onnx, --encoder-backend nas CLIs ou
+configure_backend() no processo (herdado pelos workers do pool).
+
+Uso:
+    python encoder_backend.py --backend onnx --export
+    python encoder_backend.py --backend torchscript:int8 --parity a.wav b.wav
+"""
+
+import abc
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import warnings
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_format import DEFAULT_MODEL_ID
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKEND_ENV = "ENCODER_BACKEND"
+EXPORT_DIR_ENV = "ENCODER_EXPORT_DIR"
+MAX_DRIFT_ENV = "ENCODER_MAX_DRIFT"
+DEFAULT_EXPORT_DIR = "encoder_exports"
+
+BACKENDS = ("torch", "torchscript", "onnx")
+DEFAULT_BACKEND = "torch"
+
+# Desvio máximo (1 - cosseno) de um embedding em relação ao modelo eager
+MAX_DRIFT = {False: 1e-4, True: 1e-2}
+
+# Mesmos parâmetros do resemblyzer (hparams)
+SAMPLING_RATE = 16000
+MEL_WINDOW_LENGTH = 25           # ms
+MEL_WINDOW_STEP = 10             # ms
+MEL_N_CHANNELS = 40
+PARTIALS_N_FRAMES = 160          # 1.6s
+EMBEDDING_SIZE = 256
+ONNX_OPSET = 17
+
+
+def parse_backend(spec: Optional[str]) -> Tuple[str, bool]:
+    """
+    Converte "backend[:int8]" em (backend, quantizado).
+
+    Raises:
+        ValueError: Backend ou sufixo desconhecido
+    """
+    name, _, suffix = (spec or DEFAULT_BACKEND).strip().lower().partition(":")
+    if name not in BACKENDS:
+        raise ValueError(f"Backend de encoder desconhecido: {name} (use {', '.join(BACKENDS)})")
+    if suffix not in ("", "int8"):
+        raise ValueError(f"Sufixo de backend desconhecido: {suffix} (use int8)")
+    return name, suffix == "int8"
+
+
+def model_id(spec: Optional[str] = None) -> str:
+    """
+    Identificador do modelo para caches e arquivos de embedding: os backends
+    float32 são equivalentes ao eager; os quantizados geram outra chave.
+    """
+    _, quantized = parse_backend(spec or get_backend())
+    return f"{DEFAULT_MODEL_ID}-int8" if quantized else DEFAULT_MODEL_ID
+
+
+def compatible_models() -> Tuple[str, ...]:
+    """
+    Ids de modelo comparáveis com os embeddings do backend atual: o próprio
+    model_id() e a outra precisão do mesmo modelo (float32 e int8 ficam dentro
+    de MAX_DRIFT). Referências gravadas por outro modelo são recusadas.
+    """
+    current = model_id()
+    other = DEFAULT_MODEL_ID if current != DEFAULT_MODEL_ID else f"{DEFAULT_MODEL_ID}-int8"
+    return (current, other)
+
+
+# ---------------------------------------------------------------------------
+# Pré-processamento do encoder (igual ao resemblyzer, sem importar torch)
+# ---------------------------------------------------------------------------
+
+def mel_spectrogram(wav: np.ndarray) -> np.ndarray:
+    """Mel (não log) de um áudio em 16kHz, shape (frames, 40), como o resemblyzer."""
+    import librosa
+
+    frames = librosa.feature.melspectrogram(
+        y=wav,
+        sr=SAMPLING_RATE,
+        n_fft=int(SAMPLING_RATE * MEL_WINDOW_LENGTH / 1000),
+        hop_length=int(SAMPLING_RATE * MEL_WINDOW_STEP / 1000),
+        n_mels=MEL_N_CHANNELS
+    )
+    return frames.astype(np.float32).T
+
+
+def compute_partial_slices(n_samples: int, rate: float = 1.3, min_coverage: float = 0.75) -> Tuple[List[slice], List[slice]]:
+    """
+    Janelas parciais (áudio e mel) de uma fala, como VoiceEncoder.compute_partial_slices.
+
+    Returns:
+        Tuple (fatias do áudio, fatias do mel); as fatias do áudio podem passar
+        do fim do sinal (complete com zeros até wav_slices[-1].stop)
+    """
+    if not 0 < min_coverage <= 1:
+        raise ValueError("min_coverage deve estar em (0, 1]")
+    samples_per_frame = int(SAMPLING_RATE * MEL_WINDOW_STEP / 1000)
+    n_frames = int(np.ceil((n_samples + 1) / samples_per_frame))
+    frame_step = int(np.round((SAMPLING_RATE / rate) / samples_per_frame))
+    if not 0 < frame_step <= PARTIALS_N_FRAMES:
+        raise ValueError(f"rate fora do intervalo suportado: {rate}")
+
+    wav_slices, mel_slices = [], []
+    steps = max(1, n_frames - PARTIALS_N_FRAMES + frame_step + 1)
+    for i in range(0, steps, frame_step):
+        mel_slices.append(slice(i, i + PARTIALS_N_FRAMES))
+        wav_slices.append(slice(i * samples_per_frame, (i + PARTIALS_N_FRAMES) * samples_per_frame))
+
+    # A última janela só entra se tiver cobertura suficiente
+    last = wav_slices[-1]
+    coverage = (n_samples - last.start) / (last.stop - last.start)
+    if coverage < min_coverage and len(mel_slices) > 1:
+        mel_slices = mel_slices[:-1]
+        wav_slices = wav_slices[:-1]
+    return wav_slices, mel_slices
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class SpeakerEncoder(abc.ABC):
+    """
+    Interface comum dos backends: embed_partials() roda o modelo; o resto
+    (janelas parciais, mel, média) é igual ao VoiceEncoder.embed_utterance.
+    """
+
+    backend = DEFAULT_BACKEND
+    embedding_size = EMBEDDING_SIZE
+
+    def __init__(self, quantized: bool = False):
+        self.quantized = quantized
+
+    @property
+    def spec(self) -> str:
+        return f"{self.backend}:int8" if self.quantized else self.backend
+
+    compute_partial_slices = staticmethod(compute_partial_slices)
+
+    @abc.abstractmethod
+    def embed_partials(self, mels: np.ndarray) -> np.ndarray:
+        """
+        Embeddings (normalizados) de um lote de janelas de mel.
+
+        Args:
+            mels: float32 (janelas, 160, 40)
+
+        Returns:
+            float32 (janelas, 256)
+        """
+
+    def embed_utterance(
+        self,
+        wav: np.ndarray,
+        return_partials: bool = False,
+        rate: float = 1.3,
+        min_coverage: float = 0.75
+    ):
+        """Mesma assinatura e resultado do VoiceEncoder.embed_utterance."""
+        wav_slices, mel_slices = compute_partial_slices(len(wav), rate, min_coverage)
+        max_wave_length = wav_slices[-1].stop
+        if max_wave_length >= len(wav):
+            wav = np.pad(wav, (0, max_wave_length - len(wav)), "constant")
+
+        mel = mel_spectrogram(wav)
+        partial_embeds = self.embed_partials(np.array([mel[s] for s in mel_slices]))
+
+        raw_embed = np.mean(partial_embeds, axis=0)
+        embed = raw_embed / np.linalg.norm(raw_embed, 2)
+        if return_partials:
+            return embed, partial_embeds, wav_slices
+        return embed
+
+    def share_memory(self):
+        """Prepara o modelo para ser herdado por fork (somente leitura)."""
+        return self
+
+
+class TorchEncoder(SpeakerEncoder):
+    """VoiceEncoder eager; atributos do VoiceEncoder continuam acessíveis."""
+
+    backend = "torch"
+
+    def __init__(self, quantized: bool = False):
+        super().__init__(quantized)
+        model = load_voice_encoder()
+        if quantized:
+            model = quantize_torch(model)
+        self.model = model
+
+    def __getattr__(self, name):
+        # Compatibilidade com quem usava o VoiceEncoder direto (device, linear, ...)
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def __call__(self, mels):
+        return self.model(mels)
+
+    def embed_partials(self, mels: np.ndarray) -> np.ndarray:
+        import torch
+        with torch.inference_mode():
+            batch = torch.from_numpy(np.ascontiguousarray(mels, dtype=np.float32)).to(self.model.device)
+            return self.model(batch).cpu().numpy()
+
+    def share_memory(self):
+        self.model.eval()
+        for param in self.model.parameters():
+            param.requires_grad_(False)
+        self.model.share_memory()
+        return self
+
+
+class TorchScriptEncoder(SpeakerEncoder):
+    """Grafo TorchScript congelado (exportado uma vez, carregado de disco)."""
+
+    backend = "torchscript"
+
+    def __init__(self, path: str, quantized: bool = False):
+        super().__init__(quantized)
+        import torch
+
+        self.path = path
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)  # depreciação do torch.jit
+            self.model = torch.jit.load(path, map_location="cpu")
+
+    def embed_partials(self, mels: np.ndarray) -> np.ndarray:
+        import torch
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(np.ascontiguousarray(mels, dtype=np.float32))).numpy()
+
+
+class OnnxEncoder(SpeakerEncoder):
+    """
+    Modelo ONNX executado pelo ONNX Runtime. A sessão é criada por processo
+    (workers criados por fork criam a sua, com as threads configuradas).
+    """
+
+    backend = "onnx"
+
+    def __init__(self, path: str, quantized: bool = False):
+        super().__init__(quantized)
+        self.path = path
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.session()
+
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    ort = _import_onnxruntime()
+                    options = ort.SessionOptions()
+                    if _threads:
+                        options.intra_op_num_threads = _threads
+                        options.inter_op_num_threads = 1
+                    self._session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+                    self._pid = os.getpid()
+        return self._session
+
+    def embed_partials(self, mels: np.ndarray) -> np.ndarray:
+        mels = np.ascontiguousarray(mels, dtype=np.float32)
+        return self.session().run(["embeds"], {"mels": mels})[0]
+
+    def share_memory(self):
+        # A sessão não sobrevive ao fork: cada worker cria a sua no primeiro uso
+        self._session = None
+        return self
+
+
+# ---------------------------------------------------------------------------
+# Exportação
+# ---------------------------------------------------------------------------
+
+def load_voice_encoder():
+    """VoiceEncoder do resemblyzer em CPU (instala o VAD em NumPy se preciso)."""
+    from vad import install_webrtcvad_fallback
+
+    # webrtcvad opcional: sem o pacote nativo, usa o VAD em NumPy
+    install_webrtcvad_fallback()
+    from resemblyzer import VoiceEncoder
+    return VoiceEncoder()  # resemblyzer
+
+
+def quantize_torch(model):
+    """Quantização dinâmica int8 (pesos) da camada linear; o LSTM fica em float32."""
+    import torch
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # avisos de depreciação da quantização do torch
+        return torch.ao.quantization.quantize_dynamic(
+            model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError("Backend onnx requer onnxruntime: pip install onnx onnxruntime") from None
+    return onnxruntime
+
+
+def _weights_path() -> Path:
+    """pretrained.pt do resemblyzer, localizado sem importar o pacote (e o torch)."""
+    spec = importlib.util.find_spec("resemblyzer")
+    if spec is None or not spec.submodule_search_locations:
+        raise RuntimeError("resemblyzer não instalado")
+    return Path(list(spec.submodule_search_locations)[0]) / "pretrained.pt"
+
+
+def export_path(spec: str, export_dir: Optional[str] = None) -> Path:
+    """
+    Caminho da exportação de um backend: muda quando os pesos ou a versão
+    do torch mudam (a exportação antiga deixa de ser usada).
+    """
+    backend, quantized = parse_backend(spec)
+    weights = _weights_path().stat()
+    fingerprint = f"{weights.st_size:x}{weights.st_mtime_ns:x}"[-12:]
+    torch_version = metadata.version("torch").split("+")[0]
+    suffix = ".int8" if quantized else ""
+    ext = ".onnx" if backend == "onnx" else ".pt"
+    directory = Path(export_dir or os.environ.get(EXPORT_DIR_ENV) or DEFAULT_EXPORT_DIR)
+    return directory / f"voice_encoder.{fingerprint}.torch{torch_version}{suffix}{ext}"
+
+
+def _export_torchscript(path: Path, quantized: bool):
+    import torch
+
+    model = load_voice_encoder().eval()
+    if quantized:
+        model = quantize_torch(model)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # avisos de depreciação do torch.jit
+        traced = torch.jit.trace(model, torch.zeros(1, PARTIALS_N_FRAMES, MEL_N_CHANNELS))
+        frozen = torch.jit.freeze(traced.eval())
+        torch.jit.save(frozen, str(path))
+
+
+def _export_onnx(path: Path, quantized: bool, export_dir: Optional[str] = None):
+    import torch
+
+    if quantized:
+        # Quantiza o grafo float32 (exportado antes, se preciso) com o ONNX Runtime
+        _import_onnxruntime()
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        source = ensure_export("onnx", export_dir)
+        # Só a projeção linear (MatMul/Gemm): o LSTM fica em float32, como no torch
+        quantize_dynamic(str(source), str(path), per_channel=True, weight_type=QuantType.QInt8,
+                         op_types_to_quantize=["MatMul", "Gemm"])
+        return
+
+    model = load_voice_encoder().eval()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # aviso de batch do LSTM: sem h0/c0 de entrada, o lote é livre
+            torch.onnx.export(
+                model, (torch.zeros(1, PARTIALS_N_FRAMES, MEL_N_CHANNELS),), str(path),
+                input_names=["mels"], output_names=["embeds"],
+                dynamic_axes={"mels": {0: "batch"}, "embeds": {0: "batch"}},
+                opset_version=ONNX_OPSET, dynamo=False
+            )
+    except torch.onnx.OnnxExporterError as e:
+        raise RuntimeError(f"Exportação ONNX falhou ({e}): pip install onnx onnxruntime") from e
+
+
+def ensure_export(spec: str, export_dir: Optional[str] = None, max_drift: Optional[float] = None) -> Path:
+    """
+    Exporta o encoder para o backend (uma vez) e retorna o caminho do arquivo.
+    Exportações int8 só são mantidas se passarem no check_parity.
+
+    Raises:
+        RuntimeError: Dependência ausente ou quantização fora da tolerância
+    """
+    backend, quantized = parse_backend(spec)
+    if backend == "torch":
+        raise ValueError("O backend torch não usa exportação")
+    path = export_path(spec, export_dir)
+    if path.exists():
+        return path
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    logger.info(f"📦 Exportando encoder ({spec}) para {path}")
+    start = time.perf_counter()
+    try:
+        if backend == "onnx":
+            _export_onnx(tmp, quantized, export_dir)
+        else:
+            _export_torchscript(tmp, quantized)
+        if quantized:
+            require_parity(_open(backend, str(tmp), quantized), max_drift)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    logger.info(f"   ✅ Exportado em {time.perf_counter() - start:.1f}s ({path.stat().st_size / 1e6:.1f} MB)")
+    return path
+
+
+def _open(backend: str, path: str, quantized: bool) -> SpeakerEncoder:
+    if backend == "onnx":
+        return OnnxEncoder(path, quantized)
+    return TorchScriptEncoder(path, quantized)
+
+
+def load_encoder(spec: Optional[str] = None, export_dir: Optional[str] = None) -> SpeakerEncoder:
+    """
+    Carrega o encoder do backend (padrão: o configurado no processo),
+    exportando o modelo na primeira vez.
+    """
+    spec = spec or get_backend()
+    backend, quantized = parse_backend(spec)
+    if backend == "torch":
+        encoder = TorchEncoder(quantized)
+        if quantized:
+            require_parity(encoder)
+        return encoder
+    return _open(backend, str(ensure_export(spec, export_dir)), quantized)
+
+
+# ---------------------------------------------------------------------------
+# Paridade com o modelo eager
+# ---------------------------------------------------------------------------
+
+def parity_signals() -> List[np.ndarray]:
+    """Falas sintéticas determinísticas (16kHz) usadas quando não há áudios."""
+    from synthetic_signals import synth_speech
+    return [synth_speech(seconds, SAMPLING_RATE, seed=seed) for seconds, seed in ((2.0, 1), (5.0, 2), (9.0, 3))]
+
+
+def check_parity(
+    encoder: SpeakerEncoder,
+    wavs: Optional[Sequence[np.ndarray]] = None,
+    reference: Optional[SpeakerEncoder] = None,
+    max_drift: Optional[float] = None
+) -> Dict:
+    """
+    Compara os embeddings de um backend com os do modelo eager (float32).
+
+    Args:
+        encoder: Backend avaliado
+        wavs: Falas em 16kHz (padrão: parity_signals())
+        reference: Encoder eager já carregado (padrão: carrega um)
+        max_drift: Tolerância de 1 - cosseno (padrão: MAX_DRIFT ou ENCODER_MAX_DRIFT)
+
+    Returns:
+        Dict com "min_cosine", "max_drift" (por fala), "partial_max_drift",
+        "tolerance", "ok" e tempos médios por fala (ms)
+    """
+    wavs = list(wavs) if wavs is not None else parity_signals()
+    reference = reference or TorchEncoder()
+    if max_drift is None:
+        max_drift = float(os.environ.get(MAX_DRIFT_ENV) or MAX_DRIFT[encoder.quantized])
+
+    cosines, partial_cosines = [], []
+    timings = {"reference_ms": 0.0, "backend_ms": 0.0}
+    for wav in wavs:
+        start = time.perf_counter()
+        ref_emb, ref_partials, _ = reference.embed_utterance(wav, return_partials=True)
+        timings["reference_ms"] += (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        emb, partials, _ = encoder.embed_utterance(wav, return_partials=True)
+        timings["backend_ms"] += (time.perf_counter() - start) * 1000
+        cosines.append(float(np.dot(ref_emb, emb)))
+        partial_cosines.append(float(np.min(np.sum(ref_partials * partials, axis=1))))
+
+    drift = 1.0 - min(cosines)
+    return {
+        "backend": encoder.spec,
+        "utterances": len(wavs),
+        "min_cosine": min(cosines),
+        "max_drift": drift,
+        "partial_max_drift": 1.0 - min(partial_cosines),
+        "tolerance": max_drift,
+        "ok": drift <= max_drift,
+        "reference_ms": timings["reference_ms"] / len(wavs),
+        "backend_ms": timings["backend_ms"] / len(wavs),
+    }
+
+
+def require_parity(encoder: SpeakerEncoder, max_drift: Optional[float] = None) -> Dict:
+    """
+    check_parity que falha quando o desvio passa da tolerância.
+
+    Raises:
+        RuntimeError: Desvio acima da tolerância
+    """
+    report = check_parity(encoder, max_drift=max_drift)
+    if not report["ok"]:
+        raise RuntimeError(
+            f"Encoder {encoder.spec} fora da tolerância: desvio {report['max_drift']:.4f} > "
+            f"{report['tolerance']:.4f} (use o backend {encoder.backend} sem int8 ou ajuste {MAX_DRIFT_ENV})")
+    return report
+
+
+# ---------------------------------------------------------------------------
+# Configuração do processo
+# ---------------------------------------------------------------------------
+
+_backend: Optional[str] = None
+_threads: Optional[int] = None
+
+
+def get_backend() -> str:
+    """Backend do processo: configure_backend() ou a variável ENCODER_BACKEND."""
+    return _backend or os.environ.get(BACKEND_ENV) or DEFAULT_BACKEND
+
+
+def configure_backend(spec: Optional[str]) -> str:
+    """
+    Define o backend do processo (ex.: --encoder-backend na CLI). Também vai
+    para o ambiente, para que workers criados por spawn usem o mesmo.
+    """
+    global _backend
+    parse_backend(spec)
+    _backend = spec.strip().lower() if spec else None
+    if _backend:
+        os.environ[BACKEND_ENV] = _backend
+    return get_backend()
+
+
+def set_threads(threads: Optional[int]):
+    """Threads intra-op das sessões ONNX Runtime criadas a partir daqui."""
+    global _threads
+    _threads = threads
+
+
+def add_backend_argument(parser):
+    """Adiciona --encoder-backend a uma CLI."""
+    parser.add_argument("--encoder-backend", default=None, metavar="BACKEND",
+                        help=f"Backend do encoder: {', '.join(BACKENDS)}, com :int8 opcional "
+                             f"(padrão: ${BACKEND_ENV} ou {DEFAULT_BACKEND})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exporta o encoder de voz e mede a paridade com o modelo eager")
+    parser.add_argument("--backend", default=None, help=f"{', '.join(BACKENDS)}, com :int8 opcional")
+    parser.add_argument("--export-dir", default=None, help=f"Diretório das exportações (padrão: ${EXPORT_DIR_ENV} ou {DEFAULT_EXPORT_DIR})")
+    parser.add_argument("--export", action="store_true", help="Só exporta (se ainda não exportado)")
+    parser.add_argument("--parity", nargs='*', metavar="AUDIO", default=None,
+                        help="Compara com o eager nos áudios (padrão: falas sintéticas)")
+    parser.add_argument("--max-drift", type=float, default=None, help="Tolerância de 1 - cosseno")
+    args = parser.parse_args()
+
+    from audio_io import reserved_stdout
+
+    spec = args.backend or get_backend()
+    with reserved_stdout() as out:
+        if args.export:
+            print(json.dumps({"backend": spec, "path": str(ensure_export(spec, args.export_dir, args.max_drift))}), file=out)
+            sys.exit(0)
+
+        wavs = None
+        if args.parity:
+            from audio_io import load_audio
+            wavs = [load_audio(path, sr=SAMPLING_RATE)[0] for path in args.parity]
+        report = check_parity(load_encoder(spec, args.export_dir), wavs, max_drift=args.max_drift)
+        print(json.dumps(report), file=out)
+    sys.exit(0 if report["ok"] else 1)
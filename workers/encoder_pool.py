@@ -0,0 +1,272 @@
+"""
+Pool de processos com um único VoiceEncoder compartilhado
+O processo pai carrega torch/resemblyzer e o modelo uma vez, move os pesos
+para memória compartilhada (somente leitura) e só então cria os workers por
+fork: cada worker enxerga as mesmas páginas do modelo e do runtime em vez de
+carregar uma cópia própria.
+
+- Threads intra-op por worker = núcleos disponíveis / workers (total de
+  threads = núcleos), opcionalmente com afinidade de CPU disjunta
+- Memória por worker: RSS, PSS (proporcional, divide as páginas
+  compartilhadas) e a parte compartilhada, lidos de /proc
+- Qualquer backend do encoder (ver encoder_backend); no ONNX Runtime cada
+  worker cria a sua sessão sobre o mesmo arquivo exportado
+
+Uso:
+    python encoder_pool.py --workers 4 --inputs a.wav b.wav ...
+    python encoder_pool.py --workers 4 --no-share --inputs ...   # comparação
+    python encoder_pool.py --workers 4 --encoder-backend onnx --inputs ...
+"""
+
+import gc
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> List[int]:
+    """CPUs que este processo pode usar (respeita cgroups/taskset)."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # macOS/Windows
+        return list(range(os.cpu_count() or 1))
+
+
+def threads_per_worker(workers: int, cores: Optional[int] = None) -> int:
+    """Threads intra-op de cada worker para o total não passar do número de núcleos."""
+    cores = cores or len(available_cpus())
+    return max(1, cores // max(1, workers))
+
+
+def cpu_slice(index: int, workers: int, cpus: Optional[Sequence[int]] = None) -> List[int]:
+    """Fatia disjunta de CPUs do worker `index` (todas, se houver mais workers que CPUs)."""
+    cpus = list(cpus or available_cpus())
+    if workers > len(cpus):
+        return cpus
+    per_worker = len(cpus) // workers
+    return cpus[index * per_worker:(index + 1) * per_worker]
+
+
+def configure_threads(threads: int, cpus: Optional[Sequence[int]] = None):
+    """
+    Fixa as threads do torch e do ONNX Runtime (intra-op e inter-op) e,
+    opcionalmente, a afinidade de CPU do processo atual.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"   ⚠️ Afinidade de CPU não aplicada: {e}")
+    import encoder_backend
+    encoder_backend.set_threads(threads)
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # só pode ser definido antes do primeiro uso do pool inter-op
+
+
+def load_shared_encoder():
+    """
+    Carrega e aquece o encoder no processo atual (o pai do pool) e move os
+    pesos para memória compartilhada, somente leitura.
+
+    O aquecimento roda com 1 thread: o pool OpenMP do pai não é criado antes
+    do fork (o libgomp não sobrevive a fork com o pool ativo).
+    """
+    import torch
+    import encoder_backend
+    import preprocess_and_embed
+
+    torch.set_num_threads(1)
+    encoder_backend.set_threads(1)
+    encoder = preprocess_and_embed.get_encoder()
+    preprocess_and_embed.warm_up()
+    return encoder.share_memory()
+
+
+def process_memory(pid: Optional[int] = None) -> Dict:
+    """
+    Memória de um processo em kB: "rss", "pss" (páginas compartilhadas
+    divididas entre os processos que as usam) e "shared" (RSS de arquivos e
+    memória compartilhada). Fora do Linux, só o pico de RSS do processo atual.
+    """
+    pid = pid or os.getpid()
+    info: Dict = {"pid": pid}
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile", "RssShmem"):
+                    info[key] = int(value.split()[0])
+        info["rss"] = info.pop("VmRSS", 0)
+        info["shared"] = info.pop("RssFile", 0) + info.pop("RssShmem", 0)
+        info["private"] = info.pop("RssAnon", 0)
+        with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    info["pss"] = int(line.split()[1])
+                    break
+    except OSError:
+        if pid == os.getpid():
+            try:
+                import resource
+                info["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            except ImportError:
+                pass  # Windows não possui o módulo resource
+    return info
+
+
+# Estado de cada worker do EncoderPool (definido no initializer)
+_worker_info: Dict = {}
+
+
+def _init_worker(threads: int, cpus: Optional[List[int]], share: bool):
+    configure_threads(threads, cpus)
+    _worker_info.update({"threads": threads, "cpus": cpus, "shared_encoder": share})
+    if not share:
+        import preprocess_and_embed
+        from audio_io import reserved_stdout
+        with reserved_stdout():
+            preprocess_and_embed.warm_up()  # cada worker com a sua cópia (comparação)
+
+
+def _embed_path(path: str):
+    from preprocess_and_embed import extract_embedding
+    return os.getpid(), extract_embedding(path)
+
+
+def _worker_report(_=None) -> Dict:
+    time.sleep(0.05)  # espalha as chamadas entre os processos
+    import torch
+    import encoder_backend
+    report = process_memory()
+    report.update(_worker_info)
+    report["torch_threads"] = torch.get_num_threads()
+    report["encoder_backend"] = encoder_backend.get_backend()
+    return report
+
+
+class EncoderPool:
+    """
+    Pool de processos que embedam áudios com um encoder compartilhado.
+
+    Args:
+        workers: Número de processos (padrão: núcleos disponíveis)
+        threads: Threads intra-op por worker (padrão: núcleos / workers)
+        pin_cpus: Fixa cada worker em uma fatia disjunta de CPUs
+        share: Carrega o encoder no pai e cria os workers por fork; com False
+            cada worker (spawn) carrega o seu, para comparação
+        encoder_backend: Backend do encoder (padrão: o do processo)
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        threads: Optional[int] = None,
+        pin_cpus: bool = False,
+        share: bool = True,
+        encoder_backend: Optional[str] = None
+    ):
+        import multiprocessing as mp
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.workers = max(1, workers or len(available_cpus()))
+        self.threads = threads or threads_per_worker(self.workers)
+        self.share = share
+        if encoder_backend:
+            from preprocess_and_embed import set_encoder_backend
+            set_encoder_backend(encoder_backend)  # vai para o ambiente: workers por spawn herdam
+        if share:
+            load_shared_encoder()
+            # Objetos do pai fora do GC: as coletas nos workers não tocam (nem copiam) essas páginas
+            gc.collect()
+            gc.freeze()
+        ctx = mp.get_context("fork" if share else "spawn")
+
+        # Um executor por worker: cada um recebe a sua fatia de CPUs no initializer
+        self._executors = []
+        for index in range(self.workers):
+            cpus = cpu_slice(index, self.workers) if pin_cpus else None
+            self._executors.append(ProcessPoolExecutor(
+                max_workers=1, mp_context=ctx,
+                initializer=_init_worker, initargs=(self.threads, cpus, share)
+            ))
+        self._next = 0
+        logger.info(f"🚀 Pool de encoder: {self.workers} worker(s) x {self.threads} thread(s)"
+                    f" ({'compartilhado' if share else 'um encoder por worker'})")
+
+    def submit(self, fn, *args):
+        """Envia uma tarefa ao próximo worker (round-robin)."""
+        executor = self._executors[self._next % len(self._executors)]
+        self._next += 1
+        return executor.submit(fn, *args)
+
+    def embed_paths(self, paths: Sequence[str]) -> List:
+        """Embeddings dos áudios (pré-processados), na ordem de entrada."""
+        futures = [self.submit(_embed_path, path) for path in paths]
+        return [future.result()[1] for future in futures]
+
+    def memory(self) -> Dict:
+        """Memória do pai e de cada worker (kB), com os totais de RSS e PSS."""
+        workers = [executor.submit(_worker_report).result() for executor in self._executors]
+        parent = process_memory()
+        return {
+            "parent": parent,
+            "workers": workers,
+            "total_rss": parent.get("rss", 0) + sum(w.get("rss", 0) for w in workers),
+            "total_pss": parent.get("pss", 0) + sum(w.get("pss", 0) for w in workers),
+        }
+
+    def close(self):
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from encoder_backend import add_backend_argument, get_backend
+
+    parser = argparse.ArgumentParser(description="Embeddings em paralelo com um encoder compartilhado entre processos")
+    parser.add_argument("--inputs", nargs='+', default=[], help="Áudios pré-processados")
+    parser.add_argument("--workers", type=int, default=None, help="Processos (padrão: núcleos disponíveis)")
+    parser.add_argument("--threads", type=int, default=None, help="Threads intra-op por worker (padrão: núcleos / workers)")
+    parser.add_argument("--pin-cpus", action="store_true", help="Fixa cada worker em uma fatia disjunta de CPUs")
+    parser.add_argument("--no-share", action="store_true", help="Um encoder por worker (spawn), para comparação")
+    add_backend_argument(parser)
+    args = parser.parse_args()
+
+    from audio_io import reserved_stdout
+
+    with reserved_stdout() as out, \
+            EncoderPool(args.workers, args.threads, args.pin_cpus, share=not args.no_share,
+                        encoder_backend=args.encoder_backend) as pool:
+        start = time.perf_counter()
+        embeddings = pool.embed_paths(args.inputs)
+        elapsed = time.perf_counter() - start
+        report = {
+            "count": len(embeddings),
+            "elapsed": elapsed,
+            "files_per_second": len(embeddings) / elapsed if elapsed > 0 else 0.0,
+            "workers": pool.workers,
+            "threads_per_worker": pool.threads,
+            "shared": pool.share,
+            "encoder_backend": get_backend(),
+            "memory_kb": pool.memory(),
+        }
+        print(json.dumps(report), file=out)
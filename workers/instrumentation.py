@@ -0,0 +1,180 @@
+"""
+Instrumentação por etapa do pipeline (opt-in)
+Mede tempo de parede, tempo de CPU e pico de alocação de cada etapa
+(load, mono, resample, denoise, bandpass, trim, write, embed, ...)
+
+Exporta para o metadata retornado, texto Prometheus ou JSON lines.
+"""
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+METRIC_PREFIX = "voice_pipeline"
+
+# Medições de pico abertas por track_peak (sobrevivem aos reset_peak das etapas)
+_peak_trackers: List[Dict] = []
+
+
+def _reset_peak():
+    """tracemalloc.reset_peak preservando o pico já visto pelos track_peak ativos."""
+    if _peak_trackers:
+        _, peak = tracemalloc.get_traced_memory()
+        for tracker in _peak_trackers:
+            tracker["peak"] = max(tracker["peak"], peak)
+    tracemalloc.reset_peak()
+
+
+@contextmanager
+def track_peak() -> Iterator[Dict]:
+    """
+    Mede o pico de alocação de um bloco (bytes acima do início), mesmo com
+    um StageProfiler medindo etapas dentro dele.
+
+    Yields:
+        Dict preenchido com "peak_bytes" na saída do bloco
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    tracker = {"start": current, "peak": current}
+    result: Dict = {}
+    _peak_trackers.append(tracker)
+    try:
+        yield result
+    finally:
+        _peak_trackers.remove(tracker)
+        _, peak = tracemalloc.get_traced_memory()
+        result["peak_bytes"] = max(0, max(peak, tracker["peak"]) - tracker["start"])
+        if started:
+            tracemalloc.stop()
+
+
+class StageProfiler:
+    """
+    Coleta métricas por etapa.
+
+    Etapas podem ser aninhadas; o nome registrado é o caminho com pontos
+    (ex.: "validate.embed_generated"). Com enabled=False nada é medido,
+    então o pipeline pode usar o profiler sempre, sem custo.
+
+    Args:
+        enabled: Ativa a coleta
+        trace_memory: Mede pico de alocação com tracemalloc (tem custo extra)
+        labels: Labels fixos para a exportação (ex.: {"pipeline": "studio"})
+    """
+
+    def __init__(self, enabled: bool = True, trace_memory: bool = True, labels: Optional[Dict] = None):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.labels = dict(labels or {})
+        self.records: List[Dict] = []
+        self._stack: List[Dict] = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Context manager que mede uma etapa."""
+        if not self.enabled:
+            yield
+            return
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        frame = {"name": name, "start_current": 0, "peak_seen": 0}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent["peak_seen"] = max(parent["peak_seen"], peak)
+            _reset_peak()
+            frame["start_current"] = frame["peak_seen"] = current
+
+        path = ".".join([f["name"] for f in self._stack] + [name])
+        self._stack.append(frame)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            self._stack.pop()
+
+            record = {"stage": path, "wall_ms": wall * 1000, "cpu_ms": cpu * 1000}
+            if self.trace_memory and tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                absolute_peak = max(peak, frame["peak_seen"])
+                record["peak_bytes"] = max(0, absolute_peak - frame["start_current"])
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent["peak_seen"] = max(parent["peak_seen"], absolute_peak)
+                _reset_peak()
+            self.records.append(record)
+
+            if not self._stack and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def as_list(self) -> List[Dict]:
+        """Registros por etapa, prontos para ir no metadata/JSON de resultado."""
+        return [dict(r) for r in self.records]
+
+    def to_prometheus(self, prefix: str = METRIC_PREFIX) -> str:
+        """Exporta no formato texto do Prometheus (gauges da última execução)."""
+        metrics = [
+            ("wall_seconds", "wall_ms", 1e-3, "Tempo de parede por etapa"),
+            ("cpu_seconds", "cpu_ms", 1e-3, "Tempo de CPU por etapa"),
+            ("peak_bytes", "peak_bytes", 1, "Pico de alocação por etapa"),
+        ]
+        lines = []
+        for metric, key, scale, help_text in metrics:
+            rows = [r for r in self.records if key in r]
+            if not rows:
+                continue
+            name = f"{prefix}_stage_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for r in rows:
+                labels = dict(self.labels, stage=r["stage"])
+                label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{{{label_text}}} {r[key] * scale:.9g}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self) -> str:
+        """Exporta uma linha JSON por etapa (com timestamp e labels)."""
+        timestamp = time.time()
+        return "".join(
+            json.dumps(dict(self.labels, timestamp=timestamp, **r)) + "\n" for r in self.records
+        )
+
+    def export(self, path: str):
+        """
+        Grava as métricas: .prom sobrescreve em formato Prometheus
+        (node_exporter textfile), qualquer outra extensão acrescenta JSON lines.
+        """
+        out = Path(path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix == ".prom":
+            tmp = out.with_name(out.name + ".tmp")
+            tmp.write_text(self.to_prometheus(), encoding="utf-8")
+            tmp.replace(out)
+        else:
+            with open(out, "a", encoding="utf-8") as f:
+                f.write(self.to_jsonl())
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def get_profiler(profiler: Optional[StageProfiler]) -> StageProfiler:
+    """Retorna o profiler informado ou um desativado (no-op)."""
+    return profiler if profiler is not None else StageProfiler(enabled=False)
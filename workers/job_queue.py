@@ -0,0 +1,566 @@
+"""
+Fila de jobs persistente (SQLite) + pool de workers
+Os jobs usam as mesmas operações do worker_daemon e são executados por
+processos que mantêm o encoder carregado. O lado Node enfileira e consulta
+status/resultados pela CLI (ou direto no arquivo SQLite).
+
+- Prioridades: "interactive" (validação) antes de "bulk" (construção de clones)
+- Deduplicação: payload idêntico (op + params + conteúdo dos arquivos
+  citados nos params) reaproveita o job existente
+- Retries com backoff exponencial; leases expirados voltam para a fila
+  (ou falham, se o job já usou todas as tentativas: um job que derruba o
+  worker não fica em loop). O worker renova o lease (heartbeat) enquanto
+  o job roda, então jobs mais longos que o lease não são reservados de novo
+
+Uso:
+    python job_queue.py --db jobs.sqlite3 enqueue --op validate --params '{"reference": ..., "generated": ...}'
+    python job_queue.py --db jobs.sqlite3 status 42
+    python job_queue.py --db jobs.sqlite3 work --workers 2
+    python job_queue.py --db jobs.sqlite3 work --workers 4 --shared-encoder   # um encoder para o pool
+    python job_queue.py --db jobs.sqlite3 work --workers 4 --encoder-backend onnx
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+logger = logging.getLogger(__name__)
+
+DB_ENV = "JOB_QUEUE_DB"
+DEFAULT_DB = "jobs.sqlite3"
+
+PRIORITIES = {"interactive": 0, "default": 50, "bulk": 100}
+
+# Prioridade padrão por operação (validação é interativa, construção de clone é lote)
+OP_PRIORITIES = {
+    "validate": "interactive",
+    "validate_batch": "interactive",
+    "extract_embedding": "default",
+    "preprocess_audio": "bulk",
+    "preprocess_and_embed": "bulk",
+    "extract_embeddings_batch": "bulk",
+    "combine_embeddings": "bulk",
+    "update_voice_aggregate": "bulk",
+    "encode_audio": "bulk",
+}
+
+# Operações de controle do daemon não fazem sentido na fila
+REJECTED_OPS = ("shutdown",)
+
+STATUSES = ("queued", "running", "done", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    params TEXT NOT NULL,
+    payload_hash TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, available_at, id);
+CREATE INDEX IF NOT EXISTS jobs_payload ON jobs (payload_hash, status);
+"""
+
+
+def _file_fingerprints(value, out: Dict[str, str]):
+    """Hash do conteúdo de cada arquivo (ou dos arquivos de cada diretório) citado em value."""
+    if isinstance(value, dict):
+        for item in value.values():
+            _file_fingerprints(item, out)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _file_fingerprints(item, out)
+    elif isinstance(value, str) and value and len(value) < 4096 and not value.startswith("data:"):
+        from embedding_cache import hash_file
+        path = Path(value)
+        if path.is_file():
+            out[value] = hash_file(value)
+        elif path.is_dir():
+            for f in sorted(path.iterdir()):
+                if f.is_file():
+                    out[str(f)] = hash_file(str(f))
+
+
+def payload_hash(op: str, params: Dict) -> str:
+    """
+    Hash canônico de op + params (chaves ordenadas) + conteúdo dos arquivos
+    citados nos params: o mesmo caminho com outro conteúdo é outro job.
+    """
+    files: Dict[str, str] = {}
+    _file_fingerprints(params, files)
+    canonical = json.dumps({"op": op, "params": params, "files": files}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def resolve_priority(priority, op: str) -> int:
+    if priority is None:
+        priority = OP_PRIORITIES.get(op, "default")
+    if isinstance(priority, str):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Prioridade desconhecida: {priority} (use {', '.join(PRIORITIES)} ou um inteiro)")
+        return PRIORITIES[priority]
+    return int(priority)
+
+
+class JobQueue:
+    """
+    Fila persistente em SQLite (modo WAL, seguro entre processos).
+
+    Args:
+        path: Arquivo do banco (padrão: $JOB_QUEUE_DB ou jobs.sqlite3)
+        dedup_window: Segundos em que um job concluído com o mesmo payload é reaproveitado
+        backoff_base: Espera (s) antes do primeiro retry; dobra a cada tentativa
+        backoff_max: Espera máxima entre tentativas
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        dedup_window: float = 3600,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0
+    ):
+        self.path = path or os.environ.get(DB_ENV) or DEFAULT_DB
+        self.dedup_window = dedup_window
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE: trava de escrita já no início (claim/enqueue sem corrida)
+        return _Transaction(self._conn)
+
+    def enqueue(
+        self,
+        op: str,
+        params: Optional[Dict] = None,
+        priority=None,
+        max_attempts: int = 3,
+        dedup: bool = True
+    ) -> Dict:
+        """
+        Enfileira um job.
+
+        Returns:
+            Dict com job_id, status e deduplicated (True se reaproveitou um job existente)
+        """
+        if op in REJECTED_OPS:
+            raise ValueError(f"Operação não permitida na fila: {op}")
+        params = params or {}
+        digest = payload_hash(op, params)
+        now = time.time()
+
+        with self._transaction():
+            if dedup:
+                row = self._conn.execute(
+                    "SELECT id, status FROM jobs WHERE payload_hash = ? AND "
+                    "(status IN ('queued', 'running') OR (status = 'done' AND finished_at >= ?)) "
+                    "ORDER BY id DESC LIMIT 1",
+                    (digest, now - self.dedup_window),
+                ).fetchone()
+                if row:
+                    return {"job_id": row["id"], "status": row["status"], "deduplicated": True}
+
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (op, params, payload_hash, priority, status, max_attempts, available_at, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (op, json.dumps(params), digest, resolve_priority(priority, op), max(1, max_attempts), now, now),
+            )
+        return {"job_id": cursor.lastrowid, "status": "queued", "deduplicated": False}
+
+    def claim(self, worker: str, lease_seconds: float = 600) -> Optional[Dict]:
+        """
+        Reserva o próximo job (menor prioridade numérica, depois o mais antigo).
+
+        Jobs "running" com lease vencido (worker morreu) voltam para a fila
+        antes; os que já usaram todas as tentativas ficam como "failed".
+        """
+        now = time.time()
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, worker = NULL, lease_until = NULL, finished_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                ("Lease expirado na última tentativa (worker morreu?)", now, now),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL "
+                "WHERE status = 'running' AND lease_until < ?",
+                (now,),
+            )
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND available_at <= ? "
+                "ORDER BY priority, id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "started_at = ?, lease_until = ? WHERE id = ?",
+                (worker, now, now + lease_seconds, row["id"]),
+            )
+        job = _row_to_job(row)
+        job["attempts"] += 1
+        return job
+
+    def heartbeat(self, job_id: int, worker: str, lease_seconds: float = 600) -> bool:
+        """
+        Renova o lease do job reservado por worker (lease_until = agora + lease_seconds).
+
+        Returns:
+            False se o lease já foi perdido (o job voltou para a fila ou é de outro worker)
+        """
+        cursor = self._conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time() + lease_seconds, job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: int, result: Dict, worker: str) -> bool:
+        """
+        Registra o resultado do job reservado por worker.
+
+        Returns:
+            False se o lease do worker já foi perdido (o job voltou para a fila
+            ou é de outro worker): o resultado é descartado
+        """
+        cursor = self._conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (json.dumps(result), time.time(), job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: int, error: str, worker: str) -> str:
+        """
+        Registra uma falha do job reservado por worker: volta para a fila com
+        backoff ou, sem tentativas restantes, fica como "failed".
+
+        Returns:
+            Novo status ("queued" ou "failed"), ou "lost" se o lease do worker
+            já foi perdido (nada é alterado)
+        """
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'running' AND worker = ?",
+                (job_id, worker),
+            ).fetchone()
+            if row is None:
+                return "lost"
+            if row["attempts"] < row["max_attempts"]:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (row["attempts"] - 1))
+                delay *= random.uniform(0.8, 1.2)  # jitter: evita retries sincronizados
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, available_at = ?, worker = NULL, "
+                    "lease_until = NULL WHERE id = ?",
+                    (error, now + delay, job_id),
+                )
+                return "queued"
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+                (error, now, job_id),
+            )
+            return "failed"
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def stats(self) -> Dict:
+        """Contagem de jobs por status (e por prioridade na fila)."""
+        counts = {status: 0 for status in STATUSES}
+        for row in self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        queued = {str(row["priority"]): row["n"] for row in self._conn.execute(
+            "SELECT priority, COUNT(*) AS n FROM jobs WHERE status = 'queued' GROUP BY priority")}
+        return {"counts": counts, "queued_by_priority": queued}
+
+    def purge(self, older_than: float) -> int:
+        """Remove jobs concluídos/falhos finalizados há mais de older_than segundos."""
+        cursor = self._conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - older_than,),
+        )
+        return cursor.rowcount
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict:
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    if job.get("result") is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+# ---------------------------------------------------------------------------
+# Pool de workers
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def keep_lease(db_path: str, job_id: int, worker: str, lease_seconds: float):
+    """
+    Renova o lease do job a cada lease_seconds / 3 enquanto o bloco roda
+    (thread com conexão própria ao SQLite).
+    """
+    stop = threading.Event()
+
+    def run():
+        queue = JobQueue(db_path)
+        try:
+            while not stop.wait(lease_seconds / 3):
+                if not queue.heartbeat(job_id, worker, lease_seconds):
+                    logger.warning(f"   ⚠️ Lease do job {job_id} perdido durante a execução")
+                    return
+        finally:
+            queue.close()
+
+    thread = threading.Thread(target=run, name=f"lease-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _worker_main(db_path: str, worker_name: str, poll_interval: float, lease_seconds: float, warmup: bool,
+                 threads: int = 1, cpus: Optional[List[int]] = None):
+    """
+    Loop de um processo do pool: carrega o encoder uma vez (ou herda o do pai,
+    com encoder compartilhado) e consome jobs.
+    """
+    import worker_daemon  # redireciona prints de bibliotecas para stderr
+    from encoder_pool import configure_threads
+
+    configure_threads(threads, cpus)
+
+    stopping = {"flag": False}
+
+    def _handler(signum, frame):
+        stopping["flag"] = True
+
+    signal.signal(signal.SIGTERM, _handler)
+    signal.signal(signal.SIGINT, _handler)
+
+    if warmup:
+        worker_daemon.warm_up()
+
+    queue = JobQueue(db_path)
+    logger.info(f"🚀 Worker {worker_name} pronto")
+    while not stopping["flag"]:
+        job = queue.claim(worker_name, lease_seconds)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"   ▶️ Job {job['id']} ({job['op']}, tentativa {job['attempts']}/{job['max_attempts']})")
+        with keep_lease(db_path, job["id"], worker_name, lease_seconds):
+            response = worker_daemon.handle_request({"id": job["id"], "op": job["op"], "params": job["params"]})
+        if response.get("ok"):
+            if queue.complete(job["id"], response["result"], worker_name):
+                logger.info(f"   ✅ Job {job['id']} concluído em {response['elapsed_ms']:.0f}ms")
+            else:
+                logger.warning(f"   ⚠️ Job {job['id']} concluído após o lease expirar: resultado descartado")
+        else:
+            status = queue.fail(job["id"], response.get("error") or "erro desconhecido", worker_name)
+            logger.warning(f"   ⚠️ Job {job['id']} falhou ({status}): {response.get('error')}")
+    queue.close()
+
+
+def run_pool(
+    db_path: str,
+    workers: int = 1,
+    poll_interval: float = 0.5,
+    lease_seconds: float = 600,
+    warmup: bool = True,
+    shared_encoder: bool = False,
+    threads: Optional[int] = None,
+    pin_cpus: bool = False,
+    report_interval: float = 300,
+    encoder_backend: Optional[str] = None
+) -> int:
+    """
+    Executa o pool: N processos consumindo a fila, reiniciados se morrerem.
+
+    Com shared_encoder o encoder é carregado uma vez aqui e os workers são
+    criados por fork, compartilhando os pesos (ver encoder_pool). As threads
+    intra-op de cada worker somam o número de núcleos; a memória (RSS/PSS)
+    de cada worker vai para o log a cada report_interval segundos.
+    encoder_backend escolhe o backend do encoder de todos os workers (ver
+    encoder_backend).
+
+    SIGTERM/SIGINT encerram os workers depois do job em andamento.
+    """
+    import multiprocessing as mp
+    from encoder_pool import cpu_slice, load_shared_encoder, process_memory, threads_per_worker
+
+    workers = max(1, workers)
+    threads = threads or threads_per_worker(workers)
+    if encoder_backend:
+        from preprocess_and_embed import set_encoder_backend
+        set_encoder_backend(encoder_backend)  # vai para o ambiente: workers por spawn herdam
+    if shared_encoder:
+        import gc
+        import worker_daemon  # noqa: F401  (prints de bibliotecas para stderr, herdado pelos workers)
+        load_shared_encoder()
+        gc.collect()
+        gc.freeze()
+        warmup = False  # os workers herdam o encoder já aquecido
+    ctx = mp.get_context("fork" if shared_encoder else "spawn")
+    host = socket.gethostname()
+    stopping = {"flag": False}
+
+    def start(index: int):
+        name = f"{host}:{os.getpid()}:{index}"
+        cpus = cpu_slice(index, workers) if pin_cpus else None
+        proc = ctx.Process(target=_worker_main,
+                           args=(db_path, name, poll_interval, lease_seconds, warmup, threads, cpus),
+                           name=name, daemon=False)
+        proc.start()
+        return proc
+
+    def report():
+        # PSS divide as páginas herdadas do pai entre os processos: é o custo real de cada worker
+        for proc in procs:
+            memory = process_memory(proc.pid) if proc.is_alive() else {}
+            if memory.get("rss"):
+                logger.info(f"   📊 {proc.name}: RSS {memory['rss'] / 1024:.0f} MB, "
+                            f"PSS {memory.get('pss', 0) / 1024:.0f} MB")
+
+    def _handler(signum, frame):
+        stopping["flag"] = True
+
+    signal.signal(signal.SIGTERM, _handler)
+    signal.signal(signal.SIGINT, _handler)
+
+    procs: List = [start(i) for i in range(workers)]
+    logger.info(f"🚀 Pool com {len(procs)} worker(s) x {threads} thread(s) na fila {db_path}"
+                f"{' (encoder compartilhado)' if shared_encoder else ''}")
+    last_report = time.monotonic()
+    while not stopping["flag"]:
+        time.sleep(1.0)
+        if report_interval and time.monotonic() - last_report >= report_interval:
+            report()
+            last_report = time.monotonic()
+        for i, proc in enumerate(procs):
+            if not proc.is_alive() and not stopping["flag"]:
+                logger.warning(f"   ⚠️ Worker {proc.name} saiu (código {proc.exitcode}), reiniciando")
+                procs[i] = start(i)
+
+    for proc in procs:
+        if proc.is_alive():
+            proc.terminate()  # SIGTERM: termina o job atual e sai
+    for proc in procs:
+        proc.join()
+    logger.info("👋 Pool encerrado")
+    return 0
+
+
+if __name__ == "__main__":
+    from encoder_backend import add_backend_argument
+
+    parser = argparse.ArgumentParser(description="Fila persistente de jobs do pipeline de voz")
+    parser.add_argument("--db", default=None, help=f"Arquivo SQLite da fila (padrão: ${DB_ENV} ou {DEFAULT_DB})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enqueue = sub.add_parser("enqueue", help="Enfileira um job")
+    p_enqueue.add_argument("--op", required=True, help="Operação do worker_daemon (ex.: validate)")
+    p_enqueue.add_argument("--params", default="{}", help="Parâmetros em JSON")
+    p_enqueue.add_argument("--priority", help="interactive, default, bulk ou inteiro (menor = antes)")
+    p_enqueue.add_argument("--max-attempts", type=int, default=3, help="Tentativas antes de falhar (padrão: 3)")
+    p_enqueue.add_argument("--no-dedup", action="store_true", help="Sempre cria um job novo")
+
+    p_status = sub.add_parser("status", help="Status/resultado de jobs")
+    p_status.add_argument("job_ids", nargs='+', type=int)
+
+    sub.add_parser("stats", help="Contagem de jobs por status")
+
+    p_work = sub.add_parser("work", help="Executa o pool de workers")
+    p_work.add_argument("--workers", type=int, default=1, help="Processos no pool (padrão: 1)")
+    p_work.add_argument("--poll-interval", type=float, default=0.5, help="Espera (s) quando a fila está vazia")
+    p_work.add_argument("--lease", type=float, default=600,
+                        help="Tempo (s) sem heartbeat até um job travado voltar à fila")
+    p_work.add_argument("--no-warmup", action="store_true", help="Não aquecer o encoder ao iniciar")
+    p_work.add_argument("--shared-encoder", action="store_true",
+                        help="Carrega o encoder uma vez e cria os workers por fork, compartilhando os pesos")
+    p_work.add_argument("--threads", type=int, default=None,
+                        help="Threads intra-op por worker (padrão: núcleos / workers)")
+    p_work.add_argument("--pin-cpus", action="store_true", help="Fixa cada worker em uma fatia disjunta de CPUs")
+    p_work.add_argument("--report-interval", type=float, default=300,
+                        help="Intervalo (s) do relatório de memória por worker no log (0 desativa)")
+    add_backend_argument(p_work)
+
+    p_purge = sub.add_parser("purge", help="Remove jobs finalizados antigos")
+    p_purge.add_argument("--older-than", type=float, default=7 * 24 * 3600, help="Idade em segundos (padrão: 7 dias)")
+
+    args = parser.parse_args()
+    db_path = args.db or os.environ.get(DB_ENV) or DEFAULT_DB
+
+    if args.command == "work":
+        sys.exit(run_pool(db_path, args.workers, args.poll_interval, args.lease, not args.no_warmup,
+                          shared_encoder=args.shared_encoder, threads=args.threads,
+                          pin_cpus=args.pin_cpus, report_interval=args.report_interval,
+                          encoder_backend=args.encoder_backend))
+
+    queue = JobQueue(db_path)
+    if args.command == "enqueue":
+        try:
+            output = queue.enqueue(args.op, json.loads(args.params), args.priority,
+                                   args.max_attempts, dedup=not args.no_dedup)
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+    elif args.command == "status":
+        jobs = [queue.get(job_id) for job_id in args.job_ids]
+        output = {"jobs": [job if job else {"id": job_id, "status": "unknown"}
+                           for job_id, job in zip(args.job_ids, jobs)]}
+    elif args.command == "stats":
+        output = queue.stats()
+    else:
+        output = {"removed": queue.purge(args.older_than)}
+    print(json.dumps(output))
@@ -0,0 +1,371 @@
+"""
+Perfil de ruído por locutor/sessão
+Estima o piso de ruído espectral uma vez, a partir dos frames mais
+silenciosos das primeiras amostras de um clone, e reaproveita o perfil
+para spectral gating estacionário (barato) nas amostras e takes seguintes.
+
+Quando o ruído de uma amostra não bate com o perfil salvo (outro
+microfone/sala), volta para o noisereduce não-estacionário.
+
+Mesmo algoritmo do modo estacionário do noisereduce (limiar = média +
+n_std * desvio do ruído em dB por frequência, máscara suavizada), só que
+com as estatísticas do ruído vindas do perfil.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR_ENV = "NOISE_PROFILE_DIR"
+PROFILE_VERSION = 1
+
+# Mesmos padrões do noisereduce
+N_FFT = 1024
+HOP_LENGTH = N_FFT // 4
+N_STD_THRESH = 1.5
+FREQ_MASK_SMOOTH_HZ = 500
+TIME_MASK_SMOOTH_MS = 50
+
+# Frames usados na estimativa: os QUIET_PERCENTILE% mais silenciosos (mínimo MIN_NOISE_FRAMES)
+QUIET_PERCENTILE = 10
+MIN_NOISE_FRAMES = 16
+
+# Diferença mediana (dB) entre o piso da amostra e o do perfil acima da qual o perfil não serve
+MATCH_TOLERANCE_DB = 6.0
+
+
+def _stft(y: np.ndarray):
+    from scipy.signal import stft
+    _, _, z = stft(y, nfft=N_FFT, nperseg=N_FFT, noverlap=N_FFT - HOP_LENGTH, padded=False)
+    return z
+
+
+def _amp_to_db(x: np.ndarray, top_db: float = 80.0) -> np.ndarray:
+    # Igual ao _amp_to_db do noisereduce
+    x_db = 20 * np.log10(np.abs(x) + np.finfo(np.float64).eps)
+    return np.maximum(x_db, np.max(x_db, axis=-1, keepdims=True) - top_db)
+
+
+def analyze(y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """STFT de y e o espectro em dB, reaproveitados na comparação com o perfil e no gating."""
+    sig_stft = _stft(np.asarray(y, dtype=np.float64))
+    return sig_stft, _amp_to_db(sig_stft)
+
+
+def _quiet_frames_db(spec_db: np.ndarray) -> np.ndarray:
+    """Espectro em dB (freq x frames) só dos frames mais silenciosos."""
+    energy = np.mean(spec_db, axis=0)
+    count = min(spec_db.shape[1], max(MIN_NOISE_FRAMES, int(spec_db.shape[1] * QUIET_PERCENTILE / 100)))
+    quietest = np.argsort(energy)[:count]
+    return spec_db[:, quietest]
+
+
+def _f32_to_base64(x: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(x, dtype="<f4").tobytes()).decode("utf-8")
+
+
+def _base64_to_f32(b64_str: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(b64_str), dtype="<f4").astype(np.float64)
+
+
+class NoiseProfile:
+    """
+    Piso de ruído espectral: média e desvio (dB) por bin de frequência.
+
+    Args:
+        sr: Sample rate em que o perfil foi estimado
+        mean_db: Média do ruído em dB por frequência (N_FFT // 2 + 1,)
+        std_db: Desvio do ruído em dB por frequência
+        frames: Frames de ruído usados na estimativa
+    """
+
+    def __init__(self, sr: int, mean_db: np.ndarray, std_db: np.ndarray, frames: int = 0,
+                 created_at: Optional[float] = None):
+        self.sr = sr
+        self.mean_db = np.asarray(mean_db, dtype=np.float64)
+        self.std_db = np.asarray(std_db, dtype=np.float64)
+        self.frames = frames
+        self.created_at = created_at or time.time()
+
+    @classmethod
+    def estimate(cls, y: np.ndarray, sr: int, spec_db: Optional[np.ndarray] = None) -> "NoiseProfile":
+        """Estima o perfil a partir dos frames mais silenciosos de y."""
+        noise_db = _quiet_frames_db(analyze(y)[1] if spec_db is None else spec_db)
+        return cls(sr, np.mean(noise_db, axis=1), np.std(noise_db, axis=1), frames=noise_db.shape[1])
+
+    def threshold_db(self, n_std_thresh: float = N_STD_THRESH) -> np.ndarray:
+        return self.mean_db + self.std_db * n_std_thresh
+
+    def mismatch_db(self, y: np.ndarray, sr: int, spec_db: Optional[np.ndarray] = None) -> float:
+        """
+        Diferença mediana (dB) entre o piso de ruído de y e o do perfil
+        (inf se o sample rate for outro).
+        """
+        if sr != self.sr:
+            return float("inf")
+        floor_db = np.mean(_quiet_frames_db(analyze(y)[1] if spec_db is None else spec_db), axis=1)
+        return float(np.median(np.abs(floor_db - self.mean_db)))
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": PROFILE_VERSION,
+            "sr": self.sr,
+            "n_fft": N_FFT,
+            "hop_length": HOP_LENGTH,
+            "frames": self.frames,
+            "created_at": self.created_at,
+            "mean_db_b64": _f32_to_base64(self.mean_db),
+            "std_db_b64": _f32_to_base64(self.std_db),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "NoiseProfile":
+        if data.get("n_fft", N_FFT) != N_FFT or data.get("hop_length", HOP_LENGTH) != HOP_LENGTH:
+            raise ValueError("Perfil de ruído com parâmetros de STFT diferentes")
+        return cls(data["sr"], _base64_to_f32(data["mean_db_b64"]), _base64_to_f32(data["std_db_b64"]),
+                   frames=data.get("frames", 0), created_at=data.get("created_at"))
+
+
+def _smoothing_kernels(sr: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Filtro de suavização da máscara do noisereduce, separado em (freq, tempo):
+    o filtro 2D dele é o produto externo dos dois, então duas convoluções 1D
+    dão o mesmo resultado bem mais rápido.
+    """
+    n_grad_freq = int(FREQ_MASK_SMOOTH_HZ / (sr / (N_FFT / 2)))
+    n_grad_time = int(TIME_MASK_SMOOTH_MS / ((HOP_LENGTH / sr) * 1000))
+    if n_grad_freq <= 1 and n_grad_time <= 1:
+        return None
+
+    def ramp(n):
+        kernel = np.concatenate([np.linspace(0, 1, n + 1, endpoint=False), np.linspace(1, 0, n + 2)])[1:-1]
+        return kernel / np.sum(kernel)
+
+    return ramp(max(1, n_grad_freq)), ramp(max(1, n_grad_time))
+
+
+def spectral_gate(
+    y: np.ndarray,
+    sr: int,
+    profile: NoiseProfile,
+    n_std_thresh: float = N_STD_THRESH,
+    prop_decrease: float = 1.0,
+    analysis: Optional[Tuple[np.ndarray, np.ndarray]] = None
+) -> np.ndarray:
+    """
+    Spectral gating estacionário com o limiar do perfil (um STFT + um ISTFT).
+
+    Args:
+        analysis: (stft, espectro em dB) de y já calculados (ver analyze)
+
+    Returns:
+        Áudio filtrado, mesmo tamanho e dtype de y
+    """
+    from scipy.ndimage import convolve1d
+    from scipy.signal import istft
+
+    sig_stft, sig_db = analysis if analysis is not None else analyze(y)
+    mask = (sig_db > profile.threshold_db(n_std_thresh)[:, None]) * prop_decrease + (1.0 - prop_decrease)
+    kernels = _smoothing_kernels(sr)
+    if kernels is not None:
+        mask = convolve1d(mask, kernels[0], axis=0, mode="constant")
+        mask = convolve1d(mask, kernels[1], axis=1, mode="constant")
+
+    _, denoised = istft(sig_stft * mask, nfft=N_FFT, nperseg=N_FFT, noverlap=N_FFT - HOP_LENGTH)
+    out = np.zeros(len(y), dtype=y.dtype)
+    n = min(len(y), len(denoised))
+    out[:n] = denoised[:n]
+    return out
+
+
+_SAFE_ID = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class NoiseProfileStore:
+    """
+    Perfis de ruído em disco, um arquivo JSON por clone/sessão.
+
+    O cache em memória é validado pelo mtime do arquivo: um perfil recriado
+    ou apagado por outro processo é relido/descartado no próximo get.
+
+    Args:
+        root: Diretório dos perfis
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._profiles: Dict[str, Tuple[int, NoiseProfile]] = {}
+
+    def _path(self, profile_id: str) -> Path:
+        return self.root / f"{_SAFE_ID.sub('_', profile_id)}.noise.json"
+
+    def get(self, profile_id: str) -> Optional[NoiseProfile]:
+        try:
+            with open(self._path(profile_id), "r", encoding="utf-8") as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                cached = self._profiles.get(profile_id)
+                if cached is not None and cached[0] == mtime:
+                    return cached[1]
+                profile = NoiseProfile.from_dict(json.load(f))
+        except FileNotFoundError:
+            self._profiles.pop(profile_id, None)
+            return None
+        except (OSError, ValueError, KeyError):
+            return None
+        self._profiles[profile_id] = (mtime, profile)
+        return profile
+
+    def _write_tmp(self, out: Path, profile: NoiseProfile) -> str:
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{out.name}.", suffix=".tmp", dir=self.root)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(profile.to_dict(), f)
+        return tmp_path
+
+    def put(self, profile_id: str, profile: NoiseProfile):
+        """Grava o perfil (escrita atômica, substitui o existente)."""
+        out = self._path(profile_id)
+        os.replace(self._write_tmp(out, profile), out)
+        self._profiles[profile_id] = (os.stat(out).st_mtime_ns, profile)
+
+    def create(self, profile_id: str, profile: NoiseProfile) -> Tuple[NoiseProfile, bool]:
+        """
+        Grava o perfil só se ainda não existir (criação exclusiva entre processos).
+
+        Returns:
+            Tuple (perfil salvo, True se foi este que criou); quando outro
+            worker criou antes, o perfil dele
+        """
+        out = self._path(profile_id)
+        tmp_path = self._write_tmp(out, profile)
+        try:
+            os.link(tmp_path, out)
+            created = True
+        except FileExistsError:
+            created = False
+        finally:
+            os.remove(tmp_path)
+        if created:
+            self._profiles[profile_id] = (os.stat(out).st_mtime_ns, profile)
+            return profile, True
+        return self.get(profile_id) or profile, False
+
+    def delete(self, profile_id: str) -> bool:
+        self._profiles.pop(profile_id, None)
+        try:
+            os.remove(self._path(profile_id))
+            return True
+        except OSError:
+            return False
+
+
+_default_store: Optional[NoiseProfileStore] = None
+
+
+def get_default_store() -> NoiseProfileStore:
+    """Perfis do processo em $NOISE_PROFILE_DIR (padrão: ./noise_profiles)."""
+    global _default_store
+    if _default_store is None:
+        _default_store = NoiseProfileStore(os.environ.get(PROFILE_DIR_ENV) or "noise_profiles")
+    return _default_store
+
+
+def configure_default_store(root: str) -> NoiseProfileStore:
+    """Substitui o diretório de perfis do processo (ex.: --noise-profile-dir na CLI)."""
+    global _default_store
+    _default_store = NoiseProfileStore(root)
+    return _default_store
+
+
+def cache_token(profile_id: str, store: Optional[NoiseProfileStore] = None) -> List:
+    """Identidade do perfil salvo para chaves de cache: recriar o perfil gera outra chave."""
+    profile = (store or get_default_store()).get(profile_id)
+    return [profile_id, profile.created_at if profile else None]
+
+
+def denoise(
+    y: np.ndarray,
+    sr: int,
+    profile_id: str,
+    store: Optional[NoiseProfileStore] = None,
+    tolerance_db: float = MATCH_TOLERANCE_DB
+) -> Tuple[np.ndarray, Dict]:
+    """
+    Redução de ruído com o perfil do clone/sessão.
+
+    - Sem perfil salvo: estima a partir de y, salva e aplica o gating estacionário
+    - Perfil compatível: gating estacionário direto
+    - Perfil incompatível (sample rate ou piso diferente): noisereduce não-estacionário
+
+    Returns:
+        Tuple (áudio, info) com info = {"mode", "profile_id", "mismatch_db"?}
+    """
+    store = store or get_default_store()
+    profile = store.get(profile_id)
+    info: Dict = {"profile_id": profile_id}
+
+    analysis = analyze(y)
+
+    if profile is None:
+        # Workers em paralelo: só um cria, os outros usam o perfil que ficou salvo
+        profile, created = store.create(profile_id, NoiseProfile.estimate(y, sr, analysis[1]))
+        if created:
+            info["mode"] = "profile_created"
+            logger.info(f"   ✅ Perfil de ruído criado: {profile_id} ({profile.frames} frames)")
+            return spectral_gate(y, sr, profile, analysis=analysis), info
+
+    mismatch = profile.mismatch_db(y, sr, analysis[1])
+    info["mismatch_db"] = mismatch if np.isfinite(mismatch) else None
+    if mismatch <= tolerance_db:
+        info["mode"] = "profile"
+        return spectral_gate(y, sr, profile, analysis=analysis), info
+
+    import noisereduce as nr
+    logger.warning(f"   ⚠️ Ruído não bate com o perfil {profile_id} ({mismatch:.1f} dB): usando modo não-estacionário")
+    info["mode"] = "nonstationary"
+    return nr.reduce_noise(y=y, sr=sr, stationary=False).astype(y.dtype, copy=False), info
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import soundfile as sf
+
+    parser = argparse.ArgumentParser(description="Perfil de ruído por clone/sessão")
+    parser.add_argument("--profile", required=True, help="Id do clone/sessão")
+    parser.add_argument("--dir", default=os.environ.get(PROFILE_DIR_ENV) or "noise_profiles",
+                        help=f"Diretório dos perfis (padrão: ${PROFILE_DIR_ENV} ou ./noise_profiles)")
+    parser.add_argument("--input", help="Áudio: cria o perfil (se não existir) ou aplica o denoise")
+    parser.add_argument("--output", help="Grava o áudio filtrado")
+    parser.add_argument("--reset", action="store_true", help="Apaga o perfil salvo antes")
+    args = parser.parse_args()
+
+    profile_store = NoiseProfileStore(args.dir)
+    if args.reset:
+        profile_store.delete(args.profile)
+
+    result: Dict = {"profile_id": args.profile}
+    if args.input:
+        audio, rate = sf.read(args.input, dtype="float32", always_2d=True)
+        audio = audio.mean(axis=1)
+        denoised, result = denoise(audio, rate, args.profile, profile_store)
+        if args.output:
+            sf.write(args.output, denoised, rate, subtype="PCM_16")
+            result["output"] = args.output
+
+    saved = profile_store.get(args.profile)
+    result["exists"] = saved is not None
+    if saved is not None:
+        result.update({"sr": saved.sr, "frames": saved.frames, "created_at": saved.created_at})
+    print(json.dumps(result))
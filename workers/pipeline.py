@@ -0,0 +1,486 @@
+"""
+Pipeline de pré-processamento declarativo, em etapas
+Uma única implementação das etapas (load → mono → resample → normalize/denoise
+→ bandpass → trim → normalize), com os comportamentos existentes como presets:
+
+- "studio": audio_preprocessor.preprocess_audio — resample polifásico, RMS 0.1
+  antes do denoise, bandpass 80Hz-8kHz e trim no fim
+- "embed": preprocess_and_embed.preprocess_audio — resample soxr, sem
+  bandpass, trim antes de normalizar para RMS 0.07
+
+A saída de cada etapa pode ficar em cache (StageCache) pela chave encadeada
+hash da entrada + configuração das etapas até ela: mudar um parâmetro de uma
+etapa (ex.: top_db do trim) reaproveita tudo o que vem antes e só reexecuta
+dali em diante.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from artifact_store import ArtifactStore, artifact_key
+from audio_io import AudioSource, read_source, source_hash
+from instrumentation import StageProfiler, get_profiler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_ENV = "STAGE_CACHE_DIR"
+
+# Modo de baixa memória: duração (s) de cada bloco do noisereduce (padrão dele: 25s a 24kHz)
+# e padding (s) de cada lado do bloco
+LOW_MEMORY_DENOISE_CHUNK_S = 5
+LOW_MEMORY_DENOISE_PADDING_S = 2
+
+
+class StageContext:
+    """Estado de uma execução: workspace (modo de baixa memória) e metadados das etapas."""
+
+    def __init__(self, workspace=None, info: Optional[Dict] = None):
+        self.workspace = workspace
+        self.info = info if info is not None else {}
+
+
+# Etapas: fn(y, sr, ctx, **params) -> (y, sr). A etapa "load" recebe a fonte em y.
+
+def _load(source, sr, ctx: StageContext, mono: bool = True):
+    import librosa
+    from audio_io import decode_audio
+    if isinstance(source, bytes):
+        y, sr = decode_audio(source, mono=mono)
+        y = y if mono else np.ascontiguousarray(y.T)
+    else:
+        y, sr = librosa.load(source, sr=None, mono=mono)
+    ctx.info["original_sr"] = sr
+    logger.info(f"   📊 Áudio original: {sr}Hz, {y.shape[-1]} samples")
+    return y, sr
+
+
+def _mono(y, sr, ctx: StageContext):
+    if ctx.workspace is not None:
+        y = np.mean(y, axis=0, out=ctx.workspace.get("mono", y.shape[1], y.dtype))
+    else:
+        import librosa
+        y = librosa.to_mono(y)
+    logger.info("   ✅ Convertido para mono")
+    return y, sr
+
+
+def _resample(y, sr, ctx: StageContext, target_sr: int = 24000, method: str = "poly"):
+    if method == "poly":
+        from dsp_chain import get_chain
+        y = get_chain(sr, target_sr, apply_bandpass=False).resample(y)
+    else:
+        import librosa
+        y = librosa.resample(y, orig_sr=sr, target_sr=target_sr, res_type=method)
+    logger.info(f"   ✅ Resampleado: {sr}Hz -> {target_sr}Hz")
+    return y, target_sr
+
+
+def _normalize(y, sr, ctx: StageContext, target_rms: float = 0.1, eps: float = 0.0):
+    if ctx.workspace is not None:
+        from dsp_chain import mean_square
+        rms = np.sqrt(mean_square(y) + eps)
+        if rms > 0:
+            y *= np.float32(target_rms / rms)
+    else:
+        rms = np.sqrt(np.mean(y**2) + eps)
+        if rms > 0:
+            y = y * (target_rms / rms)
+    if rms > 0:
+        logger.info(f"   ✅ Normalizado RMS: {rms:.4f} → {target_rms:.4f}")
+    return y, sr
+
+
+def _denoise(y, sr, ctx: StageContext, noise_profile: Optional[str] = None):
+    import noisereduce as nr
+    try:
+        if noise_profile:
+            # Perfil do clone: gating estacionário, não-estacionário se não bater
+            from noise_profile import denoise
+            y, ctx.info["denoise"] = denoise(y, sr, noise_profile)
+        elif ctx.workspace is not None:
+            # Blocos menores (padding = constante de tempo do filtro): o STFT
+            # do noisereduce é o maior pico do pipeline
+            y = nr.reduce_noise(y=y, sr=sr, stationary=False,
+                                chunk_size=LOW_MEMORY_DENOISE_CHUNK_S * sr,
+                                padding=LOW_MEMORY_DENOISE_PADDING_S * sr).astype(np.float32, copy=False)
+        else:
+            y = nr.reduce_noise(y=y, sr=sr, stationary=False)
+        logger.info("   ✅ Ruído reduzido")
+    except Exception as e:
+        logger.warning(f"   ⚠️ Erro na redução de ruído: {e}")
+    return y, sr
+
+
+def _bandpass(y, sr, ctx: StageContext, low: float = 80.0, high: float = 8000.0, order: int = 4):
+    # SOS de fase zero (dsp_chain), in-place no modo de baixa memória
+    from dsp_chain import get_chain
+    chain = get_chain(sr, sr, True, low, high, order)
+    y = chain.bandpass_inplace(y, ctx.workspace) if ctx.workspace is not None else chain.bandpass(y)
+    logger.info(f"   ✅ Filtro bandpass aplicado ({low:g}Hz-{high / 1000:g}kHz)")
+    return y, sr
+
+
+def _trim(y, sr, ctx: StageContext, top_db: float = 25):
+    import librosa.effects
+    y_trimmed, _ = librosa.effects.trim(y, top_db=top_db)
+    if len(y_trimmed) < len(y):
+        logger.info(f"   ✅ Silêncio removido: {len(y)} → {len(y_trimmed)} samples")
+        y = y_trimmed
+    return y, sr
+
+
+# nome -> (função, condição para executar; None = sempre)
+STAGES: Dict[str, Tuple[Callable, Optional[Callable]]] = {
+    "load": (_load, None),
+    "mono": (_mono, lambda y, sr, params: y.ndim > 1),
+    "resample": (_resample, lambda y, sr, params: sr != params["target_sr"]),
+    "normalize": (_normalize, None),
+    "denoise": (_denoise, None),
+    "bandpass": (_bandpass, None),
+    "trim": (_trim, None),
+}
+
+# Presets: sequência de (etapa, parâmetros). target_sr entra no resample.
+PRESETS: Dict[str, List[Tuple[str, Dict]]] = {
+    "studio": [
+        ("load", {"mono": False}),
+        ("mono", {}),
+        ("resample", {"method": "poly"}),
+        ("normalize", {"target_rms": 0.1}),
+        ("denoise", {}),
+        ("bandpass", {"low": 80.0, "high": 8000.0, "order": 4}),
+        ("trim", {"top_db": 25}),
+    ],
+    "embed": [
+        ("load", {"mono": True}),
+        ("mono", {}),
+        ("resample", {"method": "soxr_hq"}),
+        ("denoise", {}),
+        ("trim", {"top_db": 25}),
+        ("normalize", {"target_rms": 0.07, "eps": 1e-9}),
+    ],
+}
+
+
+class Stage:
+    """Uma etapa configurada do pipeline."""
+
+    def __init__(self, name: str, params: Optional[Dict] = None):
+        if name not in STAGES:
+            raise ValueError(f"Etapa desconhecida: {name}")
+        self.name = name
+        self.params = dict(params or {})
+        self.fn, self.condition = STAGES[name]
+
+    def cache_config(self, low_memory: bool = False) -> Dict:
+        """
+        Configuração que entra na chave (o perfil de ruído salvo também conta).
+
+        Args:
+            low_memory: Execução no modo de baixa memória: o denoise em blocos
+                gera outra saída, então não compartilha chave com o modo normal
+        """
+        config = dict(self.params)
+        if low_memory and self.name == "denoise" and not config.get("noise_profile"):
+            config["low_memory"] = {"chunk_s": LOW_MEMORY_DENOISE_CHUNK_S,
+                                    "padding_s": LOW_MEMORY_DENOISE_PADDING_S}
+        if config.get("noise_profile"):
+            from noise_profile import cache_token
+            config["noise_profile"] = cache_token(config["noise_profile"])
+        return config
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, {self.params!r})"
+
+
+class StageCache:
+    """
+    Saídas de etapa por chave: LRU em memória (limitado em bytes) e, com
+    store, também no armazenamento de artefatos (arquivo .npy por etapa).
+
+    Args:
+        max_memory_bytes: Tamanho máximo do nível em memória
+        store: ArtifactStore para o nível em disco (None = só memória)
+    """
+
+    def __init__(self, max_memory_bytes: int = 256 * 1024 * 1024, store: Optional[ArtifactStore] = None):
+        self.max_memory_bytes = max_memory_bytes
+        self.store = store
+        self._memory: "OrderedDict[str, Tuple[np.ndarray, int, Dict]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory": 0, "disk": 0, "miss": 0}
+
+    def _remember(self, key: str, y: np.ndarray, sr: int, info: Dict):
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[0].nbytes
+            self._memory[key] = (y, sr, info)
+            self._memory_bytes += y.nbytes
+            while self._memory_bytes > self.max_memory_bytes and self._memory:
+                self._memory_bytes -= self._memory.popitem(last=False)[1][0].nbytes
+
+    def get(self, key: str) -> Tuple[Optional[Tuple[np.ndarray, int, Dict]], str]:
+        """
+        Returns:
+            Tuple ((áudio, sr, info) ou None, nível: "memory", "disk" ou "miss").
+            O áudio é uma cópia: as etapas podem alterá-lo in-place.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory"] += 1
+                y, sr, info = self._memory[key]
+                return (y.copy(), sr, dict(info)), "memory"
+
+        if self.store is not None:
+            manifest = self.store.get(key)
+            if manifest is not None:
+                try:
+                    y = np.load(manifest["files"]["audio"])
+                except (OSError, ValueError, KeyError):
+                    y = None
+                if y is not None:
+                    sr, info = manifest["metadata"]["sr"], manifest["metadata"].get("info", {})
+                    self._remember(key, y, sr, info)
+                    with self._lock:
+                        self.stats["disk"] += 1
+                    return (y.copy(), sr, dict(info)), "disk"
+
+        with self._lock:
+            self.stats["miss"] += 1
+        return None, "miss"
+
+    def put(self, key: str, y: np.ndarray, sr: int, info: Dict):
+        # Cópia: y pode ser um buffer do workspace ou ser alterado pela etapa seguinte
+        y = np.array(y, copy=True)
+        self._remember(key, y, sr, dict(info))
+        if self.store is not None and self.store.get(key) is None:
+            staging = self.store.staging_dir()
+            np.save(staging / "audio.npy", y)
+            self.store.publish(key, staging, {"audio": "audio.npy"}, {"sr": sr, "info": info})
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+
+class Pipeline:
+    """
+    Sequência de etapas; use build_pipeline() para montar a partir de um preset.
+    """
+
+    def __init__(self, name: str, stages: List[Stage]):
+        self.name = name
+        self.stages = stages
+
+    def describe(self) -> List[Dict]:
+        return [{"stage": s.name, "params": s.params} for s in self.stages]
+
+    def keys(self, input_hash: str, low_memory: bool = False, start: int = 0) -> List[str]:
+        """
+        Chave de cache de cada etapa: encadeia hash da entrada e configurações.
+
+        Args:
+            input_hash: Hash da entrada, ou a chave da etapa start - 1
+            start: Primeira etapa a calcular (as chaves retornadas começam nela)
+        """
+        keys = []
+        key = input_hash
+        for stage in self.stages[start:]:
+            key = artifact_key(key, f"stage:{stage.name}", stage.cache_config(low_memory))
+            keys.append(key)
+        return keys
+
+    def run(
+        self,
+        source: AudioSource,
+        profiler: Optional[StageProfiler] = None,
+        cache: Optional[StageCache] = None,
+        workspace=None
+    ) -> Tuple[np.ndarray, int, Dict]:
+        """
+        Executa o pipeline a partir de uma fonte de áudio (caminho, "-", data
+        URL ou bytes). Com cache, retoma da etapa mais avançada já calculada.
+
+        Args:
+            source: Áudio de entrada
+            profiler: Instrumentação por etapa (opt-in)
+            cache: StageCache para reaproveitar/guardar as saídas das etapas
+            workspace: dsp_chain.Workspace para o modo de baixa memória
+
+        Returns:
+            Tuple (áudio, sample rate, info); info traz "original_sr", "denoise"
+            (com perfil de ruído) e, com cache, "cache"
+        """
+        source = read_source(source)
+        ctx = StageContext(workspace)
+        prof = get_profiler(profiler)
+        start = 0
+        y, sr = source, None
+        keys = None
+
+        if cache is not None:
+            with prof.stage("cache_lookup"):
+                keys = self.keys(source_hash(source), low_memory=workspace is not None)
+                for i in range(len(self.stages) - 1, -1, -1):
+                    hit, tier = cache.get(keys[i])
+                    if hit is not None:
+                        y, sr, ctx.info = hit
+                        start = i + 1
+                        logger.info(f"   ♻️ Etapas até '{self.stages[i].name}' reaproveitadas do cache ({tier})")
+                        break
+
+        y, sr = self._run_stages(y, sr, ctx, prof, start, cache, keys)
+        if cache is not None:
+            ctx.info["cache"] = {
+                "reused": self.stages[start - 1].name if start else None,
+                "computed": [s.name for s in self.stages[start:]],
+            }
+        return y, sr, ctx.info
+
+    def run_signal(
+        self,
+        y: np.ndarray,
+        sr: int,
+        profiler: Optional[StageProfiler] = None,
+        workspace=None
+    ) -> Tuple[np.ndarray, int, Dict]:
+        """Executa as etapas seguintes ao load sobre um áudio já em memória (sem cache)."""
+        ctx = StageContext(workspace)
+        start = 1 if self.stages and self.stages[0].name == "load" else 0
+        y, sr = self._run_stages(y, sr, ctx, get_profiler(profiler), start, None, None)
+        return y, sr, ctx.info
+
+    def _run_stages(self, y, sr, ctx, prof, start, cache, keys):
+        for i in range(start, len(self.stages)):
+            stage = self.stages[i]
+            if stage.condition is None or stage.condition(y, sr, stage.params):
+                with prof.stage(stage.name):
+                    y, sr = stage.fn(y, sr, ctx, **stage.params)
+            if cache is not None:
+                if stage.name == "denoise" and stage.params.get("noise_profile") and i:
+                    # A chave foi calculada antes do denoise: se o perfil foi criado
+                    # agora (ou por outro worker), a saída é do perfil que ficou salvo
+                    keys[i:] = self.keys(keys[i - 1], ctx.workspace is not None, start=i)
+                cache.put(keys[i], y, sr, ctx.info)
+        return y, sr
+
+
+def build_pipeline(
+    preset: str = "studio",
+    target_sr: int = 24000,
+    overrides: Optional[Dict[str, Optional[Dict]]] = None
+) -> Pipeline:
+    """
+    Monta um pipeline a partir de um preset.
+
+    Args:
+        preset: "studio" ou "embed"
+        target_sr: Sample rate alvo (parâmetro do resample)
+        overrides: Etapa -> parâmetros a sobrescrever, ou None/False para
+            remover a etapa (ex.: {"trim": {"top_db": 30}, "bandpass": None})
+
+    Returns:
+        Pipeline configurado
+    """
+    if preset not in PRESETS:
+        raise ValueError(f"Preset desconhecido: {preset} (disponíveis: {', '.join(PRESETS)})")
+    overrides = dict(overrides or {})
+    unknown = set(overrides) - {name for name, _ in PRESETS[preset]}
+    if unknown:
+        raise ValueError(f"Etapas fora do preset '{preset}': {', '.join(sorted(unknown))}")
+
+    stages = []
+    for name, params in PRESETS[preset]:
+        params = dict(params)
+        if name == "resample":
+            params["target_sr"] = target_sr
+        if name in overrides:
+            if not overrides[name] and overrides[name] != {}:
+                continue
+            params.update(overrides[name])
+        stages.append(Stage(name, params))
+    return Pipeline(preset, stages)
+
+
+_default_cache: Optional[StageCache] = None
+
+
+def get_default_cache() -> StageCache:
+    """Cache de etapas do processo; com STAGE_CACHE_DIR também guarda em disco."""
+    global _default_cache
+    if _default_cache is None:
+        root = os.environ.get(CACHE_DIR_ENV)
+        _default_cache = StageCache(store=ArtifactStore(root) if root else None)
+    return _default_cache
+
+
+def configure_default_cache(root: Optional[str] = None, **kwargs) -> StageCache:
+    """Substitui o cache de etapas do processo (ex.: --stage-cache na CLI)."""
+    global _default_cache
+    _default_cache = StageCache(store=ArtifactStore(root) if root else None, **kwargs)
+    return _default_cache
+
+
+def _parse_override(text: str) -> Tuple[str, str, object]:
+    """"trim.top_db=30" -> ("trim", "top_db", 30)."""
+    import json
+    target, _, value = text.partition("=")
+    stage, _, param = target.partition(".")
+    if not stage or not param or not value:
+        raise ValueError(f"Use etapa.parametro=valor: {text}")
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        parsed = value
+    return stage, param, parsed
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description="Pipeline de pré-processamento em etapas (presets studio/embed)")
+    parser.add_argument("input", nargs="?", help="Áudio de entrada")
+    parser.add_argument("output", nargs="?", help="WAV processado")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="studio", help="Preset (padrão: studio)")
+    parser.add_argument("--target-sr", type=int, default=24000, help="Sample rate alvo (padrão: 24000)")
+    parser.add_argument("--set", action="append", default=[], metavar="ETAPA.PARAM=VALOR",
+                        help="Sobrescreve um parâmetro (ex.: trim.top_db=30, normalize.target_rms=0.08)")
+    parser.add_argument("--skip", action="append", default=[], metavar="ETAPA", help="Remove uma etapa do preset")
+    parser.add_argument("--stage-cache", metavar="DIR",
+                        help="Cache das saídas de etapa em disco (padrão: $STAGE_CACHE_DIR; sem ele, só memória)")
+    parser.add_argument("--describe", action="store_true", help="Só imprime as etapas do pipeline")
+    parser.add_argument("--profile", action="store_true", help="Mede tempo/CPU/memória por etapa")
+    args = parser.parse_args()
+
+    overrides: Dict[str, Optional[Dict]] = {name: None for name in args.skip}
+    for text in args.set:
+        stage_name, param, value = _parse_override(text)
+        overrides.setdefault(stage_name, {})[param] = value
+    pipeline = build_pipeline(args.preset, args.target_sr, overrides)
+
+    if args.describe:
+        print(json.dumps(pipeline.describe()))
+        sys.exit(0)
+    if not args.input or not args.output:
+        parser.error("informe <input> <output>")
+
+    import soundfile as sf
+    cache = configure_default_cache(args.stage_cache) if args.stage_cache else get_default_cache()
+    profiler = StageProfiler(labels={"pipeline": args.preset}) if args.profile else None
+    y, sr, info = pipeline.run(args.input, profiler=profiler, cache=cache)
+    sf.write(args.output, y, sr, subtype="PCM_16")
+    info.update({"output": args.output, "sample_rate": sr, "duration": len(y) / sr})
+    if profiler:
+        info["stages"] = profiler.as_list()
+    print(json.dumps(info))
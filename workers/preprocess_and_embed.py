@@ -1,144 +1,463 @@
 """
 Script Python de Pré-processamento + Extração de Embedding
 Versão integrada e otimizada para o pipeline profissional
+
+Imports pesados (librosa, noisereduce, torch/resemblyzer) e o VoiceEncoder
+são carregados só no primeiro uso; use warm_up() para pagar esse custo antes.
 """
 
 import os
 from pathlib import Path
 import numpy as np
-import librosa
-import soundfile as sf
-import noisereduce as nr
-import base64
 import json
 import logging
 import sys
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
 
-# Patch para webrtcvad opcional
-try:
-    import webrtcvad
-except ImportError:
-    # Criar mock do webrtcvad se não estiver disponível
-    # O resemblyzer chama vad.is_speech(buf, sample_rate=16000)
-    class MockVad:
-        def __init__(self, mode=2):
-            self.mode = mode
-        
-        def is_speech(self, buf, sample_rate=16000):
-            # Aceita buf e sample_rate (com default) mas sempre retorna True (voz ativa)
-            return True
-    
-    class MockWebRTCVad:
-        Vad = MockVad
-    
-    sys.modules['webrtcvad'] = MockWebRTCVad()
-
-# Agora pode importar resemblyzer
-from resemblyzer import VoiceEncoder, preprocess_wav
+from artifact_store import ArtifactStore
+from audio_io import (
+    AudioSource,
+    audio_payload,
+    describe_source,
+    load_audio,
+    read_source,
+    source_hash,
+    to_data_url,
+)
+from embedding_format import (
+    BINARY_SUFFIX,
+    base64_to_embedding,
+    embedding_to_base64,
+    load_embedding,
+    save_embedding_bin,
+)
+from instrumentation import StageProfiler, get_profiler
+from vad import keep_voiced
+from voice_aggregate import VoiceAggregate
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicializar encoder uma vez (reutilizável)
-encoder = VoiceEncoder()  # resemblyzer
+# Encoder criado uma vez, no primeiro uso (reutilizável)
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """
+    Retorna o encoder do processo, carregando o backend configurado (ver
+    encoder_backend; padrão: VoiceEncoder eager) na primeira chamada.
+    """
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                from encoder_backend import load_encoder
+                _encoder = load_encoder()
+    return _encoder
 
 
-def preprocess_audio(in_path: str, out_path: str, target_sr: int = 24000):
+def set_encoder_backend(spec: Optional[str]) -> str:
     """
-    Pré-processa áudio seguindo pipeline profissional:
+    Seleciona o backend do encoder ("torch", "torchscript", "onnx", com
+    ":int8" opcional); um encoder já carregado com outro backend é descartado.
+    """
+    global _encoder
+    from encoder_backend import configure_backend
+    with _encoder_lock:
+        spec = configure_backend(spec)
+        if _encoder is not None and _encoder.spec != spec:
+            _encoder = None
+    return spec
+
+
+def is_encoder_loaded() -> bool:
+    """Indica se o encoder já foi carregado neste processo."""
+    return _encoder is not None
+
+
+def warm_up():
+    """
+    Carrega a pilha de ML e o encoder e roda uma inferência curta, para que
+    a primeira requisição real não pague o cold start.
+    """
+    import librosa  # noqa: F401
+    import noisereduce  # noqa: F401
+    get_encoder().embed_utterance(np.zeros(16000, dtype=np.float32))
+
+
+def __getattr__(name):
+    # Compatibilidade: `from preprocess_and_embed import encoder` continua funcionando
+    if name == "encoder":
+        return get_encoder()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def preprocess_signal(
+    y: np.ndarray,
+    sr: int,
+    target_sr: int = 24000,
+    profiler: Optional[StageProfiler] = None,
+    noise_profile: Optional[str] = None
+) -> np.ndarray:
+    """
+    Pré-processa um áudio em memória seguindo pipeline profissional:
     - Conversão para mono
     - Resample para target_sr
     - Redução de ruído
     - Trim de silêncio
     - Normalização RMS
+    
+    Args:
+        profiler: Instrumentação por etapa (opt-in)
+        noise_profile: Id do clone/sessão: denoise estacionário com o perfil
+            de ruído salvo (ver noise_profile)
+    
+    Returns:
+        Áudio float32 processado em target_sr
     """
+    from pipeline import build_pipeline
+    
+    # Etapas do preset "embed" (ver pipeline)
+    overrides = {"denoise": {"noise_profile": noise_profile}} if noise_profile else None
+    yt, _, _ = build_pipeline("embed", target_sr, overrides).run_signal(y, sr, profiler=profiler)
+    
+    return yt.astype(np.float32, copy=False)
+
+
+def preprocess_audio(
+    in_path: str,
+    out_path: str,
+    target_sr: int = 24000,
+    profiler: Optional[StageProfiler] = None,
+    stage_cache=None
+):
+    """
+    Pré-processa áudio do disco (ver preprocess_signal) e salva em out_path.
+    Com stage_cache (pipeline.StageCache) reaproveita as etapas já calculadas.
+    """
+    import soundfile as sf
+    from pipeline import build_pipeline
+    
     logger.info(f"🎵 Pré-processando: {in_path} -> {out_path}")
+    prof = get_profiler(profiler)
     
-    y, sr = librosa.load(in_path, sr=None)
-    
-    # Mono
-    if y.ndim > 1:
-        y = librosa.to_mono(y)
-        logger.info("   ✅ Convertido para mono")
-    
-    # Resample
-    if sr != target_sr:
-        y = librosa.resample(y, orig_sr=sr, target_sr=target_sr)
-        logger.info(f"   ✅ Resampleado: {sr}Hz -> {target_sr}Hz")
-    
-    # Noise reduction
-    try:
-        y = nr.reduce_noise(y=y, sr=target_sr)
-        logger.info("   ✅ Ruído reduzido")
-    except Exception as e:
-        logger.warning(f"   ⚠️ Erro no noisereduce: {e}")
-    
-    # Trim silence (substitui webrtcvad - mais preciso!)
-    # Librosa.effects.trim é melhor que webrtcvad para remoção de silêncio
-    yt, _ = librosa.effects.trim(y, top_db=25)
-    if len(yt) < len(y):
-        logger.info(f"   ✅ Silêncio removido: {len(y)} -> {len(yt)} samples (melhor que webrtcvad!)")
-    
-    # Normalize RMS
-    rms = np.sqrt(np.mean(yt**2) + 1e-9)
-    if rms > 0:
-        target_rms = 0.07
-        yt = yt * (target_rms / rms)
-        logger.info(f"   ✅ RMS normalizado: {rms:.4f} -> {target_rms:.4f}")
+    yt, _, _ = build_pipeline("embed", target_sr).run(in_path, profiler=prof, cache=stage_cache)
+    yt = yt.astype(np.float32, copy=False)
     
     # Garantir que diretório existe
     Path(out_path).parent.mkdir(parents=True, exist_ok=True)
     
-    sf.write(out_path, yt, samplerate=target_sr, subtype="PCM_16")
+    with prof.stage("write"):
+        sf.write(out_path, yt, samplerate=target_sr, subtype="PCM_16")
     logger.info(f"   ✅ Áudio salvo: {out_path}")
     
     return out_path
 
 
-def extract_embedding(wav_path: str):
+def extract_embedding(wav_path: AudioSource, profiler: Optional[StageProfiler] = None, vad: bool = True):
     """
     Extrai embedding de voz usando Resemblyzer.
     
     Args:
-        wav_path: Caminho do áudio pré-processado
+        wav_path: Áudio pré-processado: caminho, data URL ou bytes
+        profiler: Instrumentação por etapa (opt-in)
+        vad: Embedar só os trechos com voz (pausas e respirações ficam de fora)
     
     Returns:
         numpy array com embedding
     """
-    logger.info(f"🎤 Extraindo embedding: {wav_path}")
+    logger.info(f"🎤 Extraindo embedding: {describe_source(wav_path)}")
     
     # Usar método direto (sem preprocess_wav) para evitar problema com webrtcvad
     # O áudio já foi pré-processado, então podemos carregar direto
     logger.info("   🔄 Carregando áudio para extração de embedding...")
     
+    prof = get_profiler(profiler)
+    
     # Resemblyzer requer 16kHz
-    wav, sr = librosa.load(wav_path, sr=16000)
-    emb = encoder.embed_utterance(wav)
+    with prof.stage("load"):
+        wav, sr = load_audio(wav_path, sr=16000)
+    if vad:
+        with prof.stage("vad"):
+            wav = keep_voiced(wav, 16000)
+    with prof.stage("embed"):
+        emb = get_encoder().embed_utterance(wav)
+    
+    logger.info(f"   ✅ Embedding extraído: shape {emb.shape}")
+    return emb
+
+
+def embed_signal(
+    y: np.ndarray,
+    sr: int,
+    profiler: Optional[StageProfiler] = None,
+    vad: bool = True
+) -> np.ndarray:
+    """
+    Extrai embedding de um áudio já em memória (resample direto para 16kHz).
+    Com vad=True só os trechos com voz vão para o encoder.
+    """
+    prof = get_profiler(profiler)
     
+    # Resemblyzer requer 16kHz
+    if sr != 16000:
+        import librosa
+        with prof.stage("resample_16k"):
+            y = librosa.resample(y, orig_sr=sr, target_sr=16000)
+    if vad:
+        with prof.stage("vad"):
+            y = keep_voiced(y, 16000)
+    with prof.stage("embed"):
+        emb = get_encoder().embed_utterance(y.astype(np.float32, copy=False))
     logger.info(f"   ✅ Embedding extraído: shape {emb.shape}")
     return emb
 
 
-def embedding_to_base64(emb: np.ndarray):
+def preprocess_and_embed(
+    in_path: AudioSource,
+    out_path: Optional[str] = None,
+    target_sr: int = 24000,
+    profiler: Optional[StageProfiler] = None,
+    store: Optional[ArtifactStore] = None,
+    noise_profile: Optional[str] = None
+) -> Tuple[np.ndarray, Optional[str]]:
+    """
+    Pré-processa e extrai o embedding sem ida e volta por WAV em disco.
+    
+    O áudio float processado segue direto para o resample de 16kHz e o
+    encoder, evitando escrita PCM_16, nova decodificação e segundo resample.
+    
+    Args:
+        in_path: Áudio de entrada: caminho, "-" (stdin), data URL ou bytes
+        out_path: Se informado, também salva o áudio processado (target_sr)
+        target_sr: Sample rate do áudio processado
+        profiler: Instrumentação por etapa (opt-in)
+        store: Armazenamento de artefatos; a mesma entrada reaproveita o
+            WAV processado e o embedding já salvos
+        noise_profile: Id do clone/sessão para o denoise com perfil de ruído
+    
+    Returns:
+        Tuple (embedding, out_path ou None)
+    """
+    emb, _ = _preprocess_and_embed(in_path, out_path, target_sr, profiler, store, noise_profile)
+    return emb, out_path
+
+
+def _preprocess_and_embed(
+    in_path: AudioSource,
+    out_path: Optional[str],
+    target_sr: int,
+    profiler: Optional[StageProfiler],
+    store: Optional[ArtifactStore],
+    noise_profile: Optional[str] = None
+):
+    """
+    Retorna (embedding, áudio processado): o array em memória ou, com
+    store, o caminho do WAV no armazenamento.
+    """
+    in_path = read_source(in_path)
+    if store is not None:
+        return _preprocess_and_embed_stored(in_path, out_path, target_sr, profiler, store, noise_profile)
+    
+    import soundfile as sf
+    
+    logger.info(f"🎵 Pré-processando e extraindo embedding: {describe_source(in_path)}")
+    prof = get_profiler(profiler)
+    
+    with prof.stage("load"):
+        y, sr = load_audio(in_path)
+    yt = preprocess_signal(y, sr, target_sr, profiler=prof, noise_profile=noise_profile)
+    
+    if out_path:
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+        with prof.stage("write"):
+            sf.write(out_path, yt, samplerate=target_sr, subtype="PCM_16")
+        logger.info(f"   ✅ Áudio salvo: {out_path}")
+    
+    emb = embed_signal(yt, target_sr, profiler=prof)
+    return emb, yt
+
+
+def _preprocess_and_embed_stored(
+    in_path: AudioSource,
+    out_path: Optional[str],
+    target_sr: int,
+    profiler: Optional[StageProfiler],
+    store: ArtifactStore,
+    noise_profile: Optional[str] = None
+) -> Tuple[np.ndarray, str]:
+    """preprocess_and_embed com resultado endereçado pelo conteúdo da entrada."""
+    from artifact_store import artifact_key, materialize
+    from embedding_cache import EMBEDDING_CONFIG
+    from encoder_backend import model_id
+
+    prof = get_profiler(profiler)
+    input_hash = source_hash(in_path)
+
+    def store_key() -> Tuple[str, bool]:
+        config = dict(EMBEDDING_CONFIG, target_sr=target_sr)
+        if noise_profile:
+            # O resultado depende do perfil salvo: recriar o perfil gera outra chave
+            from noise_profile import cache_token
+            config["noise_profile"] = cache_token(noise_profile)
+        profile_saved = not noise_profile or config["noise_profile"][1] is not None
+        return artifact_key(input_hash, "embed", config, model_id()), profile_saved
+
+    with prof.stage("store_lookup"):
+        key, profile_saved = store_key()
+
+    def build(staging: Path):
+        emb, _ = _preprocess_and_embed(in_path, str(staging / "audio.wav"), target_sr, prof, None, noise_profile)
+        save_embedding_bin(emb, str(staging / ("embedding" + BINARY_SUFFIX)), model=model_id())
+        return {"audio": "audio.wav", "embedding": "embedding" + BINARY_SUFFIX}, {"target_sr": target_sr}
+
+    if profile_saved:
+        manifest, hit = store.get_or_create(key, build)
+        if hit:
+            logger.info(f"   ✅ Artefato reaproveitado: {key[:12]}")
+    else:
+        # Sem perfil salvo ainda: esta amostra o cria, e a chave só existe depois
+        staging = store.staging_dir()
+        files, metadata = build(staging)
+        manifest = store.publish(store_key()[0], staging, files, metadata)
+
+    with prof.stage("store_materialize"):
+        emb = load_embedding(manifest["files"]["embedding"], mmap=False)
+        if out_path:
+            materialize(manifest["files"]["audio"], out_path)
+    return emb, manifest["files"]["audio"]
+
+
+def embed_source(
+    source: AudioSource,
+    out_path: Optional[str] = None,
+    target_sr: int = 24000,
+    profiler: Optional[StageProfiler] = None,
+    store: Optional[ArtifactStore] = None,
+    audio_format: Optional[str] = None,
+    noise_profile: Optional[str] = None
+) -> Dict:
     """
-    Converte embedding numpy para base64 string.
+    preprocess_and_embed com resultado pronto para JSON (stdout ou daemon),
+    sem arquivos temporários.
+
+    Args:
+        audio_format: Se informado ("wav", "flac", "mp3", "opus"), inclui o
+            áudio processado em "audio" como data URL
+
+    Returns:
+        Dict com embedding, shape, out_path e, opcionalmente, audio
     """
-    return base64.b64encode(emb.tobytes()).decode("utf-8")
+    emb, audio = _preprocess_and_embed(source, out_path, target_sr, profiler, store, noise_profile)
+    result = {"embedding": emb.tolist(), "shape": list(emb.shape), "out_path": out_path}
+    if audio_format:
+        if isinstance(audio, str):
+            if audio_format == "wav":
+                data = Path(audio).read_bytes()
+                result["audio"] = {"format": "wav", "sample_rate": target_sr, "bytes": len(data),
+                                   "data_url": to_data_url(data, "audio/wav")}
+                return result
+            audio, _ = load_audio(audio)
+        result["audio"] = audio_payload(audio, target_sr, audio_format)
+    return result
 
 
-def base64_to_embedding(b64_str: str) -> np.ndarray:
+def embed_wavs_batch(
+    wavs: Sequence[np.ndarray],
+    batch_size: int = 32,
+    rate: float = 1.3,
+    min_coverage: float = 0.75,
+    vad: bool = True
+) -> List[np.ndarray]:
     """
-    Converte base64 string para embedding numpy.
+    Extrai embeddings de várias falas (16kHz) agrupando as janelas parciais
+    de todas elas em lotes compartilhados do encoder.
+    
+    Equivalente a chamar embed_signal em cada wav, mas com poucos forward
+    passes grandes em vez de um pequeno por arquivo.
+    
+    Args:
+        wavs: Lista de áudios float32 em 16kHz
+        batch_size: Número de janelas parciais por forward pass
+        rate: Janelas parciais por segundo (igual ao embed_utterance)
+        min_coverage: Cobertura mínima da última janela (igual ao embed_utterance)
+        vad: Embedar só os trechos com voz de cada áudio
+    
+    Returns:
+        Lista com um embedding por áudio, na mesma ordem
     """
-    bytes_data = base64.b64decode(b64_str)
-    return np.frombuffer(bytes_data, dtype=np.float32)
+    if batch_size < 1:
+        raise ValueError("batch_size deve ser >= 1")
+    
+    from encoder_backend import mel_spectrogram
+    encoder = get_encoder()
+    
+    # Janelas parciais de todos os áudios, com o índice do áudio de origem
+    partial_mels = []
+    owners = []
+    for i, wav in enumerate(wavs):
+        if vad:
+            wav = keep_voiced(wav, 16000)
+        wav_slices, mel_slices = encoder.compute_partial_slices(len(wav), rate, min_coverage)
+        max_wave_length = wav_slices[-1].stop
+        if max_wave_length >= len(wav):
+            wav = np.pad(wav, (0, max_wave_length - len(wav)), "constant")
+        mel = mel_spectrogram(wav)
+        for s in mel_slices:
+            partial_mels.append(mel[s])
+            owners.append(i)
+    
+    mels = np.array(partial_mels)
+    partial_embeds = np.empty((len(mels), encoder.embedding_size), dtype=np.float32)
+    for start in range(0, len(mels), batch_size):
+        partial_embeds[start:start + batch_size] = encoder.embed_partials(mels[start:start + batch_size])
+    
+    # Embedding de cada fala = média normalizada (L2) das suas janelas parciais
+    owners = np.array(owners)
+    embeddings = []
+    for i in range(len(wavs)):
+        raw_embed = partial_embeds[owners == i].mean(axis=0)
+        embeddings.append(raw_embed / np.linalg.norm(raw_embed, 2))
+    
+    logger.info(f"   ✅ {len(wavs)} embeddings extraídos em lote ({len(mels)} janelas, batch {batch_size})")
+    return embeddings
+
+
+def extract_embeddings_batch(
+    wav_paths: Sequence[str],
+    batch_size: int = 32
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Extrai embeddings de vários áudios pré-processados de uma vez.
+    
+    Args:
+        wav_paths: Caminhos dos áudios pré-processados
+        batch_size: Número de janelas parciais por forward pass
+    
+    Returns:
+        Tuple (embeddings por arquivo, embedding combinado normalizado)
+    """
+    import librosa
+    
+    logger.info(f"🎤 Extraindo embeddings em lote: {len(wav_paths)} arquivos")
+    
+    # Resemblyzer requer 16kHz
+    wavs = [librosa.load(path, sr=16000)[0] for path in wav_paths]
+    embeddings = embed_wavs_batch(wavs, batch_size=batch_size)
+    
+    combined = VoiceAggregate.from_embeddings(embeddings).combined("average")
+    return embeddings, combined
 
 
-def save_embedding_json(emb: np.ndarray, out_json: str):
+def save_embedding_json(emb: np.ndarray, out_json: str, model: Optional[str] = None):
     """
-    Salva embedding em arquivo JSON.
+    Salva embedding em arquivo JSON, com o id do modelo (padrão: o do backend atual).
     """
-    obj = {"embedding": emb.tolist(), "shape": list(emb.shape), "dtype": str(emb.dtype)}
+    from encoder_backend import model_id
+    obj = {"embedding": emb.tolist(), "shape": list(emb.shape), "dtype": str(emb.dtype),
+           "model": model or model_id()}
     
     Path(out_json).parent.mkdir(parents=True, exist_ok=True)
     
@@ -150,39 +469,122 @@ def save_embedding_json(emb: np.ndarray, out_json: str):
 
 def load_embedding_json(json_path: str) -> np.ndarray:
     """
-    Carrega embedding de arquivo JSON.
+    Carrega embedding de arquivo JSON (ou do formato binário .emb, mapeado em memória).
     """
-    with open(json_path, "r", encoding="utf-8") as f:
-        obj = json.load(f)
-    
-    return np.array(obj["embedding"], dtype=np.float32)
+    return load_embedding(json_path)
+
+
+def save_embedding_file(emb: np.ndarray, out_base: str, fmt: str = "json") -> str:
+    """
+    Salva embedding ao lado do áudio: <out_base>.emb.json ou <out_base>.emb (binário).
+    """
+    from encoder_backend import model_id
+    if fmt == "bin":
+        out_path = save_embedding_bin(emb, out_base + BINARY_SUFFIX, model=model_id())
+        logger.info(f"   ✅ Embedding salvo: {out_path}")
+        return out_path
+    save_embedding_json(emb, out_base + ".emb.json", model=model_id())
+    return out_base + ".emb.json"
 
 
 if __name__ == "__main__":
     import argparse
+    from encoder_backend import add_backend_argument, model_id
     
     p = argparse.ArgumentParser(description="Pré-processa áudio e extrai embedding")
-    p.add_argument("--input", required=True, help="Caminho do áudio de entrada")
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help='Caminho do áudio de entrada ("-" lê o áudio codificado do stdin)')
+    source.add_argument("--inputs", nargs='+', help="Modo lote: áudios já pré-processados para extrair embeddings")
     p.add_argument("--out", required=False, help="Caminho de saída (opcional)")
     p.add_argument("--target-sr", type=int, default=24000, help="Sample rate alvo (padrão: 24000)")
+    p.add_argument("--no-wav", action="store_true", help="Não salvar o áudio processado (apenas o embedding)")
+    p.add_argument("--batch-size", type=int, default=32, help="Janelas parciais por forward pass no modo lote (padrão: 32)")
+    p.add_argument("--combined-out", required=False, help="Modo lote: arquivo do embedding combinado (opcional)")
+    p.add_argument("--format", choices=["json", "bin"], default="json", help="Formato do embedding salvo (padrão: json)")
+    p.add_argument("--profile", action="store_true", help="Mede tempo/CPU/memória por etapa (vai no JSON de saída)")
+    p.add_argument("--metrics-out", help="Exporta as métricas por etapa (.prom = Prometheus, senão JSON lines)")
+    p.add_argument("--store", default=os.environ.get("ARTIFACT_STORE_DIR"),
+                   help="Armazenamento de artefatos por conteúdo (padrão: $ARTIFACT_STORE_DIR)")
+    p.add_argument("--stdout", action="store_true",
+                   help='Resultado (embedding + metadados) em JSON no stdout, sem gravar arquivos; padrão com --input -')
+    p.add_argument("--emit-audio", choices=["wav", "flac", "mp3", "opus"],
+                   help="Com --stdout: inclui o áudio processado no JSON (data URL base64)")
+    p.add_argument("--noise-profile", metavar="ID",
+                   help="Id do clone/sessão: reaproveita o perfil de ruído (denoise estacionário)")
+    p.add_argument("--noise-profile-dir", help="Diretório dos perfis de ruído (padrão: $NOISE_PROFILE_DIR)")
+    add_backend_argument(p)
     args = p.parse_args()
     
+    if args.encoder_backend:
+        set_encoder_backend(args.encoder_backend)
+    if args.noise_profile_dir:
+        from noise_profile import configure_default_store
+        configure_default_store(args.noise_profile_dir)
+    
+    if args.inputs:
+        embeddings, combined = extract_embeddings_batch(args.inputs, batch_size=args.batch_size)
+        
+        outputs = [save_embedding_file(emb, wav_path, args.format)
+                   for wav_path, emb in zip(args.inputs, embeddings)]
+        if args.combined_out:
+            if args.format == "bin":
+                save_embedding_bin(combined, args.combined_out, model=model_id(),
+                                   metadata={"count": len(embeddings)})
+            else:
+                save_embedding_json(combined, args.combined_out, model=model_id())
+        
+        print(json.dumps({
+            "embeddings": outputs,
+            "combined": args.combined_out,
+            "combined_embedding": combined.tolist(),
+            "count": len(embeddings)
+        }))
+        sys.exit(0)
+    
+    profiler = None
+    if args.profile or args.metrics_out:
+        profiler = StageProfiler(labels={"pipeline": "embed"})
+    store = ArtifactStore(args.store) if args.store else None
+    
+    if args.stdout or args.input == "-":
+        # Sem arquivos: só grava o WAV se --out for pedido explicitamente
+        from audio_io import reserved_stdout
+        with reserved_stdout() as out:
+            result = embed_source(args.input, args.out, target_sr=args.target_sr, profiler=profiler,
+                                  store=store, audio_format=args.emit_audio, noise_profile=args.noise_profile)
+            if profiler:
+                result["stages"] = profiler.as_list()
+                if args.metrics_out:
+                    profiler.export(args.metrics_out)
+            out.write(json.dumps(result) + "\n")
+        sys.exit(0)
+    
     input_path = args.input
     out_path = args.out or (Path(input_path).with_suffix(".proc.wav").as_posix())
     
     logger.info(f"🚀 Iniciando processamento: {input_path}")
     
-    # Pré-processar
-    preprocess_audio(input_path, out_path, target_sr=args.target_sr)
-    
-    # Extrair embedding
-    emb = extract_embedding(out_path)
+    # Pré-processar + extrair embedding em memória
+    emb, _ = preprocess_and_embed(
+        input_path,
+        None if args.no_wav else out_path,
+        target_sr=args.target_sr,
+        profiler=profiler,
+        store=store,
+        noise_profile=args.noise_profile
+    )
     logger.info(f"✅ Embedding extraído: shape {emb.shape}, len {len(emb)}")
     
-    # Salvar embedding JSON
-    save_embedding_json(emb, out_path + ".emb.json")
+    # Salvar embedding (JSON ou binário)
+    emb_path = save_embedding_file(emb, out_path, args.format)
     
     logger.info(f"✅ Processamento concluído!")
-    logger.info(f"   Áudio processado: {out_path}")
-    logger.info(f"   Embedding: {out_path}.emb.json")
+    if not args.no_wav:
+        logger.info(f"   Áudio processado: {out_path}")
+    logger.info(f"   Embedding: {emb_path}")
+    
+    if profiler:
+        if args.metrics_out:
+            profiler.export(args.metrics_out)
+        print(json.dumps({"embedding_path": emb_path, "stages": profiler.as_list()}))
 
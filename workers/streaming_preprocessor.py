@@ -0,0 +1,352 @@
+"""
+Pré-processamento em blocos com memória limitada
+Para gravações longas (podcasts, aulas): o áudio nunca é carregado inteiro
+
+Mesmas etapas (e ordem) do preset "studio" de audio_preprocessor.preprocess_audio,
+aplicadas bloco a bloco:
+1. Leitura em blocos com soundfile + conversão para mono
+2. Resample polifásico com contexto entre blocos (sem emendas, via dsp_chain);
+   uma passada prévia grava o sinal resampleado e mede o RMS dele
+3. Normalização RMS (ganho aplicado antes do denoise, como no studio)
+4. Redução de ruído e bandpass com sobreposição (bordas descartadas)
+5. Trim com os frames centrados do librosa.effects.trim
+
+Sem denoise a saída é a mesma do caminho normal. Com denoise, o noisereduce
+não estacionário estima o ruído por bloco (constante de tempo de 2s), então o
+volume pode diferir de 1-3 dB em blocos curtos; um memory_budget_mb maior
+aproxima do resultado do caminho normal.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Iterator, Tuple
+
+import numpy as np
+import soundfile as sf
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Frames do trim (mesmos padrões do librosa.effects.trim)
+TRIM_HOP = 512
+TRIM_FRAME = 2048
+# amin do amplitude_to_db do librosa (1e-5), em potência
+TRIM_AMIN_POWER = 1e-10
+
+# Estimativa grosseira de bytes vivos por amostra em cada etapa (para o orçamento)
+# (medido com tracemalloc; o noisereduce não estacionário domina)
+_READ_BYTES_PER_SAMPLE = 8
+_DENOISE_BYTES_PER_SAMPLE = 384
+_FILTER_BYTES_PER_SAMPLE = 24
+
+
+def _read_blocks(snd: sf.SoundFile, block_frames: int) -> Iterator[np.ndarray]:
+    """Lê o arquivo em blocos mono float32."""
+    while True:
+        block = snd.read(frames=block_frames, dtype="float32", always_2d=True)
+        if not len(block):
+            return
+        yield block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+
+
+def _with_context(
+    blocks: Iterator[np.ndarray],
+    context: int,
+    fn: Callable[[np.ndarray], np.ndarray],
+    up: int = 1,
+    down: int = 1
+) -> Iterator[np.ndarray]:
+    """
+    Aplica fn a cada bloco com `context` amostras dos vizinhos de cada lado
+    e descarta a saída correspondente ao contexto, eliminando emendas.
+
+    fn pode mudar a taxa por up/down (resample); blocos e contexto devem ser
+    múltiplos de `down` (exceto o último bloco) para os cortes serem exatos.
+    """
+    prev_tail = np.zeros(0, dtype=np.float32)
+    pending = None
+    for block in blocks:
+        if pending is not None:
+            window = np.concatenate([prev_tail, pending, block[:context]])
+            start = len(prev_tail) * up // down
+            out = fn(window)
+            yield out[start:start + len(pending) * up // down]
+            prev_tail = np.concatenate([prev_tail, pending])[-context:]
+        pending = block
+
+    if pending is not None:
+        window = np.concatenate([prev_tail, pending])
+        start = len(prev_tail) * up // down
+        out = fn(window)
+        yield out[start:start + -(-len(pending) * up // down)]
+
+
+def _frame_energies(blocks: Iterator[np.ndarray]) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Energia (soma dos quadrados) dos frames de trim em streaming, centrados
+    como no librosa.effects.trim: o frame k cobre [k*TRIM_HOP - TRIM_FRAME/2,
+    k*TRIM_HOP + TRIM_FRAME/2), com zeros fora do sinal, e há
+    1 + n // TRIM_HOP frames para n amostras.
+
+    Yields:
+        (índice do primeiro frame, energias dos frames seguintes)
+    """
+    frames_per_window = TRIM_FRAME // TRIM_HOP
+    carry = np.zeros(TRIM_FRAME // 2, dtype=np.float64)  # padding inicial
+    hops = np.zeros(0, dtype=np.float64)  # energias por hop ainda sem janela completa
+    samples = 0
+    first = 0
+
+    def windows(x):
+        nonlocal carry, hops, first
+        n = len(x) - len(x) % TRIM_HOP
+        blocks = x[:n].reshape(-1, TRIM_HOP)
+        hops = np.concatenate([hops, np.einsum("ij,ij->i", blocks, blocks)])
+        carry = x[n:]
+        if len(hops) < frames_per_window:
+            return None
+        cumulative = np.concatenate([[0.0], np.cumsum(hops)])
+        sums = cumulative[frames_per_window:] - cumulative[:-frames_per_window]
+        hops = hops[len(sums):]
+        start, first = first, first + len(sums)
+        return start, sums
+
+    for block in blocks:
+        samples += len(block)
+        out = windows(np.concatenate([carry, np.asarray(block, dtype=np.float64)]))
+        if out is not None:
+            yield out
+
+    # Padding final (zeros completam o último hop) e só os frames que o librosa gera
+    tail = np.concatenate([carry, np.zeros(TRIM_FRAME // 2 + TRIM_HOP, dtype=np.float64)])
+    out = windows(tail[:len(tail) - len(tail) % TRIM_HOP])
+    if out is not None:
+        start, sums = out
+        last = samples // TRIM_HOP
+        if start <= last:
+            yield start, sums[:last - start + 1]
+
+
+def _block_frames_for_budget(budget_bytes: int, input_sr: int, channels: int, target_sr: int,
+                             reduce_noise: bool, apply_bandpass: bool, context_seconds: float) -> int:
+    """Tamanho do bloco (em frames de entrada) que cabe no orçamento de memória."""
+    per_second = input_sr * channels * _READ_BYTES_PER_SAMPLE
+    per_second += target_sr * (_DENOISE_BYTES_PER_SAMPLE if reduce_noise else 0)
+    per_second += target_sr * (_FILTER_BYTES_PER_SAMPLE if apply_bandpass else 0)
+    # Cada janela processada tem o bloco mais o contexto dos dois lados
+    seconds = budget_bytes / per_second - 2 * context_seconds
+    return int(max(1.0, seconds) * input_sr)
+
+
+def preprocess_audio_streaming(
+    input_path: str,
+    output_path: str,
+    target_sr: int = 24000,
+    normalize_rms: bool = True,
+    reduce_noise: bool = True,
+    apply_bandpass: bool = True,
+    trim_silence: bool = True,
+    top_db: int = 25,
+    target_rms: float = 0.1,
+    memory_budget_mb: float = 64,
+    context_seconds: float = 0.5
+) -> Tuple[str, dict]:
+    """
+    Pré-processa áudio em blocos, com pico de memória limitado pelo orçamento
+    independentemente da duração da entrada.
+
+    Com normalize_rms, o sinal resampleado vai antes para um WAV float
+    temporário (medindo o RMS, que define o ganho aplicado antes do denoise,
+    como no preset studio). O áudio filtrado vai para outro WAV temporário;
+    uma segunda leitura localiza o trecho com voz e a terceira escreve a
+    saída final (trim) de forma incremental.
+
+    Args:
+        input_path: Caminho do áudio de entrada (formato suportado pelo soundfile)
+        output_path: Caminho do áudio processado
+        target_sr: Sample rate alvo
+        normalize_rms: Normalizar RMS do sinal resampleado (antes do denoise)
+        reduce_noise: Reduzir ruído (noisereduce não estacionário, por bloco)
+        apply_bandpass: Aplicar filtro bandpass 80Hz-8kHz
+        trim_silence: Remover silêncio inicial/final
+        top_db: Threshold para trim (dB abaixo do frame mais forte)
+        target_rms: RMS alvo
+        memory_budget_mb: Orçamento de memória para os blocos em processamento
+        context_seconds: Sobreposição entre blocos para denoise/filtro
+
+    Returns:
+        Tuple (output_path, metadata)
+    """
+    logger.info(f"🎵 Pré-processamento em blocos: {input_path}")
+
+    output = Path(output_path)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_name(f".{output.name}.{os.getpid()}.stream.wav")
+    resampled_path = output.with_name(f".{output.name}.{os.getpid()}.resampled.wav")
+    final_tmp = output.with_name(f".{output.name}.{os.getpid()}.tmp.wav")
+
+    try:
+        with sf.SoundFile(input_path) as snd:
+            sr = snd.samplerate
+            channels = snd.channels
+            block_frames = _block_frames_for_budget(
+                int(memory_budget_mb * 1024 * 1024), sr, channels, target_sr,
+                reduce_noise, apply_bandpass, context_seconds
+            )
+
+            from dsp_chain import get_chain  # scipy só quando há trabalho
+            chain = get_chain(sr, target_sr, apply_bandpass)
+            up, down = chain.up, chain.down
+            block_frames = max(down, block_frames - block_frames % down)
+            logger.info(f"   📊 Áudio original: {sr}Hz, {snd.frames} samples, blocos de {block_frames / sr:.1f}s")
+
+            stream = _read_blocks(snd, block_frames)
+
+            # Resample polifásico com contexto entre blocos
+            if sr != target_sr:
+                # Contexto (múltiplo de down) cobrindo meio FIR em amostras de entrada
+                half_taps = len(chain.taps) // 2 // up + 1
+                resample_context = down * -(-max(1024, half_taps) // down)
+                stream = _with_context(stream, resample_context, chain.resample, up=up, down=down)
+
+            # Passo 1: sinal resampleado em disco + RMS; o ganho entra antes do denoise
+            gain = 1.0
+            if normalize_rms:
+                energy, count = 0.0, 0
+                with sf.SoundFile(resampled_path, "w", samplerate=target_sr, channels=1, subtype="FLOAT") as tmp:
+                    for block in stream:
+                        tmp.write(block)
+                        energy += float(np.dot(block.astype(np.float64), block))
+                        count += len(block)
+                rms = np.sqrt(energy / count) if count else 0.0
+                if rms > 0:
+                    gain = target_rms / rms
+                    logger.info(f"   ✅ Normalizado RMS: {rms:.4f} → {target_rms:.4f}")
+
+                def scaled(path):
+                    with sf.SoundFile(path) as tmp:
+                        for b in tmp.blocks(blocksize=max(1, block_frames * up // down), dtype="float32",
+                                            always_2d=True):
+                            yield b[:, 0] * np.float32(gain)
+                stream = scaled(resampled_path)
+
+            # Denoise + bandpass com sobreposição
+            stages = []
+            if reduce_noise:
+                import noisereduce as nr
+
+                def denoise(w):
+                    try:
+                        return nr.reduce_noise(y=w, sr=target_sr, stationary=False)
+                    except Exception as e:
+                        logger.warning(f"   ⚠️ Erro na redução de ruído: {e}")
+                        return w
+                stages.append(denoise)
+
+            if apply_bandpass:
+                stages.append(chain.bandpass)
+
+            if stages:
+                def apply_stages(w):
+                    for stage in stages:
+                        w = stage(w)
+                    return w.astype(np.float32)
+                stream = _with_context(stream, int(context_seconds * target_sr), apply_stages)
+
+            # Passo 2: grava o sinal filtrado e mede o frame mais forte
+            samples = 0
+            max_energy = 0.0
+            with sf.SoundFile(tmp_path, "w", samplerate=target_sr, channels=1, subtype="FLOAT") as tmp:
+                def written(blocks):
+                    nonlocal samples
+                    for block in blocks:
+                        tmp.write(block)
+                        samples += len(block)
+                        yield block
+                for _, energies in _frame_energies(written(stream)):
+                    max_energy = max(max_energy, float(energies.max()))
+
+        # Passo 3: primeiro/último frame com voz (mesmo critério do librosa.effects.trim)
+        start, end = 0, samples
+        if trim_silence and samples:
+            threshold = max(TRIM_AMIN_POWER, max_energy / TRIM_FRAME) * 10 ** (-top_db / 10)
+            first_frame = last_frame = None
+            with sf.SoundFile(tmp_path) as tmp:
+                blocks = (b[:, 0] for b in tmp.blocks(blocksize=block_frames, dtype="float32", always_2d=True))
+                for k, energies in _frame_energies(blocks):
+                    voiced = np.flatnonzero(np.maximum(TRIM_AMIN_POWER, energies / TRIM_FRAME) > threshold)
+                    if len(voiced):
+                        if first_frame is None:
+                            first_frame = k + int(voiced[0])
+                        last_frame = k + int(voiced[-1])
+            if first_frame is None:
+                start, end = 0, 0
+            else:
+                start = first_frame * TRIM_HOP
+                end = min(samples, (last_frame + 1) * TRIM_HOP)
+            if start > 0 or end < samples:
+                logger.info(f"   ✅ Silêncio removido: {samples} → {end - start} samples")
+
+        # Passo 4: escrita final incremental (trim)
+        with sf.SoundFile(tmp_path) as tmp, \
+                sf.SoundFile(final_tmp, "w", samplerate=target_sr, channels=1, subtype="PCM_16") as out:
+            tmp.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = tmp.read(frames=min(block_frames, remaining), dtype="float32")
+                if not len(block):
+                    break
+                out.write(block)
+                remaining -= len(block)
+        os.replace(final_tmp, output)
+        logger.info(f"   ✅ Áudio salvo: {output_path}")
+
+        duration = (end - start) / target_sr
+        metadata = {
+            'original_sr': sr,
+            'target_sr': target_sr,
+            'duration': duration,
+            'samples': end - start,
+            'file_size': output.stat().st_size,
+            'streaming': True,
+            'block_seconds': block_frames / sr,
+        }
+        logger.info(f"   ✅ Pré-processamento concluído: {duration:.2f}s")
+        return output_path, metadata
+
+    except Exception as e:
+        logger.error(f"   ❌ Erro no pré-processamento em blocos: {e}")
+        raise
+    finally:
+        for path in (resampled_path, tmp_path, final_tmp):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Pré-processamento em blocos para áudios longos")
+    parser.add_argument("--input", required=True, help="Caminho do áudio de entrada")
+    parser.add_argument("--output", required=True, help="Caminho do áudio processado")
+    parser.add_argument("--target-sr", type=int, default=24000, help="Sample rate alvo (padrão: 24000)")
+    parser.add_argument("--memory-mb", type=float, default=64, help="Orçamento de memória em MB (padrão: 64)")
+    parser.add_argument("--top-db", type=int, default=25, help="Threshold para trim em dB (padrão: 25)")
+    parser.add_argument("--no-denoise", action="store_true", help="Não reduzir ruído")
+    parser.add_argument("--no-bandpass", action="store_true", help="Não aplicar bandpass")
+    args = parser.parse_args()
+
+    _, metadata = preprocess_audio_streaming(
+        args.input,
+        args.output,
+        target_sr=args.target_sr,
+        reduce_noise=not args.no_denoise,
+        apply_bandpass=not args.no_bandpass,
+        top_db=args.top_db,
+        memory_budget_mb=args.memory_mb,
+    )
+    print(json.dumps(metadata))
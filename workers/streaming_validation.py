@@ -0,0 +1,475 @@
+"""
+Validação incremental de geração de voz (streaming)
+Recebe o áudio gerado em blocos, à medida que o TTS produz, e decide cedo
+
+- Janelas parciais iguais às do embed_utterance (1.6s, rate 1.3), embedadas
+  assim que ficam completas
+- Similaridade corrente contra a referência com banda de confiança
+  (variação das similaridades por janela)
+- Decisão antecipada "ok"/"reject" quando a banda inteira fica de um lado
+  do threshold: gerações ruins são cortadas segundos antes
+
+Sem VAD: o keep_voiced precisa do sinal inteiro (piso de ruído). Janelas
+quase só de silêncio são ignoradas na estatística.
+"""
+
+import logging
+import sys
+from statistics import NormalDist
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+
+from validate_generation import REJECT_THRESHOLD, classify_similarity
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Mesmos parâmetros do resemblyzer (hparams e embed_utterance)
+SAMPLING_RATE = 16000
+SAMPLES_PER_FRAME = 160          # mel_window_step = 10ms
+PARTIAL_FRAMES = 160             # partials_n_frames = 1.6s
+PARTIAL_RATE = 1.3
+MIN_COVERAGE = 0.75
+# Frames extras de cada lado para o mel (janela centrada) sair igual ao do sinal inteiro
+MEL_CONTEXT = 2 * SAMPLES_PER_FRAME
+
+# Decisão antecipada
+CONFIDENCE = 0.95
+MIN_PARTIALS = 3
+# Piso do desvio padrão das similaridades por janela (poucas janelas subestimam a variação)
+MIN_STD = 0.03
+# Janela parcial com menos que isso de frames acima do limiar de silêncio é ignorada
+MIN_VOICED_FRACTION = 0.5
+SILENCE_DBFS = -50.0
+
+PCM_FORMATS = {"s16le": np.int16, "f32le": np.float32}
+
+
+class _StreamingResampler:
+    """
+    Resample polifásico incremental (dsp_chain) sem emendas: cada bloco é
+    processado com `context` amostras dos vizinhos e a saída do contexto é
+    descartada. A saída atrasa `context` amostras até o próximo bloco.
+    """
+
+    def __init__(self, input_sr: int, target_sr: int):
+        from dsp_chain import get_chain
+        self.chain = get_chain(input_sr, target_sr, apply_bandpass=False)
+        self.up, self.down = self.chain.up, self.chain.down
+        half_len = (len(self.chain.taps) - 1) // 2 if self.chain.taps is not None else 0
+        context = -(-half_len // self.up) + 1
+        self.context = -(-context // self.down) * self.down
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._left = 0  # amostras de contexto já emitidas no início do buffer
+
+    def push(self, x: np.ndarray) -> np.ndarray:
+        if self.chain.taps is None:
+            return x
+        self._buffer = np.concatenate([self._buffer, x])
+        ready = len(self._buffer) - self._left - self.context
+        ready -= ready % self.down
+        if ready <= 0:
+            return np.zeros(0, dtype=np.float32)
+        end = self._left + ready
+        out = self.chain.resample(self._buffer[:end + self.context])
+        start = self._left * self.up // self.down
+        y = out[start:start + ready * self.up // self.down]
+        keep = min(self.context, end)
+        self._buffer = self._buffer[end - keep:]
+        self._left = keep
+        return y
+
+    def flush(self) -> np.ndarray:
+        if self.chain.taps is None or len(self._buffer) <= self._left:
+            return np.zeros(0, dtype=np.float32)
+        out = self.chain.resample(self._buffer)
+        start = self._left * self.up // self.down
+        y = out[start:-(-len(self._buffer) * self.up // self.down)]
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._left = 0
+        return y
+
+
+class StreamingValidator:
+    """
+    Valida um áudio gerado enquanto ele chega.
+
+    Uso:
+        validator = StreamingValidator(ref_emb, sample_rate=24000)
+        for chunk in chunks:
+            state = validator.push(chunk)
+            if state["decided"]:
+                break  # cortar a geração
+        result = validator.finish()
+    """
+
+    def __init__(
+        self,
+        reference: Union[str, np.ndarray],
+        threshold: float = 0.82,
+        sample_rate: int = SAMPLING_RATE,
+        confidence: float = CONFIDENCE,
+        min_partials: int = MIN_PARTIALS,
+        early_stop: bool = True,
+        skip_silence: bool = True
+    ):
+        """
+        Args:
+            reference: Embedding de referência ou caminho (JSON ou .emb)
+            threshold: Threshold de similaridade (padrão: 0.82)
+            sample_rate: Sample rate dos blocos recebidos (resample para 16kHz)
+            confidence: Nível de confiança da banda (padrão: 0.95)
+            min_partials: Janelas parciais mínimas antes de decidir
+            early_stop: Parar de embedar assim que houver decisão
+            skip_silence: Ignorar janelas quase só de silêncio na estatística
+        """
+        if isinstance(reference, str):
+            from embedding_cache import get_default_cache
+            from encoder_backend import compatible_models
+            reference, _ = get_default_cache().load_reference(reference, compatible_models())
+        reference = np.asarray(reference, dtype=np.float32)
+        self.reference = reference / max(float(np.linalg.norm(reference)), 1e-12)
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.confidence = confidence
+        self.min_partials = max(1, min_partials)
+        self.early_stop = early_stop
+        self.skip_silence = skip_silence
+
+        self.partial_samples = PARTIAL_FRAMES * SAMPLES_PER_FRAME
+        frame_step = int(np.round((SAMPLING_RATE / PARTIAL_RATE) / SAMPLES_PER_FRAME))
+        self.step_samples = frame_step * SAMPLES_PER_FRAME
+        # Janelas sobrepostas não são independentes: n efetivo = n * passo / janela
+        self._overlap = min(1.0, self.step_samples / self.partial_samples)
+
+        self._resampler = _StreamingResampler(sample_rate, SAMPLING_RATE) if sample_rate != SAMPLING_RATE else None
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._buffer_start = 0   # índice absoluto (16kHz) de _buffer[0]
+        self._received = 0       # amostras recebidas em 16kHz
+        self._next_window = 0    # índice da próxima janela parcial
+        self._partials: List[np.ndarray] = []
+        self._silent: List[np.ndarray] = []
+        self.decision: Optional[str] = None
+        self.decided_at: Optional[float] = None
+        self.finished = False
+
+    @property
+    def seconds(self) -> float:
+        return self._received / SAMPLING_RATE
+
+    @property
+    def decided(self) -> bool:
+        return self.decision is not None
+
+    def push(self, chunk: np.ndarray) -> Dict:
+        """
+        Adiciona um bloco de áudio (mono, float ou int16, em sample_rate) e
+        embeda as janelas parciais que ficaram completas.
+
+        Returns:
+            Estado corrente (ver state()); "decided" indica decisão antecipada
+        """
+        if self.finished:
+            raise RuntimeError("Validação já finalizada")
+        if self.decided and self.early_stop:
+            return self.state()
+        self._append(_as_float32(chunk))
+
+        starts = []
+        while True:
+            start = self._next_window * self.step_samples
+            if start + self.partial_samples + MEL_CONTEXT > self._received:
+                break
+            starts.append(start)
+            self._next_window += 1
+        if starts:
+            self._embed_windows(starts, self._buffer)
+            self._update_decision()
+        return self.state()
+
+    def finish(self) -> Dict:
+        """
+        Encerra o stream: completa as janelas finais como o embed_utterance
+        (padding com zeros, cobertura mínima) e devolve o resultado no formato
+        do validate(), com os detalhes do streaming em "streaming".
+        """
+        if not self.finished:
+            self.finished = True
+            if self._resampler is not None:
+                self._append(self._resampler.flush(), resampled=True)
+            if not (self.decided and self.early_stop):
+                self._embed_tail()
+        return self.result()
+
+    def state(self) -> Dict:
+        """Similaridade corrente, banda de confiança e decisão (se houver)."""
+        sim, low, high = self._estimate()
+        return {
+            "seconds": round(self.seconds, 3),
+            "partials": len(self._partials),
+            "skipped": len(self._silent),
+            "similarity": sim,
+            "band": [low, high] if sim is not None else None,
+            "decided": self.decided,
+            "decision": self.decision,
+        }
+
+    def result(self) -> Dict:
+        sim, low, high = self._estimate()
+        if sim is None:
+            return {
+                "similarity": 0.0,
+                "ok": False,
+                "threshold": self.threshold,
+                "status": "error",
+                "error": "Áudio curto demais para validar",
+                "streaming": self.state(),
+            }
+        early = self.decided and self.early_stop
+        status = self.decision if early else classify_similarity(sim, self.threshold)
+        streaming = self.state()
+        streaming.update({
+            "early": early,
+            "decided_at": self.decided_at,
+            "confidence": self.confidence,
+        })
+        return {
+            "similarity": sim,
+            "ok": status == "ok",
+            "threshold": self.threshold,
+            "status": status,
+            "needs_review": status == "review",
+            "should_reject": status == "reject",
+            "streaming": streaming,
+        }
+
+    def _append(self, x: np.ndarray, resampled: bool = False):
+        if self._resampler is not None and not resampled:
+            x = self._resampler.push(x)
+        if not len(x):
+            return
+        # Só o necessário para as próximas janelas (com o contexto do mel) fica em memória
+        keep_from = max(0, self._next_window * self.step_samples - MEL_CONTEXT)
+        drop = max(0, keep_from - self._buffer_start)
+        self._buffer = np.concatenate([self._buffer[drop:], x])
+        self._buffer_start += drop
+        self._received += len(x)
+
+    def _embed_tail(self):
+        """Janelas finais do embed_utterance (compute_partial_slices)."""
+        n = self._received
+        n_frames = int(np.ceil((n + 1) / SAMPLES_PER_FRAME))
+        frame_step = self.step_samples // SAMPLES_PER_FRAME
+        steps = max(1, n_frames - PARTIAL_FRAMES + frame_step + 1)
+        starts = [i * SAMPLES_PER_FRAME for i in range(0, steps, frame_step)]
+        last = starts[-1]
+        coverage = (n - last) / self.partial_samples
+        if coverage < MIN_COVERAGE and len(starts) > 1:
+            starts = starts[:-1]
+        starts = [s for s in starts if s >= self._next_window * self.step_samples]
+        if not starts:
+            return
+        total = starts[-1] + self.partial_samples
+        padded = self._buffer
+        if total > n:
+            padded = np.pad(self._buffer, (0, total - n), "constant")
+        self._embed_windows(starts, padded, final=True)
+        self._next_window += len(starts)
+        self._update_decision()
+
+    def _embed_windows(self, starts: List[int], wav: np.ndarray, final: bool = False):
+        """Mel de cada janela (com contexto) e um forward pass para todas."""
+        from encoder_backend import mel_spectrogram
+        from preprocess_and_embed import get_encoder
+        from vad import frame_features
+
+        mels = []
+        silent = []
+        for start in starts:
+            local = start - self._buffer_start
+            sub_start = max(0, local - MEL_CONTEXT)
+            end = local + self.partial_samples
+            sub = wav[sub_start:end + MEL_CONTEXT]
+            offset = (local - sub_start) // SAMPLES_PER_FRAME
+            mel = mel_spectrogram(sub)
+            mels.append(mel[offset:offset + PARTIAL_FRAMES])
+            if self.skip_silence:
+                energy_db, _ = frame_features(wav[local:end], SAMPLING_RATE)
+                silent.append(np.mean(energy_db > SILENCE_DBFS) < MIN_VOICED_FRACTION)
+            else:
+                silent.append(False)
+
+        embeds = get_encoder().embed_partials(np.array(mels))
+        for emb, is_silent in zip(embeds, silent):
+            (self._silent if is_silent else self._partials).append(emb)
+        if final and not self._partials:
+            # Só silêncio: usa todas as janelas (mesmo resultado do embed_utterance)
+            self._partials, self._silent = self._silent, []
+
+    def _estimate(self):
+        """(similaridade, limite inferior, limite superior) ou (None, None, None)."""
+        if not self._partials:
+            return None, None, None
+        partials = np.array(self._partials)
+        mean = partials.mean(axis=0)
+        norm = max(float(np.linalg.norm(mean)), 1e-12)
+        sim = float(mean @ self.reference) / norm
+        n = len(partials)
+        if n < 2:
+            return sim, -1.0, 1.0
+        sims = partials @ self.reference
+        std = max(float(np.std(sims, ddof=1)), MIN_STD)
+        n_eff = max(1.0, n * self._overlap)
+        half = self.z * std / np.sqrt(n_eff) / norm
+        return sim, float(max(-1.0, sim - half)), float(min(1.0, sim + half))
+
+    def _update_decision(self):
+        if self.decided or len(self._partials) < self.min_partials:
+            return
+        sim, low, high = self._estimate()
+        if high < REJECT_THRESHOLD:
+            self.decision = "reject"
+        elif low >= self.threshold:
+            self.decision = "ok"
+        else:
+            return
+        self.decided_at = round(self.seconds, 3)
+        logger.info(f"   [INFO] Decisao antecipada: {self.decision} em {self.decided_at:.1f}s "
+                    f"(similaridade {sim:.4f}, banda [{low:.4f}, {high:.4f}])")
+
+
+def _as_float32(chunk: np.ndarray) -> np.ndarray:
+    chunk = np.asarray(chunk)
+    if chunk.dtype == np.int16:
+        return chunk.astype(np.float32) / 32768.0
+    chunk = chunk.astype(np.float32, copy=False)
+    return chunk.mean(axis=1) if chunk.ndim > 1 else chunk
+
+
+def decode_pcm(data: bytes, fmt: str = "s16le") -> np.ndarray:
+    """Bytes PCM mono (s16le ou f32le) -> float32. Bytes incompletos no fim são descartados."""
+    dtype = np.dtype(PCM_FORMATS[fmt])
+    usable = len(data) - len(data) % dtype.itemsize
+    return _as_float32(np.frombuffer(data[:usable], dtype=dtype))
+
+
+def read_pcm_chunks(stream: BinaryIO, fmt: str = "s16le", chunk_bytes: int = 16000) -> Iterator[np.ndarray]:
+    """Lê PCM cru de um stream binário (ex.: stdin) em blocos float32."""
+    itemsize = np.dtype(PCM_FORMATS[fmt]).itemsize
+    carry = b""
+    while True:
+        data = stream.read1(chunk_bytes) if hasattr(stream, "read1") else stream.read(chunk_bytes)
+        if not data:
+            break
+        data = carry + data
+        usable = len(data) - len(data) % itemsize
+        carry = data[usable:]
+        if usable:
+            yield decode_pcm(data[:usable], fmt)
+
+
+def read_file_chunks(path: str, chunk_seconds: float = 0.5) -> Iterator[np.ndarray]:
+    """Lê um arquivo de áudio em blocos mono float32 (soundfile)."""
+    import soundfile as sf
+    with sf.SoundFile(path) as snd:
+        block = max(1, int(snd.samplerate * chunk_seconds))
+        for data in snd.blocks(blocksize=block, dtype="float32", always_2d=True):
+            yield data.mean(axis=1) if data.shape[1] > 1 else data[:, 0]
+
+
+def validate_stream(
+    reference: Union[str, np.ndarray],
+    chunks: Iterable[np.ndarray],
+    threshold: float = 0.82,
+    sample_rate: int = SAMPLING_RATE,
+    early_stop: bool = True,
+    on_update=None,
+    **kwargs
+) -> Dict:
+    """
+    Valida um áudio que chega em blocos; com early_stop para de consumir os
+    blocos assim que a decisão se estabiliza.
+
+    Args:
+        reference: Embedding de referência ou caminho (JSON ou .emb)
+        chunks: Blocos de áudio mono em sample_rate
+        threshold: Threshold de similaridade (padrão: 0.82)
+        sample_rate: Sample rate dos blocos
+        early_stop: Interromper na decisão antecipada
+        on_update: Callback chamado com o estado a cada nova janela parcial
+        **kwargs: Demais opções do StreamingValidator
+
+    Returns:
+        Dict no formato do validate(), com "streaming"
+    """
+    validator = StreamingValidator(reference, threshold, sample_rate, early_stop=early_stop, **kwargs)
+    partials = 0
+    for chunk in chunks:
+        state = validator.push(chunk)
+        if on_update and state["partials"] + state["skipped"] != partials:
+            partials = state["partials"] + state["skipped"]
+            on_update(state)
+        if validator.decided and early_stop:
+            break
+    return validator.finish()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from encoder_backend import add_backend_argument
+
+    parser = argparse.ArgumentParser(description="Valida geração de voz em streaming (decisão antecipada)")
+    parser.add_argument("--reference", required=True, help="Caminho do embedding de referência (JSON ou .emb)")
+    parser.add_argument("--input", default="-",
+                        help='Áudio gerado: "-" lê PCM cru do stdin (padrão), ou caminho de arquivo lido em blocos')
+    parser.add_argument("--sr", type=int, default=SAMPLING_RATE, help="Sample rate do PCM no stdin (padrão: 16000)")
+    parser.add_argument("--pcm-format", choices=sorted(PCM_FORMATS), default="s16le", help="Formato do PCM no stdin")
+    parser.add_argument("--chunk-ms", type=int, default=500, help="Tamanho dos blocos lidos (padrão: 500ms)")
+    parser.add_argument("--threshold", type=float, default=0.82, help="Threshold de similaridade (padrão: 0.82)")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE, help="Confiança da banda (padrão: 0.95)")
+    parser.add_argument("--min-partials", type=int, default=MIN_PARTIALS,
+                        help="Janelas parciais mínimas antes de decidir (padrão: 3)")
+    parser.add_argument("--no-early-stop", action="store_true", help="Consumir o áudio inteiro mesmo após decidir")
+    parser.add_argument("--progress", action="store_true", help="Imprime uma linha JSON por janela parcial")
+    add_backend_argument(parser)
+    args = parser.parse_args()
+
+    if args.encoder_backend:
+        from preprocess_and_embed import set_encoder_backend
+        set_encoder_backend(args.encoder_backend)
+
+    from audio_io import reserved_stdout
+
+    out = sys.stdout
+
+    def emit(obj):
+        # stdout fica só com as linhas JSON (prints do resemblyzer vão para stderr)
+        out.write(json.dumps(obj) + "\n")
+        out.flush()
+
+    if args.input == "-":
+        itemsize = np.dtype(PCM_FORMATS[args.pcm_format]).itemsize
+        sample_rate = args.sr
+        chunks = read_pcm_chunks(sys.stdin.buffer, args.pcm_format,
+                                 max(itemsize, sample_rate * args.chunk_ms // 1000 * itemsize))
+    else:
+        import soundfile as sf
+        sample_rate = sf.info(args.input).samplerate
+        chunks = read_file_chunks(args.input, args.chunk_ms / 1000)
+
+    try:
+        with reserved_stdout():
+            result = validate_stream(
+                args.reference, chunks, args.threshold, sample_rate,
+                early_stop=not args.no_early_stop,
+                on_update=emit if args.progress else None,
+                confidence=args.confidence,
+                min_partials=args.min_partials,
+            )
+    except Exception as e:
+        result = {"similarity": 0.0, "ok": False, "threshold": args.threshold, "status": "error", "error": str(e)}
+    emit(result)
+    sys.exit(0 if result["status"] != "error" else 1)
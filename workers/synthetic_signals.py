@@ -0,0 +1,49 @@
+"""
+Sinais sintéticos determinísticos (fala e ruído)
+Usados pelo benchmark e pela checagem de paridade dos backends do encoder
+(encoder_backend.parity_signals), sem depender de áudios no disco
+"""
+
+import numpy as np
+
+
+def synth_speech(seconds: float, sr: int, seed: int = 0) -> np.ndarray:
+    """
+    Sinal "tipo fala" determinístico: fonte harmônica com f0 variável,
+    envelope silábico (~4Hz), pausas, formantes aproximados e ruído de fundo.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.3 * t + rng.uniform(0, np.pi)) + 10 * np.sin(2 * np.pi * 2.1 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    y = np.zeros(n)
+    for harmonic in range(1, 16):
+        freq = harmonic * f0
+        # Formantes fixos (~500, 1500, 2500 Hz) moldando as harmônicas
+        gain = sum(np.exp(-((freq - fc) / bw) ** 2) for fc, bw in ((500, 200), (1500, 300), (2500, 400)))
+        y += (gain + 0.05) / harmonic * np.sin(harmonic * phase)
+
+    syllables = 0.5 * (1 + np.sin(2 * np.pi * 4.0 * t + rng.uniform(0, np.pi))) ** 2
+    pauses = (np.sin(2 * np.pi * 0.25 * t) > -0.7).astype(np.float64)
+    y = y * syllables * pauses
+    y += 0.01 * rng.standard_normal(n)
+    y = 0.3 * y / (np.max(np.abs(y)) + 1e-9)
+
+    # Silêncio no início/fim (exercita o trim)
+    pad = int(0.3 * sr)
+    y[:pad] *= 0.01
+    y[-pad:] *= 0.01
+    return y.astype(np.float32)
+
+
+def synth_noise(seconds: float, sr: int, seed: int = 0) -> np.ndarray:
+    """Ruído rosa aproximado (1/f) determinístico."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    freqs = np.fft.rfftfreq(n, 1 / sr)
+    spectrum[1:] /= np.sqrt(freqs[1:])
+    y = np.fft.irfft(spectrum, n)
+    return (0.1 * y / (np.max(np.abs(y)) + 1e-9)).astype(np.float32)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Teste do lote paralelo do pré-processamento (audio_preprocessor)
+Entradas com stems repetidos em diretórios diferentes não podem gravar a
+mesma saída. Usa áudios sintéticos em um diretório temporário.
+
+Uso:
+    python test_audio_preprocessor.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from audio_preprocessor import _output_names, batch_preprocess_parallel
+
+failures = 0
+
+
+def report(ok: bool, message: str):
+    global failures
+    print(f"{'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures += 1
+
+
+if __name__ == "__main__":
+    # Nomes: "x_2.wav" seguido de dois "x.wav" colidia com o nome gerado para o segundo x
+    for paths in (["a/x_2.wav", "a/x.wav", "b/x.wav"],
+                  ["a/x.wav", "b/x.wav", "x_1.wav", "c/x.wav"],
+                  ["a/X.wav", "b/x.wav"]):
+        names = _output_names(paths)
+        report(len({n.lower() for n in names}) == len(names), f"nomes únicos para {paths}: {names}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        sr = 24000
+        inputs = []
+        # Durações diferentes: a saída de cada entrada é identificável pelo tamanho
+        for rel, seconds in (("a/x_2.wav", 1.0), ("a/x.wav", 1.5), ("b/x.wav", 2.0)):
+            path = root / "in" / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            t = np.arange(int(seconds * sr)) / sr
+            sf.write(str(path), (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32), sr)
+            inputs.append(str(path))
+
+        batch = batch_preprocess_parallel(inputs, str(root / "out"), workers=2, reduce_noise=False,
+                                          trim_silence=False)
+        results = batch["results"]
+        outputs = [r["output"] for r in results]
+        report(all(r["status"] == "ok" for r in results), "todas as entradas processadas")
+        report(len(set(outputs)) == len(inputs), f"saídas distintas: {[Path(o).name for o in outputs]}")
+        for r in results:
+            duration = sf.info(r["output"]).duration
+            expected = sf.info(r["input"]).duration
+            report(abs(duration - expected) < 0.01,
+                   f"{Path(r['output']).name}: {duration:.2f}s no disco (entrada {expected:.2f}s)")
+
+    if failures:
+        print(f"❌ {failures} verificação(ões) falharam")
+        sys.exit(1)
+    print("✅ Lote paralelo OK")
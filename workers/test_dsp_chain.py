@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Teste do resample pré-compilado (dsp_chain) contra librosa.resample (soxr_hq)
+Tons acima do Nyquist de destino têm que ser rejeitados como no soxr_hq, a
+banda passante tem que ficar plana e sinais de voz têm que sair iguais.
+
+Uso:
+    python test_dsp_chain.py
+"""
+
+import sys
+
+import librosa
+import numpy as np
+
+from dsp_chain import get_chain
+
+failures = 0
+
+
+def report(ok: bool, message: str):
+    global failures
+    print(f"{'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures += 1
+
+
+def tone_db(y: np.ndarray) -> float:
+    """Nível de um tom de amplitude 1 após o resample (dB), sem as bordas."""
+    y = y[2000:-2000]
+    return 20 * np.log10(max(float(np.sqrt(np.mean(y ** 2) * 2)), 1e-12))
+
+
+if __name__ == "__main__":
+    for orig_sr, target_sr in ((44100, 24000), (48000, 24000), (22050, 16000), (16000, 24000)):
+        chain = get_chain(orig_sr, target_sr, apply_bandpass=False)
+        t = np.arange(2 * orig_sr) / orig_sr
+        nyquist = min(orig_sr, target_sr) / 2
+
+        def both(x):
+            ours = chain.resample(x)
+            soxr = librosa.resample(x, orig_sr=orig_sr, target_sr=target_sr, res_type="soxr_hq")
+            return ours, soxr
+
+        # Aliasing: tons logo acima do Nyquist de destino (ex.: 12.5kHz e 13kHz em 44.1k→24k)
+        for f in (nyquist * 1.04, nyquist * 1.08):
+            if f >= orig_sr / 2:
+                continue
+            ours, soxr = both(np.sin(2 * np.pi * f * t))
+            report(tone_db(ours) < -100, f"{orig_sr}→{target_sr}: {f:.0f}Hz rejeitado em {tone_db(ours):.1f}dB "
+                                         f"(soxr_hq {tone_db(soxr):.1f}dB)")
+
+        # Banda passante: até 92% do Nyquist (ex.: 11kHz em 44.1k→24k) sem perda
+        for f in (1000.0, nyquist * 0.75, nyquist * 0.92):
+            ours, soxr = both(np.sin(2 * np.pi * f * t))
+            report(abs(tone_db(ours)) < 0.05, f"{orig_sr}→{target_sr}: {f:.0f}Hz passa com {tone_db(ours):+.3f}dB "
+                                              f"(soxr_hq {tone_db(soxr):+.3f}dB)")
+
+        # Sinal na banda de voz: mesmas amostras que o librosa.resample
+        rng = np.random.default_rng(0)
+        x = sum(np.sin(2 * np.pi * f * t + rng.uniform(0, 2 * np.pi)) for f in (120, 440, 1234, 3000, 7000)) / 5
+        ours, soxr = both(x.astype(np.float32))
+        n = min(len(ours), len(soxr))
+        diff = float(np.max(np.abs(ours[100:n - 100] - soxr[100:n - 100])))
+        report(abs(len(ours) - len(soxr)) <= 1 and diff < 1e-3,
+               f"{orig_sr}→{target_sr}: diferença máxima {diff:.1e} para o soxr_hq ({len(ours)} vs {len(soxr)} samples)")
+
+    if failures:
+        print(f"❌ {failures} verificação(ões) falharam")
+        sys.exit(1)
+    print("✅ Resample equivalente ao soxr_hq")
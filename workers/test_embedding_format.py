@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Teste do id de modelo nos arquivos de embedding (embedding_format)
+Todo caminho de gravação (JSON e binário) grava o modelo do backend atual, e
+uma referência gravada por outro modelo é recusada na leitura.
+
+Uso:
+    python test_embedding_format.py
+"""
+
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from embedding_format import load_embedding, read_embedding_header, save_embedding
+from encoder_backend import compatible_models, model_id
+from preprocess_and_embed import save_embedding_file
+
+failures = 0
+
+
+def report(ok: bool, message: str):
+    global failures
+    print(f"{'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures += 1
+
+
+def saved_model(path: str):
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("model")
+    return read_embedding_header(path)[0].get("model")
+
+
+def rejected(fn) -> bool:
+    try:
+        fn()
+    except ValueError:
+        return True
+    return False
+
+
+if __name__ == "__main__":
+    emb = np.random.default_rng(0).normal(size=256).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+
+        # Gravação: o modelo do backend atual vai no arquivo, nos dois formatos
+        paths = [save_embedding(emb, str(root / "ref.json")),
+                 save_embedding(emb, str(root / "ref.emb")),
+                 save_embedding_file(emb, str(root / "a"), "json"),
+                 save_embedding_file(emb, str(root / "b"), "bin")]
+        for path in paths:
+            report(saved_model(path) == model_id(), f"{Path(path).name}: model={saved_model(path)}")
+            report(np.allclose(load_embedding(path, expected_model=compatible_models()), emb),
+                   f"{Path(path).name}: aceito pelo modelo atual")
+
+        # Leitura: referência de outro modelo é recusada (load_embedding e cache)
+        cache = EmbeddingCache()
+        for suffix in (".json", ".emb"):
+            other = save_embedding(emb, str(root / f"other{suffix}"), model="ecapa-tdnn-192")
+            report(rejected(lambda: load_embedding(other, expected_model=compatible_models())),
+                   f"other{suffix}: load_embedding recusa ecapa-tdnn-192")
+            report(rejected(lambda: cache.load_reference(other, compatible_models())),
+                   f"other{suffix}: load_reference recusa ecapa-tdnn-192")
+
+    if failures:
+        print(f"❌ {failures} verificação(ões) falharam")
+        sys.exit(1)
+    print("✅ Id de modelo gravado e conferido")
@@ -8,22 +8,12 @@ import sys
 from pathlib import Path
 
 # Aplicar patch do webrtcvad
-try:
-    import webrtcvad
+from vad import install_webrtcvad_fallback, keep_voiced
+
+if install_webrtcvad_fallback():
+    print("⚠️ webrtcvad não disponível - usando VAD em NumPy")
+else:
     print("✅ webrtcvad disponível")
-except ImportError:
-    class MockVad:
-        def __init__(self, mode=2):
-            self.mode = mode
-        
-        def is_speech(self, buf, sample_rate=16000):
-            return True
-    
-    class MockWebRTCVad:
-        Vad = MockVad
-    
-    sys.modules['webrtcvad'] = MockWebRTCVad()
-    print("⚠️ webrtcvad não disponível - usando mock")
 
 # Importar resemblyzer
 from resemblyzer import VoiceEncoder, preprocess_wav
@@ -50,7 +40,7 @@ if len(sys.argv) > 1:
         
         # Método 2: carregar direto
         wav, sr = librosa.load(audio_path, sr=16000)
-        emb = encoder.embed_utterance(wav)
+        emb = encoder.embed_utterance(keep_voiced(wav, sr))
         print(f"✅ Embedding extraído (alternativo): shape {emb.shape}")
 else:
     print("✅ Teste de importação passou!")
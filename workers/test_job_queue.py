@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Teste da fila de jobs (job_queue)
+Prioridade, deduplicação, retries, lease expirado e resultado de worker
+que perdeu o lease. Usa um banco SQLite temporário.
+
+Uso:
+    python test_job_queue.py
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from job_queue import JobQueue, keep_lease
+
+failures = 0
+
+
+def report(ok: bool, message: str):
+    global failures
+    print(f"{'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures += 1
+
+
+LEASE = 0.05
+
+with tempfile.TemporaryDirectory() as tmp:
+    queue = JobQueue(str(Path(tmp) / "jobs.sqlite3"), backoff_base=0.01, backoff_max=0.01)
+
+    # Prioridade: interativo antes de lote, mesmo enfileirado depois
+    bulk = queue.enqueue("preprocess_audio", {"input": "a.wav"})["job_id"]
+    interactive = queue.enqueue("validate", {"generated": "b.wav"})["job_id"]
+    job = queue.claim("w1", LEASE)
+    report(job["id"] == interactive, "validate é reservado antes de preprocess_audio")
+    report(queue.complete(job["id"], {"ok": True}, "w1"), "complete pelo dono do lease")
+    report(queue.claim("w1", LEASE)["id"] == bulk, "preprocess_audio reservado em seguida")
+    queue.complete(bulk, {}, "w1")
+
+    # Deduplicação: mesmo payload reaproveita o job concluído
+    again = queue.enqueue("validate", {"generated": "b.wav"})
+    report(again["deduplicated"] and again["job_id"] == interactive, "payload idêntico deduplicado")
+
+    # Lease expirado na última tentativa: falha em vez de voltar para a fila
+    crash = queue.enqueue("extract_embedding", {"wav_path": "crash.wav"}, max_attempts=1)["job_id"]
+    queue.claim("w1", LEASE)
+    time.sleep(LEASE * 2)
+    report(queue.claim("w2", LEASE) is None, "job sem tentativas restantes não é reservado de novo")
+    job = queue.get(crash)
+    report(job["status"] == "failed" and job["attempts"] == 1,
+           f"lease expirado na última tentativa -> failed (status {job['status']}, tentativa {job['attempts']})")
+
+    # Lease expirado com tentativas restantes: outro worker reserva; o antigo não sobrescreve
+    slow = queue.enqueue("extract_embedding", {"wav_path": "slow.wav"}, max_attempts=3)["job_id"]
+    queue.claim("w1", LEASE)
+    time.sleep(LEASE * 2)
+    job = queue.claim("w2", 60)
+    report(job["id"] == slow and job["attempts"] == 2, "lease expirado volta para a fila e é reservado por outro worker")
+    report(not queue.complete(slow, {"stale": True}, "w1"), "complete de worker sem lease é descartado")
+    report(queue.fail(slow, "erro antigo", "w1") == "lost", "fail de worker sem lease não altera o job")
+    report(queue.get(slow)["status"] == "running", "job continua com o worker atual")
+    report(queue.complete(slow, {"fresh": True}, "w2"), "complete do worker atual")
+    report(queue.get(slow)["result"] == {"fresh": True}, "resultado é o do worker atual")
+
+    # Heartbeat: renovar o lease mantém o job com o worker além do lease original
+    long_job = queue.enqueue("preprocess_audio", {"input": "long.wav"}, max_attempts=1)["job_id"]
+    queue.claim("w1", LEASE)
+    report(not queue.heartbeat(long_job, "w2", LEASE), "heartbeat de outro worker é recusado")
+    with keep_lease(queue.path, long_job, "w1", LEASE):
+        time.sleep(LEASE * 4)
+        report(queue.claim("w2", LEASE) is None, "job com heartbeat não é reservado por outro worker")
+    report(queue.complete(long_job, {"ok": True}, "w1"), "job mais longo que o lease concluído pelo worker original")
+
+    # Deduplicação considera o conteúdo dos arquivos citados nos params
+    audio = Path(tmp) / "take.wav"
+    audio.write_bytes(b"versao 1")
+    first = queue.enqueue("extract_embedding", {"wav_path": str(audio)})["job_id"]
+    queue.claim("w1", LEASE)
+    queue.complete(first, {"v": 1}, "w1")
+    report(queue.enqueue("extract_embedding", {"wav_path": str(audio)})["deduplicated"],
+           "mesmo arquivo, mesmo conteúdo: deduplicado")
+    audio.write_bytes(b"versao 2")
+    again = queue.enqueue("extract_embedding", {"wav_path": str(audio)})
+    report(not again["deduplicated"], "mesmo caminho com outro conteúdo: job novo")
+    queue.claim("w1", LEASE)
+    queue.complete(again["job_id"], {"v": 2}, "w1")
+
+    # Retries com backoff até esgotar as tentativas
+    flaky = queue.enqueue("encode_audio", {"input": "x.wav"}, max_attempts=2)["job_id"]
+    queue.claim("w1", 60)
+    report(queue.fail(flaky, "falha 1", "w1") == "queued", "primeira falha volta para a fila")
+    time.sleep(0.05)
+    queue.claim("w1", 60)
+    report(queue.fail(flaky, "falha 2", "w1") == "failed", "última falha marca como failed")
+
+    counts = queue.stats()["counts"]
+    report(counts["queued"] == 0 and counts["running"] == 0, f"fila vazia no fim ({counts})")
+    queue.close()
+
+if failures:
+    print(f"❌ {failures} verificação(ões) falharam")
+    sys.exit(1)
+print("✅ Fila de jobs OK")
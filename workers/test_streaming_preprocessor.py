@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Teste de paridade do pré-processamento em blocos (streaming_preprocessor)
+Compara preprocess_audio(streaming=True) com o caminho normal (preset
+"studio") no mesmo áudio: sem denoise (ou com o áudio em um bloco só) a
+saída tem que ser a mesma (RMS, trim e amostras); com o denoise não
+estacionário por bloco, volume e trim ficam próximos.
+
+Uso:
+    python test_streaming_preprocessor.py             # áudio sintético
+    python test_streaming_preprocessor.py a.wav       # áudio real
+"""
+
+import logging
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from audio_preprocessor import preprocess_audio
+from streaming_preprocessor import TRIM_HOP
+
+logging.disable(logging.INFO)
+
+failures = 0
+
+
+def report(ok: bool, message: str):
+    global failures
+    print(f"{'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures += 1
+
+
+def rms_db(x: np.ndarray) -> float:
+    return 20 * np.log10(max(float(np.sqrt(np.mean(np.square(x, dtype=np.float64)))), 1e-12))
+
+
+def synthetic(path: str, seconds: float = 12.0, sr: int = 44100):
+    """Rajadas harmônicas com silêncio nas pontas, ruído de fundo, estéreo."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    voice = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((180, 360, 540, 1200, 2600), start=1))
+    envelope = (np.sin(2 * np.pi * 1.5 * t) > 0) * ((t > 1.3) & (t < seconds - 1.7))
+    mono = 0.2 * voice * envelope + 0.003 * rng.normal(size=len(t))
+    sf.write(path, np.stack([mono, 0.8 * mono], axis=1).astype(np.float32), sr)
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        if len(sys.argv) > 1:
+            source = sys.argv[1]
+        else:
+            source = str(Path(tmp) / "input.wav")
+            synthetic(source)
+
+        normal_path, stream_path = str(Path(tmp) / "normal.wav"), str(Path(tmp) / "stream.wav")
+
+        def compare(reduce_noise: bool, memory_budget_mb: float):
+            preprocess_audio(source, normal_path, reduce_noise=reduce_noise)
+            _, metadata = preprocess_audio(source, stream_path, reduce_noise=reduce_noise,
+                                           streaming=True, memory_budget_mb=memory_budget_mb)
+            normal, _ = sf.read(normal_path, dtype="float32")
+            stream, _ = sf.read(stream_path, dtype="float32")
+            n = min(len(normal), len(stream))
+            diff = float(np.max(np.abs(stream[:n] - normal[:n]))) if n else 0.0
+            return normal, stream, rms_db(stream) - rms_db(normal), diff, metadata["block_seconds"]
+
+        # Sem denoise, em blocos de ~1s: resample, RMS, bandpass e trim iguais ao caminho normal
+        normal, stream, delta_db, diff, block = compare(False, 2)
+        report(len(stream) == len(normal), f"sem denoise: trim {len(stream)} vs {len(normal)} samples")
+        report(abs(delta_db) < 0.01, f"sem denoise: RMS {delta_db:+.3f} dB em relação ao caminho normal")
+        report(diff < 1e-3, f"sem denoise: diferença máxima {diff:.1e} (blocos de {block:.1f}s)")
+
+        # Com denoise em um bloco só (orçamento folgado): mesma saída
+        normal, stream, delta_db, diff, block = compare(True, 4096)
+        report(len(stream) == len(normal) and diff < 1e-3,
+               f"com denoise, bloco único: diferença máxima {diff:.1e}, trim {len(stream)} vs {len(normal)}")
+
+        # Com denoise no orçamento padrão: o noisereduce não estacionário estima o ruído
+        # por bloco, então só volume e trim próximos (antes do ganho antecipado: +6.7 dB)
+        normal, stream, delta_db, diff, block = compare(True, 64)
+        report(abs(len(stream) - len(normal)) <= 2 * TRIM_HOP,
+               f"com denoise: trim {len(stream)} vs {len(normal)} samples (blocos de {block:.1f}s)")
+        report(abs(delta_db) < 3.0, f"com denoise: RMS {delta_db:+.2f} dB em relação ao caminho normal")
+
+    if failures:
+        print(f"❌ {failures} verificação(ões) falharam")
+        sys.exit(1)
+    print("✅ Streaming equivalente ao caminho normal")
@@ -0,0 +1,209 @@
+"""
+Detecção de voz (VAD) vetorizada em NumPy
+Energia por frame + planicidade espectral, calculadas para o sinal inteiro
+de uma vez. Substitui o webrtcvad (dependência nativa) e permite mandar só
+os trechos com voz para o encoder.
+
+Parâmetros de janela/suavização iguais aos do resemblyzer (trim_long_silences).
+"""
+
+import sys
+from typing import Tuple
+
+import numpy as np
+
+# Mesmos padrões do resemblyzer (hparams.vad_*)
+FRAME_MS = 30
+MOVING_AVERAGE_WIDTH = 8
+MAX_SILENCE_FRAMES = 6
+
+# Agressividade 0-3 (como no webrtcvad): margem acima do piso de ruído (dB)
+ENERGY_MARGIN_DB = (3.0, 6.0, 9.0, 12.0)
+# Limiar absoluto (dBFS) usado quando só há um frame (NumpyVad.is_speech)
+ABSOLUTE_THRESHOLD_DBFS = (-55.0, -50.0, -45.0, -40.0)
+
+# Planicidade espectral: ruído ~ 0.5-1, voz vozeada bem abaixo
+FLATNESS_THRESHOLD = 0.45
+# Frames bem acima do limiar contam como voz mesmo planos (fricativas)
+LOUD_MARGIN_DB = 10.0
+
+# Abaixo disto (segundos) de voz detectada, keep_voiced devolve o sinal inteiro
+MIN_VOICED_SECONDS = 0.5
+
+
+def frame_features(y: np.ndarray, sr: int, frame_ms: int = FRAME_MS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Energia (dBFS) e planicidade espectral de cada frame não sobreposto.
+
+    Returns:
+        Tuple (energy_db, flatness), ambos (n_frames,)
+    """
+    frame = max(1, sr * frame_ms // 1000)
+    n_frames = len(y) // frame
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+
+    frames = np.asarray(y[:n_frames * frame], dtype=np.float32).reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame).astype(np.float32), axis=1)) ** 2 + 1e-12
+    flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    return energy_db.astype(np.float32), flatness.astype(np.float32)
+
+
+def _moving_average(array: np.ndarray, width: int) -> np.ndarray:
+    # Igual ao moving_average do resemblyzer (janela centrada, zeros nas bordas)
+    padded = np.concatenate((np.zeros((width - 1) // 2), array, np.zeros(width // 2)))
+    ret = np.cumsum(padded, dtype=float)
+    ret[width:] = ret[width:] - ret[:-width]
+    return ret[width - 1:] / width
+
+
+def speech_frames(
+    y: np.ndarray,
+    sr: int,
+    aggressiveness: int = 2,
+    frame_ms: int = FRAME_MS,
+    flatness_threshold: float = FLATNESS_THRESHOLD
+) -> np.ndarray:
+    """
+    Marca os frames com voz no sinal inteiro (uma passada vetorizada).
+
+    O limiar de energia é adaptativo: piso de ruído (percentil 10) + margem,
+    nunca menos que 45 dB abaixo do pico. Ruído estacionário sem voz fica
+    todo perto do piso e não passa do limiar. Depois da decisão por frame,
+    a máscara é suavizada (média móvel) e dilatada, como no resemblyzer.
+
+    Args:
+        y: Áudio float mono
+        sr: Sample rate
+        aggressiveness: 0 (mais permissivo) a 3 (mais agressivo)
+        frame_ms: Tamanho do frame
+        flatness_threshold: Planicidade máxima de um frame de voz
+
+    Returns:
+        Máscara booleana (n_frames,)
+    """
+    energy_db, flatness = frame_features(y, sr, frame_ms)
+    if len(energy_db) == 0:
+        return np.zeros(0, dtype=bool)
+
+    floor = np.percentile(energy_db, 10)
+    peak = np.percentile(energy_db, 95)
+    threshold = max(floor + ENERGY_MARGIN_DB[aggressiveness], peak - 45.0)
+
+    voiced = (energy_db > threshold) & (
+        (flatness < flatness_threshold) | (energy_db > threshold + LOUD_MARGIN_DB)
+    )
+
+    mask = np.round(_moving_average(voiced, MOVING_AVERAGE_WIDTH)).astype(bool)
+    # Dilatação: mantém pausas curtas e as bordas das palavras
+    kernel = np.ones(2 * MAX_SILENCE_FRAMES + 1)
+    return np.convolve(mask, kernel, mode="same") > 0
+
+
+def speech_mask(y: np.ndarray, sr: int, aggressiveness: int = 2, frame_ms: int = FRAME_MS) -> np.ndarray:
+    """Máscara por amostra (len(y),); o resto final que não forma um frame fica como não-voz."""
+    frame = max(1, sr * frame_ms // 1000)
+    frames = speech_frames(y, sr, aggressiveness, frame_ms)
+    mask = np.zeros(len(y), dtype=bool)
+    mask[:len(frames) * frame] = np.repeat(frames, frame)
+    return mask
+
+
+def keep_voiced(
+    y: np.ndarray,
+    sr: int,
+    aggressiveness: int = 2,
+    min_voiced_seconds: float = MIN_VOICED_SECONDS
+) -> np.ndarray:
+    """
+    Retorna só os trechos com voz, concatenados (entrada para o encoder).
+
+    Se quase nada for detectado como voz (áudio muito curto, sinal atípico),
+    devolve o sinal original para não gerar um embedding vazio.
+    """
+    mask = speech_mask(y, sr, aggressiveness)
+    if mask.sum() < min_voiced_seconds * sr:
+        return y
+    return y[mask]
+
+
+class NumpyVad:
+    """
+    Substituto do webrtcvad.Vad com a mesma interface (is_speech sobre PCM 16-bit).
+
+    Decide frame a frame com limiar absoluto de energia + planicidade; para
+    o sinal inteiro prefira speech_frames/keep_voiced (limiar adaptativo).
+    """
+
+    def __init__(self, mode: int = 2):
+        self.set_mode(mode)
+
+    def set_mode(self, mode: int):
+        if mode not in (0, 1, 2, 3):
+            raise ValueError("mode deve ser 0, 1, 2 ou 3")
+        self.mode = mode
+
+    def is_speech(self, buf: bytes, sample_rate: int = 16000, length=None) -> bool:
+        frame = np.frombuffer(buf, dtype="<i2").astype(np.float32) / 32768.0
+        if len(frame) == 0:
+            return False
+        energy_db = 10 * np.log10(np.mean(frame ** 2) + 1e-10)
+        threshold = ABSOLUTE_THRESHOLD_DBFS[self.mode]
+        if energy_db <= threshold:
+            return False
+        if energy_db > threshold + LOUD_MARGIN_DB:
+            return True
+        power = np.abs(np.fft.rfft(frame * np.hanning(len(frame)))) ** 2 + 1e-12
+        flatness = np.exp(np.mean(np.log(power))) / np.mean(power)
+        return bool(flatness < FLATNESS_THRESHOLD)
+
+
+class _WebRTCVadModule:
+    """Módulo substituto registrado como `webrtcvad` quando o pacote nativo não existe."""
+    Vad = NumpyVad
+
+
+def install_webrtcvad_fallback() -> bool:
+    """
+    Registra NumpyVad como `webrtcvad` se o pacote nativo não estiver instalado
+    (precisa rodar antes de importar o resemblyzer).
+
+    Returns:
+        True se o substituto foi instalado
+    """
+    try:
+        import webrtcvad  # noqa: F401
+        return False
+    except ImportError:
+        sys.modules["webrtcvad"] = _WebRTCVadModule()
+        return True
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    import soundfile as sf
+
+    parser = argparse.ArgumentParser(description="Detecção de voz (VAD) em NumPy")
+    parser.add_argument("--input", required=True, help="Áudio de entrada")
+    parser.add_argument("--output", help="Grava só os trechos com voz neste arquivo")
+    parser.add_argument("--aggressiveness", type=int, default=2, choices=[0, 1, 2, 3],
+                        help="0 = mais permissivo, 3 = mais agressivo (padrão: 2)")
+    args = parser.parse_args()
+
+    y, sr = sf.read(args.input, dtype="float32", always_2d=True)
+    y = y.mean(axis=1)
+    mask = speech_mask(y, sr, args.aggressiveness)
+    voiced = keep_voiced(y, sr, args.aggressiveness)
+    if args.output:
+        sf.write(args.output, voiced, sr, subtype="PCM_16")
+
+    print(json.dumps({
+        "duration": len(y) / sr,
+        "voiced_duration": float(mask.sum()) / sr,
+        "voiced_ratio": float(mask.mean()) if len(mask) else 0.0,
+        "output": args.output,
+    }))
@@ -5,16 +5,26 @@ Valida se a voz gerada corresponde à referência usando similaridade coseno
 
 import numpy as np
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Sequence
 import json
 import logging
 import argparse
 
-from preprocess_and_embed import extract_embedding, load_embedding_json
+from preprocess_and_embed import extract_embedding
+from audio_io import STDIN, AudioSource, describe_source, is_data_url, load_audio, read_source, source_hash
+from embedding_format import load_embedding
+from encoder_backend import compatible_models
+from embedding_cache import EmbeddingCache, configure_default_cache, get_default_cache
+from instrumentation import StageProfiler, get_profiler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Abaixo disso a geração é rejeitada; entre isso e o threshold vai para revisão
+REJECT_THRESHOLD = 0.75
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".ogg", ".m4a"}
+
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     """
@@ -42,16 +52,22 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
 
 def validate(
     reference_emb_path: str,
-    generated_audio_path: str,
-    threshold: float = 0.82
+    generated_audio_path: AudioSource,
+    threshold: float = 0.82,
+    use_cache: bool = True,
+    cache: Optional[EmbeddingCache] = None,
+    profiler: Optional[StageProfiler] = None
 ) -> Dict:
     """
     Valida se a voz gerada corresponde à referência.
     
     Args:
-        reference_emb_path: Caminho do JSON com embedding de referência
-        generated_audio_path: Caminho do áudio gerado
+        reference_emb_path: Caminho do embedding de referência (JSON ou .emb)
+        generated_audio_path: Áudio gerado: caminho, "-" (stdin), data URL ou bytes
         threshold: Threshold de similaridade (padrão: 0.82)
+        use_cache: Reaproveitar embeddings já calculados (por hash do áudio)
+        cache: Cache a usar (padrão: cache compartilhado do processo)
+        profiler: Instrumentação por etapa (opt-in); as métricas vão em "stages"
     
     Returns:
         Dict com resultados:
@@ -59,39 +75,58 @@ def validate(
             - "ok": True se >= threshold
             - "threshold": threshold usado
             - "status": "ok", "review", ou "reject"
+            - "cache": nível do cache usado para gerado/referência
     """
     logger.info("Validando geracao")
     logger.info(f"   Referencia: {reference_emb_path}")
-    logger.info(f"   Gerado: {generated_audio_path}")
+    logger.info(f"   Gerado: {describe_source(generated_audio_path)}")
     logger.info(f"   Threshold: {threshold}")
     
     try:
+        # stdin/data URL viram bytes uma vez só (hash do cache e decodificação em memória)
+        generated_audio_path = read_source(generated_audio_path)
+        prof = get_profiler(profiler)
+        cache_info = {"generated": "disabled", "reference": "disabled"}
+        if use_cache:
+            cache = cache or get_default_cache()
+        
         # Carregar embedding de referência
-        ref_emb = load_embedding_json(reference_emb_path)
+        with prof.stage("load_reference"):
+            if use_cache:
+                ref_emb, cache_info["reference"] = cache.load_reference(reference_emb_path, compatible_models())
+            else:
+                ref_emb = load_embedding(reference_emb_path, expected_model=compatible_models())
         logger.info(f"   [OK] Embedding de referencia carregado: shape {ref_emb.shape}")
         
-        # Extrair embedding do áudio gerado
-        gen_emb = extract_embedding(generated_audio_path)
-        logger.info(f"   [OK] Embedding gerado extraido: shape {gen_emb.shape}")
+        # Extrair embedding do áudio gerado (encoder só roda em cache miss)
+        def compute(path):
+            return extract_embedding(path, profiler=prof)
+        
+        with prof.stage("embed_generated"):
+            if use_cache:
+                gen_emb, info = cache.get_or_compute(generated_audio_path, compute)
+                cache_info["generated"] = info["tier"]
+            else:
+                gen_emb = compute(generated_audio_path)
+        logger.info(f"   [OK] Embedding gerado extraido: shape {gen_emb.shape} (cache: {cache_info['generated']})")
         
         # Calcular similaridade
-        sim = cosine_similarity(ref_emb, gen_emb)
+        with prof.stage("similarity"):
+            sim = cosine_similarity(ref_emb, gen_emb)
         logger.info(f"   [INFO] Similaridade: {sim:.4f}")
         
         # Aplicar thresholds
-        ok = sim >= threshold
-        needs_review = 0.75 <= sim < threshold
-        should_reject = sim < 0.75
+        status = classify_similarity(sim, threshold)
+        ok = status == "ok"
+        needs_review = status == "review"
+        should_reject = status == "reject"
         
         if ok:
-            status = "ok"
             logger.info(f"   [OK] Validacao OK: {sim:.4f} >= {threshold}")
         elif needs_review:
-            status = "review"
             logger.warning(f"   [WARN] Precisa revisao: {sim:.4f} < {threshold}")
         else:
-            status = "reject"
-            logger.error(f"   [ERROR] Rejeitado: {sim:.4f} < 0.75")
+            logger.error(f"   [ERROR] Rejeitado: {sim:.4f} < {REJECT_THRESHOLD}")
         
         result = {
             "similarity": float(sim),
@@ -99,8 +134,11 @@ def validate(
             "threshold": threshold,
             "status": status,
             "needs_review": needs_review,
-            "should_reject": should_reject
+            "should_reject": should_reject,
+            "cache": cache_info
         }
+        if prof.enabled:
+            result["stages"] = prof.as_list()
         
         return result
         
@@ -115,9 +153,138 @@ def validate(
         }
 
 
+def classify_similarity(sim: float, threshold: float) -> str:
+    """Retorna "ok", "review" ou "reject" para uma similaridade."""
+    if sim >= threshold:
+        return "ok"
+    if sim >= REJECT_THRESHOLD:
+        return "review"
+    return "reject"
+
+
+def _expand_audio_paths(paths: Sequence[str]) -> List[str]:
+    """Expande diretórios para os arquivos de áudio contidos (ordem alfabética)."""
+    expanded = []
+    for path in paths:
+        if path == STDIN or is_data_url(path):
+            expanded.append(path)
+            continue
+        p = Path(path)
+        if p.is_dir():
+            expanded.extend(str(f) for f in sorted(p.iterdir())
+                            if f.is_file() and f.suffix.lower() in AUDIO_EXTENSIONS)
+        else:
+            expanded.append(str(p))
+    return expanded
+
+
+def validate_batch(
+    reference_emb_paths: Sequence[str],
+    generated_paths: Sequence[str],
+    threshold: float = 0.82,
+    batch_size: int = 32,
+    use_cache: bool = True,
+    cache: Optional[EmbeddingCache] = None
+) -> Dict:
+    """
+    Valida várias gerações (best-of-N) contra uma ou mais referências em uma chamada.
+    
+    Os áudios gerados são embedados juntos em lotes compartilhados do encoder e
+    a matriz de similaridade inteira é calculada com um produto de matrizes.
+    
+    Args:
+        reference_emb_paths: Embeddings de referência (JSON ou .emb)
+        generated_paths: Áudios gerados (caminhos, "-" ou data URLs) e/ou
+            diretórios com os áudios
+        threshold: Threshold de similaridade (padrão: 0.82)
+        batch_size: Janelas parciais por forward pass do encoder
+        use_cache: Reaproveitar embeddings já calculados (por hash do áudio)
+        cache: Cache a usar (padrão: cache compartilhado do processo)
+    
+    Returns:
+        Dict com "takes" ordenados do melhor para o pior, cada um com
+        "similarity" (média sobre as referências), "similarities" por
+        referência, "status" e "rank", além de "best" e "threshold".
+    """
+    from embedding_cache import cache_key
+    from preprocess_and_embed import embed_wavs_batch
+    
+    generated_paths = _expand_audio_paths(generated_paths)
+    logger.info(f"Validando {len(generated_paths)} geracoes contra {len(reference_emb_paths)} referencias")
+    if not generated_paths:
+        raise ValueError("Nenhum áudio gerado para validar")
+    if not reference_emb_paths:
+        raise ValueError("Nenhuma referência informada")
+    
+    if use_cache:
+        cache = cache or get_default_cache()
+        refs = np.array([cache.load_reference(p, compatible_models())[0] for p in reference_emb_paths],
+                        dtype=np.float32)
+    else:
+        refs = np.array([load_embedding(p, expected_model=compatible_models()) for p in reference_emb_paths],
+                        dtype=np.float32)
+    
+    # stdin/data URL viram bytes uma vez só: a chave do cache e o decode usam o mesmo conteúdo
+    sources = [read_source(p) for p in generated_paths]
+    
+    # Embeddings dos gerados: cache primeiro, encoder em lote só para os misses
+    gen = np.zeros((len(generated_paths), refs.shape[1]), dtype=np.float32)
+    tiers = ["disabled"] * len(generated_paths)
+    missing = list(range(len(generated_paths)))
+    keys = {}
+    if use_cache:
+        missing = []
+        for i, source in enumerate(sources):
+            keys[i] = cache_key(source_hash(source), cache.model)
+            emb, tiers[i] = cache.get(keys[i])
+            if emb is None:
+                missing.append(i)
+            else:
+                gen[i] = emb
+    
+    if missing:
+        # Resemblyzer requer 16kHz
+        wavs = [load_audio(sources[i], sr=16000)[0] for i in missing]
+        for i, emb in zip(missing, embed_wavs_batch(wavs, batch_size=batch_size)):
+            gen[i] = emb
+            if use_cache:
+                cache.put(keys[i], emb)
+    
+    # Matriz de similaridade coseno (gerados x referências)
+    refs_n = refs / np.maximum(np.linalg.norm(refs, axis=1, keepdims=True), 1e-12)
+    gen_n = gen / np.maximum(np.linalg.norm(gen, axis=1, keepdims=True), 1e-12)
+    sims = gen_n @ refs_n.T
+    scores = sims.mean(axis=1)
+    
+    takes = []
+    for rank, i in enumerate(np.argsort(-scores, kind="stable"), start=1):
+        sim = float(scores[i])
+        status = classify_similarity(sim, threshold)
+        takes.append({
+            "rank": rank,
+            "path": describe_source(generated_paths[i]),
+            "similarity": sim,
+            "similarities": [float(v) for v in sims[i]],
+            "ok": status == "ok",
+            "status": status,
+            "cache": tiers[i]
+        })
+    
+    best = takes[0]
+    logger.info(f"   [INFO] Melhor: {best['path']} ({best['similarity']:.4f}, {best['status']})")
+    return {
+        "threshold": threshold,
+        "references": list(reference_emb_paths),
+        "count": len(takes),
+        "best": best,
+        "takes": takes
+    }
+
+
 if __name__ == "__main__":
     import sys
     import io
+    from encoder_backend import add_backend_argument
     
     # 🚨 CRÍTICO: Configurar encoding UTF-8 para Windows
     # Isso evita erros de encoding com emojis
@@ -126,14 +293,44 @@ if __name__ == "__main__":
         sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
     
     parser = argparse.ArgumentParser(description="Valida geração de voz")
-    parser.add_argument("--reference", required=True, help="Caminho do JSON com embedding de referência")
-    parser.add_argument("--generated", required=True, help="Caminho do áudio gerado")
+    parser.add_argument("--reference", nargs='+', required=True, help="Caminho(s) do embedding de referência (JSON ou .emb)")
+    parser.add_argument("--generated", nargs='+', required=True,
+                        help='Caminho(s) do áudio gerado ou diretório com as gerações ("-" lê o áudio do stdin)')
+    parser.add_argument("--batch-size", type=int, default=32, help="Janelas parciais por forward pass no modo lote (padrão: 32)")
     parser.add_argument("--threshold", type=float, default=0.82, help="Threshold de similaridade (padrão: 0.82)")
+    parser.add_argument("--cache-dir", help="Diretório do cache de embeddings em disco (padrão: $EMBEDDING_CACHE_DIR)")
+    parser.add_argument("--no-cache", action="store_true", help="Não usar cache de embeddings")
+    parser.add_argument("--profile", action="store_true", help="Mede tempo/CPU/memória por etapa (vai no JSON)")
+    parser.add_argument("--metrics-out", help="Exporta as métricas por etapa (.prom = Prometheus, senão JSON lines)")
+    add_backend_argument(parser)
     
     args = parser.parse_args()
     
+    if args.encoder_backend:
+        from preprocess_and_embed import set_encoder_backend
+        set_encoder_backend(args.encoder_backend)
+    if args.cache_dir:
+        configure_default_cache(cache_dir=args.cache_dir)
+    
+    batch_mode = len(args.reference) > 1 or len(args.generated) > 1 or (
+        args.generated[0] != STDIN and not is_data_url(args.generated[0]) and Path(args.generated[0]).is_dir())
+    
     try:
-        result = validate(args.reference, args.generated, args.threshold)
+        if batch_mode:
+            result = validate_batch(args.reference, args.generated, args.threshold,
+                                    batch_size=args.batch_size, use_cache=not args.no_cache)
+            print(json.dumps(result))
+            sys.stdout.flush()
+            sys.exit(0)
+        
+        profiler = None
+        if args.profile or args.metrics_out:
+            profiler = StageProfiler(labels={"pipeline": "validate"})
+        
+        result = validate(args.reference[0], args.generated[0], args.threshold,
+                          use_cache=not args.no_cache, profiler=profiler)
+        if profiler and args.metrics_out:
+            profiler.export(args.metrics_out)
         
         # 🚨 CRÍTICO: Imprimir JSON primeiro (sem emojis) para garantir que seja capturado
         # O Node.js precisa do JSON mesmo se houver erro de encoding depois
@@ -0,0 +1,366 @@
+"""
+Embedding combinado incremental por clone de voz
+Guarda soma acumulada, contagem e pesos (duração/qualidade) de cada voz:
+adicionar ou remover uma amostra atualiza o embedding combinado em O(d),
+sem reler as outras amostras. O estado em disco não guarda os embeddings
+das amostras (só o peso e um digest de cada uma): para remover, quem chama
+informa o embedding (ou o arquivo) da amostra.
+
+update_aggregate trava o arquivo de estado durante a leitura/escrita:
+atualizações concorrentes da mesma voz (pool de workers) não se perdem.
+
+Os métodos "average" e "weighted_average" de combine_embeddings são
+visões sobre este agregado.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from embedding_format import DEFAULT_MODEL_ID, base64_to_embedding
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 2
+METHODS = ("average", "weighted_average")
+
+
+def _f64_to_base64(x: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(x, dtype="<f8").tobytes()).decode("utf-8")
+
+
+def _base64_to_f64(b64_str: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(b64_str), dtype="<f8").copy()
+
+
+def embedding_digest(embedding: np.ndarray) -> str:
+    """Digest curto do embedding (float32): confere se a remoção é da mesma amostra."""
+    vector = np.ascontiguousarray(embedding, dtype="<f4")
+    return hashlib.sha256(vector.tobytes()).hexdigest()[:16]
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = 30.0):
+    """
+    Trava exclusiva entre processos no arquivo <path>.lock (flock no POSIX,
+    msvcrt no Windows).
+
+    Raises:
+        TimeoutError: Trava não obtida em timeout segundos
+    """
+    lock_path = Path(f"{path}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as f:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if os.name == "nt":
+                    import msvcrt
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Trava não obtida: {lock_path}") from None
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def sample_weight(duration: Optional[float] = None, quality: Optional[float] = None) -> float:
+    """Peso de uma amostra: duração (s) x qualidade (0-1); ausentes valem 1."""
+    weight = (1.0 if duration is None else float(duration)) * (1.0 if quality is None else float(quality))
+    if not np.isfinite(weight) or weight <= 0:
+        raise ValueError(f"Peso inválido: duration={duration}, quality={quality}")
+    return weight
+
+
+class VoiceAggregate:
+    """
+    Agregado incremental dos embeddings de um clone.
+
+    Mantém em float64 a soma simples e a soma ponderada; de cada amostra
+    guarda só o peso e o digest do embedding (remove() recebe o embedding).
+
+    Args:
+        dim: Dimensão dos embeddings
+        model: Identificador do modelo que gerou os embeddings
+    """
+
+    def __init__(self, dim: int = 256, model: str = DEFAULT_MODEL_ID):
+        self.dim = dim
+        self.model = model
+        self._sum = np.zeros(dim, dtype=np.float64)
+        self._weighted_sum = np.zeros(dim, dtype=np.float64)
+        self._weight_total = 0.0
+        self._samples: Dict[str, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def __contains__(self, sample_id: str) -> bool:
+        return sample_id in self._samples
+
+    @property
+    def sample_ids(self) -> List[str]:
+        return list(self._samples)
+
+    @property
+    def weight_total(self) -> float:
+        return self._weight_total
+
+    def add(
+        self,
+        sample_id: str,
+        embedding: np.ndarray,
+        duration: Optional[float] = None,
+        quality: Optional[float] = None,
+    ):
+        """
+        Adiciona uma amostra (O(d)).
+
+        Args:
+            sample_id: Identificador da amostra (ex.: caminho ou id do áudio)
+            embedding: Embedding (dim,)
+            duration: Duração do áudio em segundos (peso opcional)
+            quality: Qualidade 0-1 (peso opcional, ex.: SNR normalizado)
+
+        Raises:
+            KeyError: Id já agregado (remova antes, com o embedding antigo)
+        """
+        if sample_id in self._samples:
+            raise KeyError(f"Amostra já agregada: {sample_id}")
+
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        weight = sample_weight(duration, quality)
+        self._sum += vector
+        self._weighted_sum += weight * vector.astype(np.float64)
+        self._weight_total += weight
+        self._samples[sample_id] = {"digest": embedding_digest(vector), "weight": weight,
+                                    "duration": duration, "quality": quality}
+
+    def remove(self, sample_id: str, embedding: np.ndarray):
+        """
+        Remove uma amostra (O(d)).
+
+        Args:
+            sample_id: Identificador da amostra
+            embedding: O mesmo embedding usado no add
+
+        Raises:
+            KeyError: Amostra não agregada
+            ValueError: Embedding diferente do que foi adicionado
+        """
+        sample = self._samples[sample_id]
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        if embedding_digest(vector) != sample["digest"]:
+            raise ValueError(f"Embedding diferente do agregado para a amostra: {sample_id}")
+        del self._samples[sample_id]
+        self._sum -= vector
+        self._weighted_sum -= sample["weight"] * vector.astype(np.float64)
+        self._weight_total -= sample["weight"]
+        if not self._samples:
+            # Zera o acumulado de arredondamento quando a voz fica vazia
+            self._sum[:] = 0
+            self._weighted_sum[:] = 0
+            self._weight_total = 0.0
+
+    def mean(self, method: str = "weighted_average") -> np.ndarray:
+        """Média (não normalizada) segundo o método."""
+        if not self._samples:
+            raise ValueError("Agregado vazio")
+        if method == "weighted_average":
+            return self._weighted_sum / self._weight_total
+        # "average" e métodos desconhecidos: média simples (como em combine_embeddings)
+        return self._sum / len(self._samples)
+
+    def combined(self, method: str = "weighted_average") -> np.ndarray:
+        """Embedding combinado normalizado (L2), float32."""
+        combined = self.mean(method)
+        norm = np.linalg.norm(combined)
+        if norm > 0:
+            combined = combined / norm
+        return combined.astype(np.float32)
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": STATE_VERSION,
+            "model": self.model,
+            "dim": self.dim,
+            "count": len(self._samples),
+            "weight_total": self._weight_total,
+            "sum_b64": _f64_to_base64(self._sum),
+            "weighted_sum_b64": _f64_to_base64(self._weighted_sum),
+            "samples": {
+                sample_id: {
+                    "digest": s["digest"],
+                    "weight": s["weight"],
+                    "duration": s["duration"],
+                    "quality": s["quality"],
+                }
+                for sample_id, s in self._samples.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "VoiceAggregate":
+        aggregate = cls(dim=data["dim"], model=data.get("model", DEFAULT_MODEL_ID))
+        aggregate._sum = _base64_to_f64(data["sum_b64"])
+        aggregate._weighted_sum = _base64_to_f64(data["weighted_sum_b64"])
+        aggregate._weight_total = float(data["weight_total"])
+        for sample_id, s in data.get("samples", {}).items():
+            # Estado da versão 1 trazia o embedding de cada amostra: vira digest
+            digest = s.get("digest") or embedding_digest(base64_to_embedding(s["embedding_b64"]))
+            aggregate._samples[sample_id] = {
+                "digest": digest,
+                "weight": float(s["weight"]),
+                "duration": s.get("duration"),
+                "quality": s.get("quality"),
+            }
+        return aggregate
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        embeddings: Sequence[np.ndarray],
+        sample_ids: Optional[Sequence[str]] = None,
+        weights: Optional[Sequence[float]] = None
+    ) -> "VoiceAggregate":
+        """Monta um agregado a partir de vários embeddings (ids padrão: "0", "1", ...)."""
+        embeddings = [np.asarray(e, dtype=np.float32).ravel() for e in embeddings]
+        if not embeddings:
+            raise ValueError("Nenhum embedding informado")
+        aggregate = cls(dim=len(embeddings[0]))
+        ids = sample_ids or [str(i) for i in range(len(embeddings))]
+        for i, (sample_id, emb) in enumerate(zip(ids, embeddings)):
+            aggregate.add(sample_id, emb, duration=None if weights is None else weights[i])
+        return aggregate
+
+    def save(self, path: str) -> str:
+        """Grava o estado em JSON (escrita atômica)."""
+        out = Path(path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, out)
+        return str(out)
+
+    @classmethod
+    def load(cls, path: str) -> "VoiceAggregate":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def load_or_create(cls, path: str, dim: int = 256) -> "VoiceAggregate":
+        return cls.load(path) if Path(path).exists() else cls(dim=dim)
+
+
+def _sample_embedding(sample: Dict) -> np.ndarray:
+    from embedding_format import load_embedding
+    return np.asarray(sample["embedding"] if "embedding" in sample else load_embedding(sample["path"]))
+
+
+def _sample_spec(sample: Union[str, Dict]) -> Dict:
+    # Remoção por string: o caminho do embedding, que também é o id
+    return {"id": sample, "path": sample} if isinstance(sample, str) else sample
+
+
+def update_aggregate(
+    state_path: str,
+    add: Iterable[Dict] = (),
+    remove: Iterable[Union[str, Dict]] = (),
+    method: str = "weighted_average"
+) -> Dict:
+    """
+    Atualiza o agregado salvo de um clone e retorna o embedding combinado.
+
+    O arquivo de estado fica travado durante a atualização. Um id já agregado
+    em add é substituído: informe também o embedding antigo em remove.
+
+    Args:
+        state_path: Arquivo de estado do agregado (criado se não existir)
+        add: Amostras {"id", "embedding" (lista) ou "path", "duration"?, "quality"?}
+        remove: Amostras a remover {"id", "embedding" ou "path"} (ou só o
+            caminho do embedding, usado também como id)
+        method: "average" ou "weighted_average"
+
+    Returns:
+        Dict com embedding combinado, shape, method, count e sample_ids
+    """
+    with file_lock(state_path):
+        aggregate = VoiceAggregate.load_or_create(state_path)
+        for sample in map(_sample_spec, remove):
+            sample_id = sample.get("id") or sample.get("path")
+            if sample_id in aggregate:
+                aggregate.remove(sample_id, _sample_embedding(sample))
+        for sample in add:
+            sample_id = sample.get("id") or sample.get("path")
+            aggregate.add(sample_id, _sample_embedding(sample), duration=sample.get("duration"),
+                          quality=sample.get("quality"))
+        aggregate.save(state_path)
+
+    result = {"count": len(aggregate), "method": method, "sample_ids": aggregate.sample_ids}
+    if len(aggregate):
+        combined = aggregate.combined(method)
+        result.update({"embedding": combined.tolist(), "shape": list(combined.shape)})
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from embedding_format import save_embedding
+
+    parser = argparse.ArgumentParser(description="Agregado incremental de embeddings por clone")
+    parser.add_argument("--state", required=True, help="Arquivo de estado do agregado do clone")
+    parser.add_argument("--add", nargs='+', default=[], metavar="ID=ARQUIVO[:DURACAO]",
+                        help="Adiciona amostras (embedding JSON ou .emb; duração opcional como peso)")
+    parser.add_argument("--remove", nargs='+', default=[], metavar="[ID=]ARQUIVO",
+                        help="Remove amostras (o embedding da amostra é necessário para subtraí-la)")
+    parser.add_argument("--method", default="weighted_average", choices=METHODS, help="Método de combinação")
+    parser.add_argument("--output", help="Salva o embedding combinado (JSON ou .emb pela extensão)")
+    args = parser.parse_args()
+
+    samples = []
+    for item in args.add:
+        sample_id, spec = item.split("=", 1)
+        path, duration = spec, None
+        head, sep, tail = spec.rpartition(":")
+        if sep:
+            try:
+                path, duration = head, float(tail)
+            except ValueError:
+                pass  # ":" faz parte do caminho (ex.: C:\...)
+        samples.append({"id": sample_id, "path": path, "duration": duration})
+
+    removed = []
+    for item in args.remove:
+        sample_id, sep, path = item.partition("=")
+        removed.append({"id": sample_id, "path": path} if sep else item)
+
+    result = update_aggregate(args.state, samples, removed, args.method)
+    if args.output and "embedding" in result:
+        save_embedding(np.asarray(result["embedding"], dtype=np.float32), args.output,
+                       method=args.method, count=result["count"])
+    print(json.dumps(result))
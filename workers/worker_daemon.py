@@ -0,0 +1,646 @@
+"""
+Worker Python persistente do pipeline profissional
+Carrega o VoiceEncoder uma única vez e atende requisições sem cold start
+
+Protocolo JSON-lines (uma requisição por linha, via stdin/stdout ou socket TCP local):
+    -> {"id": "1", "op": "extract_embedding", "params": {"wav_path": "x.wav", "out_embedding": "x.emb"}}
+    <- {"id": "1", "ok": true, "result": {...}, "elapsed_ms": 35.2}
+
+Áudio pode vir como caminho ou, sem arquivo temporário, em "audio" (data URL ou
+base64); "return_audio" devolve o áudio resultante como data URL.
+"noise_profile" (id do clone/sessão) troca o denoise não estacionário pelo
+gate estacionário com o perfil de ruído salvo (NOISE_PROFILE_DIR).
+"stage_cache": true em preprocess_audio guarda a saída de cada etapa do
+pipeline (STAGE_CACHE_DIR para também guardar em disco).
+O backend do encoder (torch, torchscript, onnx, com ":int8" opcional) vem de
+--encoder-backend/ENCODER_BACKEND ou da operação configure_encoder.
+
+Operações:
+    ping, health, preprocess_audio, preprocess_and_embed, extract_embedding,
+    extract_embeddings_batch, validate, validate_batch, validate_stream_start,
+    validate_stream_push, validate_stream_finish, combine_embeddings, update_voice_aggregate,
+    encode_audio, configure_encoder, shutdown
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+# stdout é reservado para o protocolo: qualquer print das bibliotecas
+# (ex.: "Loaded the voice encoder model...") vai para stderr
+_protocol_out = sys.stdout
+sys.stdout = sys.stderr
+
+logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+logger = logging.getLogger(__name__)
+
+# Código de saída usado para pedir reinício ao supervisor (EX_TEMPFAIL)
+RESTART_EXIT_CODE = 75
+
+
+class WorkerState:
+    """Estado do worker exposto pelo health check."""
+
+    def __init__(self, max_requests: int = 0):
+        self.started_at = time.time()
+        self.max_requests = max_requests
+        self.requests = 0
+        self.errors = 0
+        self.busy = False
+        self.stopping = False
+        self.restart_requested = False
+
+    def health(self) -> Dict:
+        info = {
+            "status": "stopping" if self.stopping else "ok",
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "max_requests": self.max_requests,
+            "encoder_loaded": _encoder_loaded(),
+            "encoder_backend": _encoder_backend(),
+        }
+        try:
+            import resource
+            info["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            pass  # Windows não possui o módulo resource
+        from encoder_pool import process_memory
+        memory = process_memory()
+        for key in ("rss", "pss", "shared"):
+            if key in memory:
+                info[f"{key}_kb"] = memory[key]
+        return info
+
+
+state = WorkerState()
+
+
+def _op_ping(params: Dict) -> Dict:
+    return {"pong": True}
+
+
+def _op_health(params: Dict) -> Dict:
+    return state.health()
+
+
+def _profiler(params: Dict, pipeline: str):
+    """Profiler por etapa quando a requisição pede "profile": true."""
+    if not params.get("profile"):
+        return None
+    from instrumentation import StageProfiler
+    return StageProfiler(labels={"pipeline": pipeline})
+
+
+def _store(params: Dict):
+    """
+    Armazenamento de artefatos: "store" na requisição (diretório) ou
+    ARTIFACT_STORE_DIR; "store": false desativa.
+    """
+    from artifact_store import configure_default_store, get_default_store
+    root = params.get("store")
+    if root is False:
+        return None
+    store = get_default_store()
+    if root and (store is None or str(store.root) != str(Path(root))):
+        store = configure_default_store(root)
+    return store
+
+
+def _stage_cache(params: Dict):
+    """
+    Cache das saídas de etapa do pipeline ("stage_cache": true), mantido entre
+    requisições: mudar só um parâmetro final (ex.: top_db) não refaz o início.
+    """
+    if not params.get("stage_cache"):
+        return None
+    from pipeline import get_default_cache
+    return get_default_cache()
+
+
+def _op_preprocess_audio(params: Dict) -> Dict:
+    """Pré-processa áudio (pipeline "embed" por padrão, ou "studio")."""
+    pipeline = params.get("pipeline", "embed")
+    in_path = params["in_path"]
+    out_path = params.get("out_path") or Path(in_path).with_suffix(".proc.wav").as_posix()
+    target_sr = int(params.get("target_sr", 24000))
+    profiler = _profiler(params, pipeline)
+    stage_cache = _stage_cache(params)
+
+    if pipeline == "studio":
+        from audio_preprocessor import preprocess_audio
+        options = {k: v for k, v in params.items()
+                   if k not in ("pipeline", "in_path", "out_path", "target_sr", "profile", "stage_cache")}
+        out, metadata = preprocess_audio(in_path, out_path, target_sr=target_sr,
+                                         profiler=profiler, stage_cache=stage_cache, **options)
+        return {"out_path": out, "metadata": metadata}
+
+    from preprocess_and_embed import preprocess_audio
+    result = {"out_path": preprocess_audio(in_path, out_path, target_sr=target_sr, profiler=profiler,
+                                           stage_cache=stage_cache)}
+    if profiler:
+        result["stages"] = profiler.as_list()
+    return result
+
+
+def _audio_source(params: Dict, path_key: str):
+    """
+    Áudio da requisição: caminho em params[path_key] ou o conteúdo em
+    params["audio"] (data URL ou base64), decodificado em memória.
+    """
+    if params.get("audio"):
+        from audio_io import decode_param
+        return decode_param(params["audio"])
+    return params[path_key]
+
+
+def _audio_format(params: Dict) -> Optional[str]:
+    """"return_audio": true (WAV) ou o formato desejado ("flac", "mp3", "opus")."""
+    value = params.get("return_audio")
+    if not value:
+        return None
+    return "wav" if value is True else value
+
+
+def _op_preprocess_and_embed(params: Dict) -> Dict:
+    from embedding_format import save_embedding
+    from encoder_backend import model_id
+    from preprocess_and_embed import embed_source
+
+    profiler = _profiler(params, "embed")
+    result = embed_source(
+        _audio_source(params, "in_path"), params.get("out_path"),
+        target_sr=int(params.get("target_sr", 24000)), profiler=profiler,
+        store=_store(params), audio_format=_audio_format(params),
+        noise_profile=params.get("noise_profile")
+    )
+    out_embedding = params.get("out_embedding")
+    if out_embedding:
+        import numpy as np
+        save_embedding(np.asarray(result["embedding"], dtype=np.float32), out_embedding, model=model_id())
+    result["out_embedding"] = out_embedding
+    if profiler:
+        result["stages"] = profiler.as_list()
+    return result
+
+
+def _op_extract_embedding(params: Dict) -> Dict:
+    from embedding_format import save_embedding
+    from encoder_backend import model_id
+    from preprocess_and_embed import extract_embedding
+
+    emb = extract_embedding(_audio_source(params, "wav_path"))
+    out_embedding = params.get("out_embedding")
+    if out_embedding:
+        save_embedding(emb, out_embedding, model=model_id())
+    return {"embedding": emb.tolist(), "shape": list(emb.shape), "out_embedding": out_embedding}
+
+
+def _op_extract_embeddings_batch(params: Dict) -> Dict:
+    from preprocess_and_embed import extract_embeddings_batch
+
+    embeddings, combined = extract_embeddings_batch(
+        params["wav_paths"], batch_size=int(params.get("batch_size", 32))
+    )
+    return {
+        "embeddings": [emb.tolist() for emb in embeddings],
+        "combined_embedding": combined.tolist(),
+        "count": len(embeddings),
+    }
+
+
+def _op_validate(params: Dict) -> Dict:
+    from validate_generation import validate
+
+    return validate(
+        params["reference"],
+        _audio_source(params, "generated"),
+        float(params.get("threshold", 0.82)),
+        use_cache=bool(params.get("use_cache", True)),
+        profiler=_profiler(params, "validate"),
+    )
+
+
+def _op_validate_batch(params: Dict) -> Dict:
+    from validate_generation import validate_batch
+
+    references = params["references"]
+    generated = params["generated"]
+    return validate_batch(
+        [references] if isinstance(references, str) else references,
+        [generated] if isinstance(generated, str) else generated,
+        float(params.get("threshold", 0.82)),
+        batch_size=int(params.get("batch_size", 32)),
+        use_cache=bool(params.get("use_cache", True)),
+    )
+
+
+# Sessões de validação em streaming (uma por geração em andamento):
+# session -> (StreamingValidator, formato do PCM)
+_stream_sessions: Dict[str, tuple] = {}
+_stream_touched: Dict[str, float] = {}
+STREAM_SESSION_TTL = 300.0
+
+
+def _expire_stream_sessions():
+    now = time.time()
+    for session in [k for k, t in _stream_touched.items() if now - t > STREAM_SESSION_TTL]:
+        _stream_sessions.pop(session, None)
+        _stream_touched.pop(session, None)
+
+
+def _stream_session(params: Dict):
+    session = params["session"]
+    if session not in _stream_sessions:
+        raise ValueError(f"Sessão de validação desconhecida ou expirada: {session}")
+    _stream_touched[session] = time.time()
+    return session, _stream_sessions[session]
+
+
+def _op_validate_stream_start(params: Dict) -> Dict:
+    """
+    Abre uma validação em streaming. Os blocos chegam em validate_stream_push
+    como PCM mono ("pcm": base64, formato "pcm_format" s16le/f32le em "sample_rate").
+    """
+    import uuid
+    from streaming_validation import StreamingValidator
+
+    _expire_stream_sessions()
+    validator = StreamingValidator(
+        params["reference"],
+        float(params.get("threshold", 0.82)),
+        sample_rate=int(params.get("sample_rate", 16000)),
+        confidence=float(params.get("confidence", 0.95)),
+        min_partials=int(params.get("min_partials", 3)),
+        early_stop=bool(params.get("early_stop", True)),
+    )
+    session = params.get("session") or uuid.uuid4().hex
+    _stream_sessions[session] = (validator, params.get("pcm_format", "s16le"))
+    _stream_touched[session] = time.time()
+    return {"session": session}
+
+
+def _op_validate_stream_push(params: Dict) -> Dict:
+    """Adiciona um bloco; "decided": true indica que a geração já pode ser cortada."""
+    from audio_io import decode_param
+    from streaming_validation import decode_pcm
+
+    session, (validator, pcm_format) = _stream_session(params)
+    result = validator.push(decode_pcm(decode_param(params["pcm"]), pcm_format))
+    result["session"] = session
+    return result
+
+
+def _op_validate_stream_finish(params: Dict) -> Dict:
+    """Encerra a sessão e devolve o resultado no formato do validate."""
+    session, (validator, _) = _stream_session(params)
+    _stream_sessions.pop(session, None)
+    _stream_touched.pop(session, None)
+    return validator.finish()
+
+
+def _op_combine_embeddings(params: Dict) -> Dict:
+    from combine_embeddings import combine_embeddings
+
+    method = params.get("method", "weighted_average")
+    combined = combine_embeddings(params["embeddings"], method)
+    output_data = {
+        "embedding": combined.tolist(),
+        "shape": list(combined.shape),
+        "method": method,
+        "count": len(params["embeddings"]),
+    }
+    output = params.get("output")
+    if output:
+        from embedding_format import save_embedding
+        from encoder_backend import model_id
+        save_embedding(combined, output, model=model_id(), method=method, count=len(params["embeddings"]))
+    return output_data
+
+
+def _op_update_voice_aggregate(params: Dict) -> Dict:
+    """
+    Adiciona/remove amostras do agregado salvo de um clone (O(d) por amostra).
+    "remove" recebe {"id", "embedding" ou "path"} de cada amostra: o estado
+    salvo não guarda os embeddings.
+    """
+    from voice_aggregate import update_aggregate
+
+    result = update_aggregate(
+        params["state"],
+        add=params.get("add", []),
+        remove=params.get("remove", []),
+        method=params.get("method", "weighted_average"),
+    )
+    output = params.get("output")
+    if output and "embedding" in result:
+        import numpy as np
+        from embedding_format import save_embedding
+        from encoder_backend import model_id
+        save_embedding(np.asarray(result["embedding"], dtype=np.float32), output, model=model_id(),
+                       method=result["method"], count=result["count"])
+    return result
+
+
+def _op_encode_audio(params: Dict) -> Dict:
+    """
+    Codifica um áudio para várias saídas (MP3/Opus/FLAC) em uma passada do ffmpeg.
+    Com "return_audio": "mp3"/"opus"/"flac" o resultado volta como data URL em
+    "audio", sem arquivo de saída.
+    """
+    from audio_encoder import encode_array, encode_file
+
+    source = _audio_source(params, "in_path")
+    audio_format = _audio_format(params)
+    if isinstance(source, str) and not audio_format:
+        return {"outputs": encode_file(source, params["outputs"])}
+
+    from audio_io import audio_payload, decode_audio, read_source
+    source = read_source(source)
+    if isinstance(source, bytes):
+        y, sr = decode_audio(source, mono=False)
+    else:
+        import soundfile as sf
+        y, sr = sf.read(source, dtype="float32", always_2d=True)
+    result = {"outputs": encode_array(y, sr, params["outputs"]) if params.get("outputs") else []}
+    if audio_format:
+        result["audio"] = audio_payload(y, sr, audio_format)
+    return result
+
+
+def _op_configure_encoder(params: Dict) -> Dict:
+    """
+    Troca o backend do encoder ("backend": "onnx", "torchscript:int8", ...);
+    "warmup": false adia o carregamento (e a exportação) para o primeiro uso.
+    """
+    import preprocess_and_embed
+    from encoder_backend import get_backend, model_id
+
+    previous = get_backend()
+    spec = preprocess_and_embed.set_encoder_backend(params.get("backend"))
+    if params.get("warmup", True):
+        try:
+            warm_up()
+        except Exception:
+            preprocess_and_embed.set_encoder_backend(previous)  # ex.: int8 fora da tolerância
+            raise
+    return {"encoder_backend": spec, "model": model_id(), "encoder_loaded": _encoder_loaded()}
+
+
+def _op_shutdown(params: Dict) -> Dict:
+    state.stopping = True
+    return {"stopping": True}
+
+
+OPERATIONS: Dict[str, Callable[[Dict], Dict]] = {
+    "ping": _op_ping,
+    "health": _op_health,
+    "preprocess_audio": _op_preprocess_audio,
+    "preprocess_and_embed": _op_preprocess_and_embed,
+    "extract_embedding": _op_extract_embedding,
+    "extract_embeddings_batch": _op_extract_embeddings_batch,
+    "validate": _op_validate,
+    "validate_batch": _op_validate_batch,
+    "validate_stream_start": _op_validate_stream_start,
+    "validate_stream_push": _op_validate_stream_push,
+    "validate_stream_finish": _op_validate_stream_finish,
+    "combine_embeddings": _op_combine_embeddings,
+    "update_voice_aggregate": _op_update_voice_aggregate,
+    "encode_audio": _op_encode_audio,
+    "configure_encoder": _op_configure_encoder,
+    "shutdown": _op_shutdown,
+}
+
+
+def handle_request(request: Dict) -> Dict:
+    """
+    Executa uma requisição do protocolo e monta a resposta.
+
+    Nunca levanta exceção: erros são devolvidos com "ok": false.
+    """
+    request_id = request.get("id")
+    op = request.get("op")
+    start = time.perf_counter()
+
+    handler = OPERATIONS.get(op)
+    if handler is None:
+        return {"id": request_id, "ok": False, "error": f"Operação desconhecida: {op}"}
+
+    state.busy = True
+    try:
+        result = handler(request.get("params") or {})
+        response = {"id": request_id, "ok": True, "result": result}
+    except Exception as e:
+        state.errors += 1
+        logger.error(f"   ❌ Erro em {op}: {e}")
+        response = {"id": request_id, "ok": False, "error": str(e)}
+    finally:
+        state.busy = False
+
+    if op not in ("ping", "health"):
+        state.requests += 1
+        if state.max_requests and state.requests >= state.max_requests:
+            logger.info(f"🔄 Limite de {state.max_requests} requisições atingido, reiniciando")
+            state.stopping = True
+            state.restart_requested = True
+
+    response["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    if state.stopping:
+        response["restarting" if state.restart_requested else "stopping"] = True
+    return response
+
+
+def handle_line(line: str) -> Optional[Dict]:
+    """Decodifica uma linha JSON e executa a requisição (None para linha vazia)."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"id": None, "ok": False, "error": f"JSON inválido: {e}"}
+    if not isinstance(request, dict):
+        return {"id": None, "ok": False, "error": "Requisição deve ser um objeto JSON"}
+    return handle_request(request)
+
+
+def _encoder_loaded() -> bool:
+    module = sys.modules.get("preprocess_and_embed")
+    return bool(module and module.is_encoder_loaded())
+
+
+def _encoder_backend() -> str:
+    from encoder_backend import get_backend
+    return get_backend()
+
+
+def warm_up():
+    """Importa a pilha de ML e executa uma inferência curta para aquecer o encoder."""
+    import preprocess_and_embed
+
+    start = time.perf_counter()
+    preprocess_and_embed.warm_up()
+    logger.info(f"🔥 Encoder aquecido em {time.perf_counter() - start:.2f}s")
+
+
+def _install_signal_handlers():
+    """SIGTERM/SIGINT: termina a requisição em andamento e encerra limpo."""
+
+    def _handler(signum, frame):
+        state.stopping = True
+        if not state.busy:
+            raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _handler)
+    signal.signal(signal.SIGINT, _handler)
+
+
+def _exit_code() -> int:
+    return RESTART_EXIT_CODE if state.restart_requested else 0
+
+
+def serve_stdio() -> int:
+    """Atende requisições JSON-lines via stdin/stdout."""
+    logger.info(f"🚀 Worker pronto (stdio, pid {os.getpid()})")
+    for line in sys.stdin:
+        response = handle_line(line)
+        if response is None:
+            continue
+        _protocol_out.write(json.dumps(response) + "\n")
+        _protocol_out.flush()
+        if state.stopping:
+            break
+    return _exit_code()
+
+
+def serve_tcp(host: str, port: int) -> int:
+    """Atende requisições JSON-lines via socket TCP local (uma por vez)."""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                response = handle_line(raw.decode("utf-8"))
+                if response is None:
+                    continue
+                self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                if state.stopping:
+                    break
+
+    socketserver.TCPServer.allow_reuse_address = True
+    with socketserver.TCPServer((host, port), Handler) as server:
+        server.timeout = 0.5
+        logger.info(f"🚀 Worker pronto em {host}:{port} (pid {os.getpid()})")
+        while not state.stopping:
+            server.handle_request()
+    return _exit_code()
+
+
+def supervise(child_args: list) -> int:
+    """
+    Mantém um worker filho vivo, reiniciando-o quando pede reinício
+    (max-requests) ou quando cai. No modo stdio, repassa as linhas uma a uma,
+    então nenhuma requisição se perde durante o reinício.
+    """
+    command = [sys.executable, os.path.abspath(__file__)] + child_args
+    stdio = "--port" not in child_args
+    backoff = 0.5
+    child = None
+
+    def spawn():
+        logger.info("🔁 Iniciando worker filho")
+        if stdio:
+            return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                    text=True, encoding="utf-8", bufsize=1)
+        return subprocess.Popen(command)
+
+    try:
+        if not stdio:
+            while True:
+                child = spawn()
+                code = child.wait()
+                if code == 0:
+                    return 0
+                if code != RESTART_EXIT_CODE:
+                    logger.warning(f"   ⚠️ Worker saiu com código {code}, reiniciando em {backoff:.1f}s")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                else:
+                    backoff = 0.5
+
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            if child is None or child.poll() is not None:
+                child = spawn()
+            child.stdin.write(line if line.endswith("\n") else line + "\n")
+            child.stdin.flush()
+            response = child.stdout.readline()
+            if not response:
+                code = child.wait()
+                logger.warning(f"   ⚠️ Worker caiu durante a requisição (código {code})")
+                try:
+                    request_id = json.loads(line).get("id")
+                except (json.JSONDecodeError, AttributeError):
+                    request_id = None
+                response = json.dumps({"id": request_id, "ok": False,
+                                       "error": f"Worker encerrado (código {code})"}) + "\n"
+                child = None
+            _protocol_out.write(response)
+            _protocol_out.flush()
+            if child is not None:
+                flags = json.loads(response)
+                if flags.get("stopping"):
+                    child.wait()
+                    return 0
+                if flags.get("restarting"):
+                    child.wait()
+                    child = None
+        return 0
+    finally:
+        if child is not None and child.poll() is None:
+            if child.stdin:
+                child.stdin.close()
+            child.terminate()
+            child.wait()
+
+
+if __name__ == "__main__":
+    from encoder_backend import add_backend_argument
+
+    parser = argparse.ArgumentParser(description="Worker persistente do pipeline de voz")
+    parser.add_argument("--port", type=int, help="Porta TCP local (padrão: stdin/stdout)")
+    parser.add_argument("--host", default="127.0.0.1", help="Host do socket (padrão: 127.0.0.1)")
+    parser.add_argument("--max-requests", type=int, default=0,
+                        help="Reinicia o worker após N requisições (0 = sem limite)")
+    parser.add_argument("--no-warmup", action="store_true", help="Não aquecer o encoder na inicialização")
+    parser.add_argument("--supervise", action="store_true",
+                        help="Executa um supervisor que reinicia o worker quando necessário")
+    add_backend_argument(parser)
+    args = parser.parse_args()
+
+    if args.supervise:
+        child_args = [a for a in sys.argv[1:] if a != "--supervise"]
+        sys.exit(supervise(child_args))
+
+    state.max_requests = args.max_requests
+    _install_signal_handlers()
+    if args.encoder_backend:
+        from preprocess_and_embed import set_encoder_backend
+        set_encoder_backend(args.encoder_backend)
+
+    if not args.no_warmup:
+        warm_up()
+
+    if args.port:
+        sys.exit(serve_tcp(args.host, args.port))
+    sys.exit(serve_stdio())